@@ -0,0 +1,152 @@
+-- ============================================
+-- VSM Backend Migration: 后台统计汇总表
+-- Date: 2026-10-18
+-- 目的: /api/admin/stats 与 /api/stats 不再每次对 restaurants/users/reports 做 COUNT(*) / GROUP BY
+--       触发器在每次写入 (包括 Adminer 直接修改) 时增量更新汇总表,
+--       main.py 每 10 秒读取一次汇总表, 每 10 分钟按明细核对并修正偏差 (外键级联删除不会触发触发器)
+-- 需在部署新版 main.py 之前执行 (未执行时 main.py 退回按明细统计); 可重复执行 (回填会按明细重新计算)
+-- ============================================
+
+-- 1. 汇总表
+-- 餐厅按 (状态, 国家, 州属, 素食类型, 认证状态, 类别) 计数, 各维度的分布都由这张小表求和得到
+-- 由下面的回填整表重建, 先删除旧表 (结构可能是旧版本)
+DROP TRIGGER IF EXISTS trg_restaurants_stats_ins;
+DROP TRIGGER IF EXISTS trg_restaurants_stats_upd;
+DROP TRIGGER IF EXISTS trg_restaurants_stats_del;
+DROP TABLE IF EXISTS restaurant_stat_counts;
+CREATE TABLE restaurant_stat_counts (
+  status VARCHAR(20) NOT NULL DEFAULT '',
+  country VARCHAR(10) NOT NULL DEFAULT '',
+  state_id INT NOT NULL DEFAULT 0,              -- 0: 未关联州属
+  state VARCHAR(100) NOT NULL DEFAULT '',       -- 餐厅自身的州属名称, state_id 未关联时用于归类
+  vegetarian_type VARCHAR(20) NOT NULL DEFAULT '',
+  verification_status VARCHAR(20) NOT NULL DEFAULT '',
+  category VARCHAR(20) NOT NULL DEFAULT '',
+  cnt INT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (status, country, state_id, state, vegetarian_type, verification_status, category)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- 单值计数: users (用户总数), reports_pending (待处理报错), feedback (用户反馈总数)
+CREATE TABLE IF NOT EXISTS stat_counters (
+  name VARCHAR(50) PRIMARY KEY,
+  cnt INT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- 2. 触发器 (restaurants 的触发器已在上面删除)
+DROP TRIGGER IF EXISTS trg_users_stats_ins;
+DROP TRIGGER IF EXISTS trg_users_stats_del;
+DROP TRIGGER IF EXISTS trg_reports_stats_ins;
+DROP TRIGGER IF EXISTS trg_reports_stats_upd;
+DROP TRIGGER IF EXISTS trg_reports_stats_del;
+DROP TRIGGER IF EXISTS trg_feedback_stats_ins;
+DROP TRIGGER IF EXISTS trg_feedback_stats_del;
+
+DELIMITER //
+CREATE TRIGGER trg_restaurants_stats_ins AFTER INSERT ON restaurants
+FOR EACH ROW
+BEGIN
+  INSERT INTO restaurant_stat_counts (status, country, state_id, state, vegetarian_type, verification_status, category, cnt)
+  VALUES (COALESCE(NEW.status, ''), COALESCE(NEW.country, ''), COALESCE(NEW.state_id, 0), COALESCE(NEW.state, ''),
+          COALESCE(NEW.vegetarian_type, ''), COALESCE(NEW.verification_status, ''), COALESCE(NEW.category, ''), 1)
+  ON DUPLICATE KEY UPDATE cnt = cnt + 1;
+END//
+
+CREATE TRIGGER trg_restaurants_stats_upd AFTER UPDATE ON restaurants
+FOR EACH ROW
+BEGIN
+  IF NOT (NEW.status <=> OLD.status) OR NOT (NEW.country <=> OLD.country) OR NOT (NEW.state_id <=> OLD.state_id) OR NOT (NEW.state <=> OLD.state)
+     OR NOT (NEW.vegetarian_type <=> OLD.vegetarian_type) OR NOT (NEW.verification_status <=> OLD.verification_status)
+     OR NOT (NEW.category <=> OLD.category) THEN
+    UPDATE restaurant_stat_counts SET cnt = cnt - 1
+    WHERE status = COALESCE(OLD.status, '') AND country = COALESCE(OLD.country, '') AND state_id = COALESCE(OLD.state_id, 0) AND state = COALESCE(OLD.state, '')
+      AND vegetarian_type = COALESCE(OLD.vegetarian_type, '') AND verification_status = COALESCE(OLD.verification_status, '')
+      AND category = COALESCE(OLD.category, '');
+    INSERT INTO restaurant_stat_counts (status, country, state_id, state, vegetarian_type, verification_status, category, cnt)
+    VALUES (COALESCE(NEW.status, ''), COALESCE(NEW.country, ''), COALESCE(NEW.state_id, 0), COALESCE(NEW.state, ''),
+            COALESCE(NEW.vegetarian_type, ''), COALESCE(NEW.verification_status, ''), COALESCE(NEW.category, ''), 1)
+    ON DUPLICATE KEY UPDATE cnt = cnt + 1;
+  END IF;
+END//
+
+CREATE TRIGGER trg_restaurants_stats_del AFTER DELETE ON restaurants
+FOR EACH ROW
+BEGIN
+  UPDATE restaurant_stat_counts SET cnt = cnt - 1
+  WHERE status = COALESCE(OLD.status, '') AND country = COALESCE(OLD.country, '') AND state_id = COALESCE(OLD.state_id, 0) AND state = COALESCE(OLD.state, '')
+    AND vegetarian_type = COALESCE(OLD.vegetarian_type, '') AND verification_status = COALESCE(OLD.verification_status, '')
+    AND category = COALESCE(OLD.category, '');
+END//
+
+CREATE TRIGGER trg_users_stats_ins AFTER INSERT ON users
+FOR EACH ROW
+BEGIN
+  INSERT INTO stat_counters (name, cnt) VALUES ('users', 1) ON DUPLICATE KEY UPDATE cnt = cnt + 1;
+END//
+
+CREATE TRIGGER trg_users_stats_del AFTER DELETE ON users
+FOR EACH ROW
+BEGIN
+  UPDATE stat_counters SET cnt = cnt - 1 WHERE name = 'users';
+END//
+
+CREATE TRIGGER trg_reports_stats_ins AFTER INSERT ON reports
+FOR EACH ROW
+BEGIN
+  IF NEW.status = 'pending' THEN
+    INSERT INTO stat_counters (name, cnt) VALUES ('reports_pending', 1) ON DUPLICATE KEY UPDATE cnt = cnt + 1;
+  END IF;
+END//
+
+CREATE TRIGGER trg_reports_stats_upd AFTER UPDATE ON reports
+FOR EACH ROW
+BEGIN
+  IF NOT (NEW.status <=> OLD.status) THEN
+    INSERT INTO stat_counters (name, cnt) VALUES ('reports_pending', (NEW.status <=> 'pending') - (OLD.status <=> 'pending'))
+    ON DUPLICATE KEY UPDATE cnt = cnt + (NEW.status <=> 'pending') - (OLD.status <=> 'pending');
+  END IF;
+END//
+
+CREATE TRIGGER trg_reports_stats_del AFTER DELETE ON reports
+FOR EACH ROW
+BEGIN
+  IF OLD.status = 'pending' THEN
+    UPDATE stat_counters SET cnt = cnt - 1 WHERE name = 'reports_pending';
+  END IF;
+END//
+
+CREATE TRIGGER trg_feedback_stats_ins AFTER INSERT ON feedback
+FOR EACH ROW
+BEGIN
+  INSERT INTO stat_counters (name, cnt) VALUES ('feedback', 1) ON DUPLICATE KEY UPDATE cnt = cnt + 1;
+END//
+
+CREATE TRIGGER trg_feedback_stats_del AFTER DELETE ON feedback
+FOR EACH ROW
+BEGIN
+  UPDATE stat_counters SET cnt = cnt - 1 WHERE name = 'feedback';
+END//
+DELIMITER ;
+
+-- 3. 回填
+DELETE FROM restaurant_stat_counts;
+INSERT INTO restaurant_stat_counts (status, country, state_id, state, vegetarian_type, verification_status, category, cnt)
+SELECT COALESCE(status, ''), COALESCE(country, ''), COALESCE(state_id, 0), COALESCE(state, ''),
+       COALESCE(vegetarian_type, ''), COALESCE(verification_status, ''), COALESCE(category, ''), COUNT(*)
+FROM restaurants
+GROUP BY 1, 2, 3, 4, 5, 6, 7;
+
+INSERT INTO stat_counters (name, cnt)
+SELECT 'users', COUNT(*) FROM users
+ON DUPLICATE KEY UPDATE cnt = VALUES(cnt);
+
+INSERT INTO stat_counters (name, cnt)
+SELECT 'reports_pending', COUNT(*) FROM reports WHERE status = 'pending'
+ON DUPLICATE KEY UPDATE cnt = VALUES(cnt);
+
+INSERT INTO stat_counters (name, cnt)
+SELECT 'feedback', COUNT(*) FROM feedback
+ON DUPLICATE KEY UPDATE cnt = VALUES(cnt);
+
+SELECT 'Migration completed successfully!' as status;
@@ -0,0 +1,63 @@
+-- ============================================
+-- Benchmark 数据库适配: goveggie_q1_dump.sql (Q1 表结构) -> main.py 使用的 goveggie_v4 字段
+-- 只用于本地压测库, 由 benchmarks/setup_bench_db.sh 在 hostinger_migration.sql 之后执行
+-- 另外插入压测用户 (900001 普通用户 / 900002 管理员) 以及他们的收藏和通知
+-- ============================================
+
+-- 1. restaurants: v4 字段由 Q1 字段推导
+ALTER TABLE restaurants
+  ADD COLUMN name_zh VARCHAR(500) NULL,
+  ADD COLUMN location_lat DECIMAL(10,8) NULL,
+  ADD COLUMN location_lng DECIMAL(11,8) NULL,
+  ADD COLUMN recommended_dishes TEXT NULL,
+  ADD COLUMN description TEXT NULL,
+  ADD COLUMN phones JSON NULL,
+  ADD COLUMN state VARCHAR(100) NULL,
+  ADD COLUMN area VARCHAR(100) NULL,
+  ADD COLUMN business_hours JSON NULL,
+  ADD COLUMN verification_status VARCHAR(20) NULL;
+
+UPDATE restaurants r
+LEFT JOIN states s ON s.id = r.state_id
+LEFT JOIN areas a ON a.id = r.area_id
+SET r.name_zh = r.name,
+    r.location_lat = r.lat,
+    r.location_lng = r.lng,
+    r.description = r.intro,
+    r.phones = CASE
+      WHEN r.phone IS NULL THEN JSON_ARRAY()
+      WHEN r.phone2 IS NULL THEN JSON_ARRAY(r.phone)
+      ELSE JSON_ARRAY(r.phone, r.phone2) END,
+    r.state = s.name,
+    r.area = a.name,
+    r.price_level = r.price_range,
+    r.recommended = (r.verification = 'official'),
+    r.verification_status = r.verification,
+    r.updated_at = r.updated_at;
+
+-- 2. areas: v4 使用 area / area_zh / state (名称)
+ALTER TABLE areas
+  ADD COLUMN area VARCHAR(100) NULL,
+  ADD COLUMN area_zh VARCHAR(100) NULL,
+  ADD COLUMN state VARCHAR(100) NULL;
+
+UPDATE areas a LEFT JOIN states s ON s.id = a.state_id
+SET a.area = a.name, a.area_zh = a.name_zh, a.state = s.name;
+
+-- 3. users
+ALTER TABLE users ADD COLUMN preferences JSON NULL;
+
+-- 4. 压测用户及数据
+INSERT INTO users (id, email, name, role, is_active, created_at) VALUES
+  (900001, 'bench-user@example.com', 'Bench User', 'user', 1, NOW()),
+  (900002, 'bench-admin@example.com', 'Bench Admin', 'admin', 1, NOW());
+
+INSERT INTO favorites (user_id, restaurant_id, created_at)
+SELECT 900001, id, NOW() FROM restaurants WHERE status = 'active' ORDER BY id LIMIT 30;
+
+INSERT INTO user_notifications (user_id, type, title, content, data, is_read, created_at)
+SELECT 900001, 'new_restaurant', CONCAT('新餐厅: ', name), address,
+       JSON_OBJECT('restaurant_id', id), id % 3 = 0, created_at
+FROM restaurants WHERE status = 'active' ORDER BY id DESC LIMIT 200;
+
+SELECT 'Bench schema ready' as status;
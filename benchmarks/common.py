@@ -0,0 +1,55 @@
+"""
+Benchmark 公共工具: 数据库连接 (与 main.py 使用相同的 VSM_DB_* 环境变量) 和计时
+"""
+
+import os
+import statistics
+import time
+
+import mysql.connector
+
+
+def connect():
+    config = {
+        "host": os.getenv("VSM_DB_HOST", "localhost"),
+        "user": os.getenv("VSM_DB_USER", "root"),
+        "database": os.getenv("VSM_DB_NAME", "goveggie_v4"),
+        "charset": "utf8mb4",
+    }
+    if os.getenv("VSM_DB_PASSWORD"):
+        config["password"] = os.getenv("VSM_DB_PASSWORD")
+    return mysql.connector.connect(**config)
+
+
+def time_query(cursor, sql, params=(), repeat=50):
+    """执行 repeat 次, 返回 {avg_ms, p50_ms, p95_ms, rows}"""
+    samples = []
+    rows = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cursor.execute(sql, params)
+        rows = len(cursor.fetchall())
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "avg_ms": round(statistics.mean(samples), 3),
+        "p50_ms": round(samples[len(samples) // 2], 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        "rows": rows,
+    }
+
+
+def explain(cursor, sql, params=()):
+    """EXPLAIN 的简要输出: 每张表的访问类型、使用的索引和预估行数"""
+    cursor.execute("EXPLAIN " + sql, params)
+    cols = [d[0] for d in cursor.description]
+    out = []
+    for row in cursor.fetchall():
+        r = dict(zip(cols, row))
+        out.append(f"{r.get('table')}: type={r.get('type')} key={r.get('key')} rows={r.get('rows')} extra={r.get('Extra')}")
+    return out
+
+
+def print_result(label, result):
+    print(f"  {label:<10} avg={result['avg_ms']:>8.3f}ms  p50={result['p50_ms']:>8.3f}ms  "
+          f"p95={result['p95_ms']:>8.3f}ms  rows={result['rows']}")
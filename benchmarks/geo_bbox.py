@@ -0,0 +1,70 @@
+"""
+对比 list_restaurants 的两种 SQL 距离查询:
+  before: 对每一行计算 acos/cos/sin 再按半径过滤 (全表扫描)
+  after : location_lat/location_lng BETWEEN 包围盒 (idx_location_lat_lng) + ST_Distance_Sphere
+
+先执行 geo_bbox_migration.sql, 然后:
+  python benchmarks/geo_bbox.py [--repeat 50]
+"""
+
+import argparse
+import math
+
+from common import connect, explain, print_result, time_query
+
+# (名称, lat, lng, 半径米)
+CASES = [
+    ("KL 5km", 3.139, 101.6869, 5000),
+    ("KL 50km (默认半径)", 3.139, 101.6869, 50000),
+    ("Penang 10km", 5.4141, 100.3288, 10000),
+    ("Kota Kinabalu 20km", 5.9804, 116.0735, 20000),
+]
+
+
+def before_sql(lat, lng, radius):
+    dist = (f"(6371000 * acos(least(1.0, cos(radians({lat})) * cos(radians(r.location_lat)) * "
+            f"cos(radians(r.location_lng) - radians({lng})) + sin(radians({lat})) * sin(radians(r.location_lat)))))")
+    return f"""SELECT r.id, {dist} AS distance_m FROM restaurants r
+               WHERE 1=1 AND {dist} <= {radius}
+               ORDER BY distance_m ASC, r.id ASC LIMIT 50"""
+
+
+def after_sql(lat, lng, radius):
+    dlat = radius / 111320.0
+    dlng = radius / (111320.0 * max(0.01, math.cos(math.radians(lat))))
+    dist = f"ST_Distance_Sphere(POINT(r.location_lng, r.location_lat), POINT({lng}, {lat}))"
+    return f"""SELECT r.id, {dist} AS distance_m FROM restaurants r
+               WHERE 1=1 AND r.location_lat BETWEEN {lat - dlat} AND {lat + dlat}
+                 AND r.location_lng BETWEEN {lng - dlng} AND {lng + dlng}
+                 AND {dist} <= {radius}
+               ORDER BY distance_m ASC, r.id ASC LIMIT 50"""
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    db = connect()
+    cursor = db.cursor()
+    try:
+        for name, lat, lng, radius in CASES:
+            print(f"\n== {name}")
+            before = time_query(cursor, before_sql(lat, lng, radius), (), args.repeat)
+            after = time_query(cursor, after_sql(lat, lng, radius), (), args.repeat)
+            print_result("before", before)
+            print_result("after", after)
+            if before["rows"] != after["rows"]:
+                print(f"  note       行数不同 ({before['rows']} vs {after['rows']}), 半径边界处的地球半径取值差异")
+            if after["avg_ms"]:
+                print(f"  speedup    x{before['avg_ms'] / after['avg_ms']:.1f}")
+            for line in explain(cursor, before_sql(lat, lng, radius)):
+                print(f"  explain(before) {line}")
+            for line in explain(cursor, after_sql(lat, lng, radius)):
+                print(f"  explain(after)  {line}")
+    finally:
+        cursor.close(); db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+HTTP 压测: 对运行中的服务并发请求热点接口, 输出 RPS 与延迟分位数
+
+对比线程池模式与 aiomysql 模式 (同一台机器, 同一数据库):
+  VSM_DB_ASYNC=0 uvicorn main:app --port 8000
+  python benchmarks/load_test.py --label threadpool --out threadpool.json
+
+  VSM_DB_ASYNC=1 uvicorn main:app --port 8000
+  python benchmarks/load_test.py --label aiomysql --out aiomysql.json
+
+需要登录的接口通过 --token 传入 JWT (或设置 VSM_LOAD_TEST_TOKEN)
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import httpx
+
+# (名称, 路径, 是否需要用户 token)
+ENDPOINTS = [
+    ("list_restaurants", "/api/restaurants?limit=50", False),
+    ("list_restaurants_geo", "/api/restaurants?lat=3.139&lng=101.6869&radius=10000&sort_by=distance&limit=50", False),
+    ("get_restaurant", "/api/restaurants/{restaurant_id}", False),
+    ("get_me", "/api/auth/me", True),
+    ("list_favorites", "/api/favorites", True),
+    ("list_notifications", "/api/notifications?limit=20", True),
+    ("unread_count", "/api/notifications/unread-count", True),
+]
+
+
+def percentile(samples, p):
+    if not samples: return None
+    return round(samples[min(len(samples) - 1, int(len(samples) * p))], 2)
+
+
+async def worker(client, path, headers, deadline, samples, errors):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            resp = await client.get(path, headers=headers)
+            if resp.status_code >= 400:
+                errors.append(resp.status_code)
+                continue
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+            continue
+        samples.append((time.perf_counter() - start) * 1000)
+
+
+async def run_endpoint(client, path, headers, concurrency, duration):
+    samples, errors = [], []
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*[worker(client, path, headers, deadline, samples, errors) for _ in range(concurrency)])
+    samples.sort()
+    return {
+        "requests": len(samples),
+        "errors": len(errors),
+        "rps": round(len(samples) / duration, 1),
+        "p50_ms": percentile(samples, 0.50),
+        "p95_ms": percentile(samples, 0.95),
+        "p99_ms": percentile(samples, 0.99),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--token", default=os.getenv("VSM_LOAD_TEST_TOKEN"))
+    parser.add_argument("--restaurant-id", type=int, default=1)
+    parser.add_argument("--label", default="run")
+    parser.add_argument("--out", help="结果写入 JSON 文件, 便于对比两次运行")
+    args = parser.parse_args()
+
+    auth = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    results = {"label": args.label, "concurrency": args.concurrency, "duration": args.duration, "endpoints": {}}
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=30) as client:
+        for name, path, needs_user in ENDPOINTS:
+            if needs_user and not args.token:
+                print(f"{name:22s} skipped (no --token)")
+                continue
+            r = await run_endpoint(client, path.format(restaurant_id=args.restaurant_id), auth,
+                                   args.concurrency, args.duration)
+            results["endpoints"][name] = r
+            print(f"{name:22s} rps={r['rps']:<8} p50={r['p50_ms']}ms p95={r['p95_ms']}ms "
+                  f"p99={r['p99_ms']}ms errors={r['errors']}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
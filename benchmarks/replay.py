@@ -0,0 +1,304 @@
+"""
+按 uvicorn.log 的真实流量回放压测, 每个接口输出 p50/p95/p99、吞吐、每请求数据库查询数和服务进程峰值 RSS,
+结果按 git commit 保存为 JSON, 用于对比不同提交
+
+准备数据库 (goveggie_q1_dump.sql + 表结构适配 + 各迁移):
+  benchmarks/setup_bench_db.sh goveggie_bench
+  export VSM_DB_NAME=goveggie_bench
+
+由脚本启动服务 (推荐, 可采集 RSS):
+  python benchmarks/replay.py --spawn --label baseline
+或压测已运行的服务:
+  python benchmarks/replay.py --base-url http://127.0.0.1:8000 --pid <uvicorn pid>
+
+对比两次结果:
+  python benchmarks/replay.py --compare benchmarks/results/a.json benchmarks/results/b.json
+
+说明:
+  - 只回放 GET 请求 (POST 收藏/登录会改动数据); 路径和查询参数与日志一致, 按出现次数加权
+  - 普通接口使用压测用户 (900001) 的 token, /api/admin/* 使用压测管理员 (900002)
+  - 每请求查询数 = 阶段前后 SHOW GLOBAL STATUS 'Questions' 之差 / 请求数, 压测库应只服务本次压测
+  - 照片接口需要 PHOTO_DIR 下有对应文件 (或配置 VSM_PHOTO_UPSTREAM), 否则计为 404
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+import httpx
+
+from common import connect
+from load_test import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+BENCH_USER_ID = 900001
+BENCH_ADMIN_ID = 900002
+
+LOG_LINE_RE = re.compile(r'"(GET|POST|PUT|PATCH|DELETE) (\S+) HTTP/[\d.]+" (\d{3})')
+
+
+# ==================== 流量解析 ====================
+
+def route_of(path):
+    """请求路径 -> 接口模板 (数字段和照片文件名归一)"""
+    path = path.split("?", 1)[0]
+    if path.startswith("/api/photos/"):
+        return "/api/photos/{legacy_pid}/{filename}"
+    return re.sub(r"/\d+(?=/|$)", "/{id}", path)
+
+
+def parse_log(path):
+    """返回 GET 请求列表 [(route, target)], 保持日志顺序"""
+    requests = []
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            m = LOG_LINE_RE.search(line)
+            if not m: continue
+            method, target, _ = m.groups()
+            route = route_of(target)
+            if method != "GET" or not route.startswith("/api/"): continue
+            requests.append((route, target))
+    return requests
+
+
+# ==================== 服务进程 ====================
+
+def spawn_server(port):
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=os.environ.copy())
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"uvicorn exited with code {proc.returncode}")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/api", timeout=1)
+            return proc
+        except httpx.HTTPError:
+            time.sleep(0.3)
+    proc.terminate()
+    raise SystemExit("uvicorn did not start within 30s")
+
+
+def read_rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    try:
+        return int(subprocess.check_output(["ps", "-o", "rss=", "-p", str(pid)]).strip() or 0)
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+
+
+class RssSampler:
+    """后台线程每 interval 秒采样一次 RSS, 记录阶段内峰值"""
+
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak_kb = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if self.pid:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread: self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = read_rss_kb(self.pid)
+            if rss is not None and (self.peak_kb is None or rss > self.peak_kb):
+                self.peak_kb = rss
+            self._stop.wait(self.interval)
+
+
+def db_questions(cursor):
+    cursor.execute("SHOW GLOBAL STATUS LIKE 'Questions'")
+    return int(cursor.fetchone()[1])
+
+
+# ==================== 回放 ====================
+
+def make_tokens():
+    from main import create_access_token
+    user = create_access_token({"sub": str(BENCH_USER_ID), "uid": BENCH_USER_ID, "role": "user"})
+    admin = create_access_token({"sub": str(BENCH_ADMIN_ID), "uid": BENCH_ADMIN_ID, "role": "admin"})
+    return {"user": {"Authorization": f"Bearer {user}"}, "admin": {"Authorization": f"Bearer {admin}"}}
+
+
+async def run_phase(client, targets, tokens, concurrency, duration):
+    """并发循环回放 targets 列表, 直到 duration 秒结束"""
+    samples, statuses = [], Counter()
+    deadline = time.perf_counter() + duration
+    state = {"next": 0}
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            route, target = targets[state["next"] % len(targets)]
+            state["next"] += 1
+            headers = tokens["admin"] if route.startswith("/api/admin/") else tokens["user"]
+            start = time.perf_counter()
+            try:
+                resp = await client.get(target, headers=headers)
+                await resp.aread()
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+                continue
+            statuses[str(resp.status_code)] += 1
+            if resp.status_code < 400:
+                samples.append((time.perf_counter() - start) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    samples.sort()
+    total = sum(statuses.values())
+    return {
+        "requests": total,
+        "ok": len(samples),
+        "statuses": dict(statuses),
+        "rps": round(total / elapsed, 1),
+        "p50_ms": percentile(samples, 0.50),
+        "p95_ms": percentile(samples, 0.95),
+        "p99_ms": percentile(samples, 0.99),
+    }
+
+
+async def replay(args, requests, pid):
+    tokens = make_tokens()
+    by_route = defaultdict(list)
+    for route, target in requests:
+        by_route[route].append((route, target))
+    # 各接口单独一轮, 最后按日志顺序混合回放一轮
+    phases = [(route, reqs) for route, reqs in sorted(by_route.items(), key=lambda kv: -len(kv[1]))]
+    phases.append(("mix", requests))
+
+    db = connect()
+    cursor = db.cursor()
+    results = {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=30) as client:
+            # 预热: 每个不同的请求先访问一次 (内存索引/缓存建立)
+            for route, target in dict.fromkeys(requests):
+                headers = tokens["admin"] if route.startswith("/api/admin/") else tokens["user"]
+                try:
+                    await client.get(target, headers=headers)
+                except httpx.HTTPError:
+                    pass
+
+            for name, targets in phases:
+                before = db_questions(cursor)
+                with RssSampler(pid) as rss:
+                    r = await run_phase(client, targets, tokens, args.concurrency, args.duration)
+                # 减去本次 SHOW STATUS 自身
+                queries = db_questions(cursor) - before - 1
+                r["weight"] = len(targets) if name != "mix" else len(requests)
+                r["db_queries_per_request"] = round(queries / r["requests"], 2) if r["requests"] else None
+                r["peak_rss_mb"] = round(rss.peak_kb / 1024, 1) if rss.peak_kb else None
+                results[name] = r
+                print(f"{name:40s} rps={r['rps']:<8} p50={r['p50_ms']}ms p95={r['p95_ms']}ms p99={r['p99_ms']}ms "
+                      f"q/req={r['db_queries_per_request']} rss={r['peak_rss_mb']}MB statuses={r['statuses']}")
+    finally:
+        cursor.close(); db.close()
+    return results
+
+
+# ==================== 结果 ====================
+
+def git_sha():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(path_a, path_b):
+    with open(path_a) as f: a = json.load(f)
+    with open(path_b) as f: b = json.load(f)
+    print(f"A = {a['commit']} ({a['label']})   B = {b['commit']} ({b['label']})")
+    metrics = ["rps", "p50_ms", "p95_ms", "p99_ms", "db_queries_per_request", "peak_rss_mb"]
+    for name in list(dict.fromkeys(list(a["endpoints"]) + list(b["endpoints"]))):
+        ra, rb = a["endpoints"].get(name, {}), b["endpoints"].get(name, {})
+        print(f"\n== {name}")
+        for m in metrics:
+            va, vb = ra.get(m), rb.get(m)
+            change = f"{(vb - va) / va * 100:+.1f}%" if va and vb is not None else ""
+            print(f"  {m:24s} {str(va):>10} -> {str(vb):<10} {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--log", default=os.path.join(ROOT, "uvicorn.log"))
+    parser.add_argument("--base-url", default=None)
+    parser.add_argument("--spawn", action="store_true", help="由脚本启动 uvicorn (使用当前 VSM_* 环境变量)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--pid", type=int, help="已运行服务的进程号, 用于采集 RSS")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--label", default="run")
+    parser.add_argument("--out", help="默认 benchmarks/results/<commit>-<label>.json")
+    parser.add_argument("--compare", nargs=2, metavar=("A", "B"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    requests = parse_log(args.log)
+    if not requests:
+        raise SystemExit(f"no GET /api requests found in {args.log}")
+    mix = Counter(route for route, _ in requests)
+    print(f"{len(requests)} requests from {args.log}: " + ", ".join(f"{r} x{n}" for r, n in mix.most_common()))
+
+    proc = None
+    if args.spawn:
+        proc = spawn_server(args.port)
+        args.base_url, pid = f"http://127.0.0.1:{args.port}", proc.pid
+    else:
+        args.base_url, pid = args.base_url or "http://127.0.0.1:8000", args.pid
+    try:
+        endpoints = asyncio.run(replay(args, requests, pid))
+    finally:
+        if proc:
+            proc.terminate(); proc.wait()
+
+    commit = git_sha()
+    report = {
+        "commit": commit,
+        "label": args.label,
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "env": {k: v for k, v in os.environ.items() if k.startswith("VSM_") and "PASSWORD" not in k},
+        "endpoints": endpoints,
+    }
+    out = args.out or os.path.join(RESULTS_DIR, f"{commit}-{args.label}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\nsaved {out}")
+
+
+if __name__ == "__main__":
+    main()
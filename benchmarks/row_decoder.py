@@ -0,0 +1,123 @@
+"""
+对比逐行 row_to_dict 与按列计划批量解码的 RowDecoder (不需要数据库)
+
+从 goveggie_q1_dump.sql 读取 restaurants 的表结构和数据, 按 mysql.connector 的返回类型
+(DECIMAL -> Decimal, JSON -> str, TIMESTAMP -> datetime) 构造结果行和 cursor.description,
+重复拼成 --rows 行 (对应 /api/restaurants?limit=2000) 后分别计时:
+  python benchmarks/row_decoder.py [--rows 2000] [--repeat 30]
+"""
+
+import argparse
+import copy
+import os
+import re
+import statistics
+import sys
+import time
+from datetime import datetime
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from main import RowDecoder, row_to_dict  # noqa: E402
+
+DUMP = os.path.join(ROOT, "goveggie_q1_dump.sql")
+
+# 列类型 -> (MySQL 字段类型码, 值转换)
+TYPES = [
+    ("decimal", 246, Decimal),
+    ("json", 245, str),
+    ("timestamp", 7, lambda v: datetime.strptime(v, "%Y-%m-%d %H:%M:%S")),
+    ("datetime", 12, lambda v: datetime.strptime(v, "%Y-%m-%d %H:%M:%S")),
+    ("int", 3, int),
+    ("tinyint", 1, int),
+]
+ESCAPES = {"n": "\n", "r": "\r", "t": "\t", "0": "\0", "Z": "\x1a"}
+
+
+def load_table(path, table):
+    """返回 (description, [dict 行])"""
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    create = re.search(r"CREATE TABLE `%s` \((.*?)\n\) ENGINE" % table, text, re.S).group(1)
+    columns = []
+    for line in create.splitlines():
+        m = re.match(r"\s+`(\w+)` (\w+)", line)
+        if not m: continue
+        name, sql_type = m.groups()
+        type_code, convert = next(((code, fn) for t, code, fn in TYPES if sql_type == t), (253, str))
+        columns.append((name, type_code, convert))
+    description = [(name, code, None, None, None, None, True) for name, code, _ in columns]
+
+    rows = []
+    for stmt in re.findall(r"^INSERT INTO `%s` VALUES (.*);$" % table, text, re.M):
+        for values in parse_values(stmt):
+            rows.append({name: (None if v is None else convert(v))
+                         for (name, _, convert), v in zip(columns, values)})
+    return description, rows
+
+
+def parse_values(stmt):
+    """解析 mysqldump 的 (..),(..) 值列表"""
+    i, n = 0, len(stmt)
+    while i < n:
+        if stmt[i] != "(":
+            i += 1; continue
+        i += 1; values = []
+        while True:
+            if stmt[i] == "'":
+                i += 1; buf = []
+                while stmt[i] != "'":
+                    if stmt[i] == "\\":
+                        i += 1; buf.append(ESCAPES.get(stmt[i], stmt[i]))
+                    else:
+                        buf.append(stmt[i])
+                    i += 1
+                i += 1; values.append("".join(buf))
+            else:
+                j = i
+                while stmt[j] not in ",)": j += 1
+                raw = stmt[i:j]; i = j
+                values.append(None if raw == "NULL" else raw)
+            if stmt[i] == ")":
+                i += 1; break
+            i += 1
+        yield values
+
+
+def timeit(fn, make_rows, repeat):
+    samples = []
+    for _ in range(repeat):
+        rows = make_rows()
+        start = time.perf_counter()
+        fn(rows)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {"avg_ms": round(statistics.mean(samples), 3), "p50_ms": round(samples[len(samples) // 2], 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    description, source = load_table(DUMP, "restaurants")
+    base = [source[i % len(source)] for i in range(args.rows)]
+    make_rows = lambda: copy.deepcopy(base)
+    print(f"{len(source)} restaurants in dump, {len(description)} columns, decoding {args.rows} rows")
+
+    a, b = make_rows(), make_rows()
+    assert [row_to_dict(r) for r in a] == RowDecoder(description).decode(b), "decoders disagree"
+
+    before = timeit(lambda rows: [row_to_dict(r) for r in rows], make_rows, args.repeat)
+    after = timeit(lambda rows: RowDecoder(description).decode(rows), make_rows, args.repeat)
+    print(f"  row_to_dict  avg={before['avg_ms']}ms p50={before['p50_ms']}ms")
+    print(f"  RowDecoder   avg={after['avg_ms']}ms p50={after['p50_ms']}ms")
+    if after["avg_ms"]:
+        print(f"  speedup      x{before['avg_ms'] / after['avg_ms']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+#!/usr/bin/env bash
+# 建立本地压测库: 导入 goveggie_q1_dump.sql, 适配为 main.py 的表结构, 再依次执行各迁移
+#
+#   VSM_DB_USER=root VSM_DB_PASSWORD=... benchmarks/setup_bench_db.sh [库名, 默认 goveggie_bench]
+#
+# 然后用相同的 VSM_DB_* 环境变量 (VSM_DB_NAME=库名) 运行 benchmarks/replay.py
+set -euo pipefail
+
+ROOT="$(cd "$(dirname "$0")/.." && pwd)"
+DB_NAME="${1:-goveggie_bench}"
+MYSQL=(mysql -h "${VSM_DB_HOST:-localhost}" -u "${VSM_DB_USER:-root}" --default-character-set=utf8mb4)
+if [ -n "${VSM_DB_PASSWORD:-}" ]; then MYSQL+=("-p${VSM_DB_PASSWORD}"); fi
+
+echo "== create ${DB_NAME}"
+"${MYSQL[@]}" -e "DROP DATABASE IF EXISTS \`${DB_NAME}\`; CREATE DATABASE \`${DB_NAME}\` CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci;"
+
+for sql in \
+    goveggie_q1_dump.sql \
+    hostinger_migration.sql \
+    benchmarks/bench_schema.sql \
+    state_area_ids_migration.sql \
+    notification_counters_migration.sql \
+    notification_broadcast_migration.sql \
+    geo_bbox_migration.sql \
+    admin_stats_migration.sql; do
+  echo "== ${sql}"
+  "${MYSQL[@]}" "${DB_NAME}" < "${ROOT}/${sql}"
+done
+
+echo "== done: export VSM_DB_NAME=${DB_NAME}"
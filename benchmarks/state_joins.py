@@ -0,0 +1,58 @@
+"""
+对比 restaurants 与 states/areas 的两种关联方式:
+  before: CAST(s.name AS CHAR CHARACTER SET utf8mb4) = CAST(r.state ...)   (无法使用索引)
+  after : s.id = r.state_id / a.id = r.area_id                            (主键查找)
+
+先执行 state_area_ids_migration.sql, 然后:
+  python benchmarks/state_joins.py [--repeat 50]
+"""
+
+import argparse
+
+from common import connect, explain, print_result, time_query
+
+SELECT = """SELECT r.*, s.name as state_name, s.name_zh as state_name_zh,
+                   a.area as area_name, a.area_zh as area_name_zh
+            FROM restaurants r """
+
+BEFORE = SELECT + """
+            LEFT JOIN states s ON CAST(s.name AS CHAR CHARACTER SET utf8mb4) = CAST(r.state AS CHAR CHARACTER SET utf8mb4)
+            LEFT JOIN areas a ON CAST(a.area AS CHAR CHARACTER SET utf8mb4) = CAST(r.area AS CHAR CHARACTER SET utf8mb4)"""
+
+AFTER = SELECT + """
+            LEFT JOIN states s ON s.id = r.state_id
+            LEFT JOIN areas a ON a.id = r.area_id"""
+
+# (名称, WHERE 子句, 参数) — 对应 list_restaurants / get_restaurant / admin_list_restaurants 的典型请求
+CASES = [
+    ("list_restaurants limit=2000", " WHERE r.status = 'active' ORDER BY r.id DESC LIMIT 2000", ()),
+    ("list_restaurants limit=50", " WHERE r.status = 'active' ORDER BY r.id DESC LIMIT 50", ()),
+    ("get_restaurant", " WHERE r.id = (SELECT MAX(id) FROM restaurants)", ()),
+    ("admin_list_restaurants", " ORDER BY r.created_at DESC LIMIT 50", ()),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    db = connect()
+    cursor = db.cursor()
+    try:
+        for name, tail, params in CASES:
+            print(f"\n== {name}")
+            before = time_query(cursor, BEFORE + tail, params, args.repeat)
+            after = time_query(cursor, AFTER + tail, params, args.repeat)
+            print_result("before", before)
+            print_result("after", after)
+            if after["avg_ms"]:
+                print(f"  speedup    x{before['avg_ms'] / after['avg_ms']:.1f}")
+            for line in explain(cursor, AFTER + tail, params):
+                print(f"  explain    {line}")
+    finally:
+        cursor.close(); db.close()
+
+
+if __name__ == "__main__":
+    main()
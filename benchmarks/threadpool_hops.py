@@ -0,0 +1,109 @@
+"""
+线程池模式 (VSM_DB_ASYNC=0, 默认) 下 /api/restaurants 的数据库访问开销 (不需要数据库)
+
+用固定延迟的假连接代替 MySQL (--latency 毫秒, sleep 时释放 GIL, 与等待网络相同),
+按 list_restaurants 的查询形态 (借连接 + 列表 + COUNT + 归还) 并发执行 --requests 个请求:
+  per-query  async_db() + 逐条 await, 每条 SQL 和借/还连接各进出一次线程池
+  run_db     整组查询一次线程池调用 (与原来的同步 def 接口相同)
+  python benchmarks/threadpool_hops.py [--requests 2000] [--concurrency 1,64,256] [--latency 0.3]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import main  # noqa: E402
+
+LIST_SQL = "SELECT * FROM restaurants r WHERE r.status = %s LIMIT 50"
+COUNT_SQL = "SELECT COUNT(*) as total FROM restaurants r WHERE r.status = %s"
+
+
+class FakeCursor:
+    description = [("id", 3, None, None, None, None, False)]
+    rowcount = 0
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def execute(self, sql, params=()):
+        time.sleep(self.latency)
+        self.rows = [{"total": 50}] if "COUNT" in sql else [{"id": i} for i in range(50)]
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0]
+
+    def close(self):
+        pass
+
+
+class FakeConn:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def cursor(self, **kwargs):
+        return FakeCursor(self.latency)
+
+    def close(self):
+        time.sleep(self.latency)  # 归还连接时的 rollback
+
+
+async def per_query():
+    async with main.async_db() as db:
+        rows = await db.fetchall(LIST_SQL, ("active",), decode=True)
+        total = (await db.fetchone(COUNT_SQL, ("active",)))["total"]
+    return rows, total
+
+
+async def batched():
+    def queries():
+        rows = yield (LIST_SQL, ("active",), "all", True)
+        total = (yield (COUNT_SQL, ("active",), "one", False))["total"]
+        return rows, total
+    return await main.run_db(queries())
+
+
+async def measure(handler, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await handler()
+            samples.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    samples.sort()
+    return {"rps": round(requests / elapsed), "avg_ms": round(statistics.mean(samples), 3),
+            "p95_ms": round(samples[int(len(samples) * 0.95)], 3)}
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", default="1,64,256")
+    parser.add_argument("--latency", type=float, default=0.3, help="每次数据库往返的毫秒数")
+    args = parser.parse_args()
+
+    latency = args.latency / 1000
+    main.get_db = lambda: FakeConn(latency)
+    print(f"{args.requests} requests, {args.latency}ms per round trip, default threadpool")
+    for concurrency in (int(c) for c in args.concurrency.split(",")):
+        for name, handler in (("per-query", per_query), ("run_db", batched)):
+            r = asyncio.run(measure(handler, args.requests, concurrency))
+            print(f"  c={concurrency:<4} {name:<10} {r['rps']:>6} req/s  avg={r['avg_ms']}ms p95={r['p95_ms']}ms")
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,25 @@
+-- ============================================
+-- VSM Backend Migration: restaurants 坐标索引
+-- Date: 2026-10-18
+-- 目的: list_restaurants 的 SQL 距离查询 (VSM_GEO_INDEX=0 或内存索引不可用时)
+--       先用 location_lat/location_lng BETWEEN 包围盒走索引筛出候选,
+--       再只对候选行计算 ST_Distance_Sphere, 不再对整表逐行 acos/cos/sin
+-- 可重复执行; 对比: python benchmarks/geo_bbox.py
+-- ============================================
+
+-- 1. 坐标复合索引 (lat 范围扫描 + lng 索引条件下推)
+SET @exist := (SELECT COUNT(*) FROM information_schema.statistics
+  WHERE table_name = 'restaurants' AND index_name = 'idx_location_lat_lng' AND table_schema = DATABASE());
+SET @sql := IF(@exist = 0, 'ALTER TABLE restaurants ADD INDEX idx_location_lat_lng (location_lat, location_lng)', 'SELECT "Index already exists"');
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- 2. 更新统计信息, 让优化器选择新索引
+ANALYZE TABLE restaurants;
+
+-- 3. 检查: 缺少坐标的记录不会出现在距离查询中
+SELECT COUNT(*) AS missing_location FROM restaurants
+  WHERE location_lat IS NULL OR location_lng IS NULL OR (ABS(location_lat) < 0.1 AND ABS(location_lng) < 0.1);
+
+SELECT 'Migration completed successfully!' as status;
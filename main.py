@@ -5,19 +5,40 @@ Run: uvicorn main:app --host 0.0.0.0 --port 8000 --reload
 """
 
 from fastapi import FastAPI, Query, Header, HTTPException, Depends, Request, UploadFile, File
-from fastapi.responses import FileResponse, Response
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import mysql.connector
+import asyncio
+import bisect
+import contextvars
+import functools
+import gzip
+import hashlib
+import inspect
 import json
+import logging
+import math
+import mimetypes
 import os
+import re
+import threading
+import time
+import uuid
 import jwt
-from datetime import datetime, timedelta, timezone
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from email.utils import formatdate, parsedate_to_datetime
 from typing import Optional, List
 from pydantic import BaseModel
 
 app = FastAPI(title="GoVeggie API v2.0", version="2.0")
+logger = logging.getLogger("vsm")
 
 # Security
 SECRET_KEY = "vsm-super-secret-key-for-jwt-2026"
@@ -27,16 +48,15 @@ security = HTTPBearer(auto_error=False)
 
 def create_access_token(data: dict):
     to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + timedelta(days=365)
-    to_encode.update({"exp": expire})
+    now = datetime.now(timezone.utc)
+    to_encode.update({"exp": now + timedelta(days=365), "iat": now})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 async def verify_token(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)):
     if not credentials or not credentials.credentials:
         raise HTTPException(status_code=401, detail="Not authenticated")
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
+        return decode_token(credentials.credentials)
     except Exception:
         raise HTTPException(status_code=401, detail="Invalid token")
 
@@ -54,13 +74,19 @@ async def verify_token_or_key(
         return {"sub": "static_client", "role": "guest"}
     if credentials and credentials.credentials:
         try:
-            return jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+            return decode_token(credentials.credentials)
         except: pass
     raise HTTPException(status_code=403, detail="Invalid credentials")
 
-def get_current_user(payload: dict = Depends(verify_token)):
+async def get_current_user(payload: dict = Depends(verify_token)):
     return payload
 
+async def get_optional_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)):
+    """公开接口使用: 带有效 token 时返回用户, 否则返回 None (不报错)"""
+    if not credentials or not credentials.credentials: return None
+    try: return decode_token(credentials.credentials)
+    except Exception: return None
+
 def require_admin(user: dict = Depends(verify_token)):
     if user.get('role') not in ['admin', 'super_admin']:
         raise HTTPException(status_code=403, detail="Admin only")
@@ -78,13 +104,689 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ============================================================
+# Request Metrics (接口耗时分解, Prometheus /metrics)
+# ============================================================
+
+METRICS_ENABLED = os.getenv("VSM_METRICS", "1") == "1"
+SERVER_TIMING = os.getenv("VSM_SERVER_TIMING", "0") == "1"  # 响应附带 Server-Timing 头 (浏览器 DevTools 可见)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# connect: 借连接; db: execute/fetch; decode: RowDecoder; serialize: JSON 编码
+REQUEST_PHASES = ("connect", "db", "decode", "serialize")
+
+class RequestStats:
+    """单个请求的累计: SQL 条数和各阶段耗时(秒)"""
+    __slots__ = ("queries",) + REQUEST_PHASES
+
+    def __init__(self):
+        self.queries = 0
+        for phase in REQUEST_PHASES: setattr(self, phase, 0.0)
+
+# 中间件设置; run_in_threadpool 会复制 context, 线程池中的同步代码也能取到
+current_request_stats = contextvars.ContextVar("current_request_stats", default=None)
+
+@contextmanager
+def request_timer(phase, queries=0):
+    """代码块耗时计入当前请求的 phase; 不在请求中 (后台线程) 时不计"""
+    stats = current_request_stats.get()
+    if stats is None:
+        yield; return
+    start = time.perf_counter()
+    try: yield
+    finally:
+        setattr(stats, phase, getattr(stats, phase) + time.perf_counter() - start)
+        stats.queries += queries
+
+class TimedCursor:
+    """
+    mysql.connector 游标包装: execute/fetch 计入当前请求的 db 耗时和 SQL 条数;
+    单条 SQL 的 execute + fetch 累计耗时超过 VSM_SLOW_QUERY_MS 时记入慢查询日志
+    """
+
+    def __init__(self, cursor, stats):
+        self._cursor = cursor
+        self._stats = stats
+        self._statement = None  # 当前结果集对应的 (sql, params)
+        self._elapsed = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def _timed(self, fn, args, kwargs, queries=0):
+        start = time.perf_counter()
+        try: return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            self._elapsed += elapsed
+            if self._stats is not None:
+                self._stats.db += elapsed
+                self._stats.queries += queries
+
+    def _finish(self):
+        """上一条 SQL 的结果已读完或被新的 execute 取代"""
+        if self._statement is not None and self._elapsed >= SLOW_QUERY_SECONDS:
+            slow_query_log.record(*self._statement, self._elapsed)
+        self._statement = None; self._elapsed = 0.0
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        self._finish()
+        self._statement = (operation, params)
+        return self._timed(self._cursor.execute, (operation, params) + args, kwargs, 1)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        self._finish()
+        self._statement = (operation, None)
+        return self._timed(self._cursor.executemany, (operation, seq_params) + args, kwargs, 1)
+
+    def fetchone(self):
+        row = self._timed(self._cursor.fetchone, (), {})
+        if row is None: self._finish()
+        return row
+
+    def fetchall(self):
+        rows = self._timed(self._cursor.fetchall, (), {})
+        self._finish()
+        return rows
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._timed(self._cursor.fetchmany, args, kwargs)
+        if not rows: self._finish()
+        return rows
+
+    def close(self):
+        self._finish()
+        return self._cursor.close()
+
+class Histogram:
+    """按标签分组的 Prometheus histogram (调用方持锁)"""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}  # labels -> [各桶计数..., sum, count]
+
+    def observe(self, labels, value):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets): series[i] += 1
+        series[-2] += value; series[-1] += 1
+
+    def render(self, label_names):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            base = ",".join(f'{k}="{metric_label(v)}"' for k, v in zip(label_names, labels))
+            cumulative = 0
+            for bound, n in zip(self.buckets, series):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{{{base},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{base},le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{base}}} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {series[-1]}")
+        return lines
+
+def metric_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class RequestMetrics:
+    """按 method + 路由模板 + 状态码汇总: 总耗时、SQL 条数、各阶段耗时"""
+
+    LABELS = ("method", "route", "status")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.duration = Histogram("vsm_http_request_duration_seconds",
+                                  "Request latency until response headers", LATENCY_BUCKETS)
+        self.queries = Histogram("vsm_http_request_db_queries", "SQL statements per request", QUERY_BUCKETS)
+        self.phases = {phase: Histogram(f"vsm_http_request_{phase}_seconds",
+                                        f"Time per request spent in {phase}", LATENCY_BUCKETS)
+                       for phase in REQUEST_PHASES}
+
+    def observe(self, method, route, status, elapsed, stats):
+        labels = (method, route, str(status))
+        with self._lock:
+            self.duration.observe(labels, elapsed)
+            self.queries.observe(labels, stats.queries)
+            for phase, hist in self.phases.items():
+                hist.observe(labels, getattr(stats, phase))
+
+    def render(self):
+        with self._lock:
+            lines = self.duration.render(self.LABELS) + self.queries.render(self.LABELS)
+            for hist in self.phases.values():
+                lines += hist.render(self.LABELS)
+        pool = db_pool.stats()
+        for key, kind in (("in_use", "gauge"), ("idle", "gauge"), ("waiting", "gauge"), ("opened", "gauge"),
+                          ("acquires", "counter"), ("timeouts", "counter"), ("discarded", "counter")):
+            name = f"vsm_db_pool_{key}" + ("_total" if kind == "counter" else "")
+            lines += [f"# TYPE {name} {kind}", f"{name} {pool[key]}"]
+        return "\n".join(lines) + "\n"
+
+request_metrics = RequestMetrics()
+
+def server_timing_header(stats, elapsed):
+    parts = [f"{phase};dur={getattr(stats, phase) * 1000:.1f}" for phase in REQUEST_PHASES]
+    parts[1] += f';desc="{stats.queries} queries"'
+    parts.append(f"total;dur={elapsed * 1000:.1f}")
+    return ", ".join(parts)
+
+class MetricsJSONResponse(JSONResponse):
+    """接口直接返回 dict 时的 JSON 编码计入 serialize"""
+
+    def render(self, content):
+        with request_timer("serialize"):
+            return super().render(content)
+
+app.router.default_response_class = MetricsJSONResponse
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """
+    流式响应只统计到响应头发出为止;
+    未匹配路由的请求归入 route="unmatched", 避免路径进入标签
+    """
+    if not METRICS_ENABLED or request.url.path == "/metrics":
+        return await call_next(request)
+    stats = RequestStats()
+    token = current_request_stats.set(stats)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - start
+        current_request_stats.reset(token)
+        route = getattr(request.scope.get("route"), "path", None) or "unmatched"
+        request_metrics.observe(request.method, route, status, elapsed, stats)
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = server_timing_header(stats, elapsed)
+    return response
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return Response(content=request_metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# ============================================================
+# Slow Query Log (慢查询指纹汇总 + EXPLAIN)
+# ============================================================
+
+SLOW_QUERY_MS = float(os.getenv("VSM_SLOW_QUERY_MS", "200"))  # <= 0 关闭
+SLOW_QUERY_SECONDS = SLOW_QUERY_MS / 1000 if SLOW_QUERY_MS > 0 else float("inf")
+SLOW_QUERY_MAX_FINGERPRINTS = 500
+SLOW_QUERY_ROWS_REFRESH = 60  # 同一指纹的 rows examined 最多每分钟从 performance_schema 刷新一次
+
+SQL_COMMENT_RE = re.compile(r"/\*.*?\*/|--[^\n]*", re.S)
+SQL_LITERAL_RE = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|\b\d+(?:\.\d+)?\b|%s")
+# 负数: 运算符/左括号/逗号/关键字之后的 "- ?" 并入字面量 (a - 5 这样的减法不受影响)
+SQL_NEGATIVE_RE = re.compile(r"((?:[=<>(,]|\b(?:AND|OR|BETWEEN|SELECT|THEN|ELSE|WHEN|LIMIT|OFFSET))\s*)-\s*\?", re.I)
+# 括号内两个以上的 ? 合并 (IN (...) / FIELD(r.id, ...) / VALUES (...)), IN/VALUES 单个 ? 也归为同一指纹
+SQL_PARAM_RUN_RE = re.compile(r"\?(?:\s*,\s*\?)+\s*(?=\))")
+SQL_VALUE_LIST_RE = re.compile(r"\b(IN|VALUES)\s*\(\s*\?\+?\s*\)(?:\s*,\s*\(\s*\?\+?\s*\))*", re.I)
+EXPLAINABLE_RE = re.compile(r"\s*\(?\s*(SELECT|UPDATE|DELETE|WITH)\b", re.I)
+
+def sql_fingerprint(sql):
+    """字面量/占位符替换为 ?, IN (...) / FIELD(...) 列表合并, 空白归一; 动态拼接的 WHERE 组合各自成为一个指纹"""
+    sql = SQL_COMMENT_RE.sub(" ", sql)
+    sql = SQL_LITERAL_RE.sub("?", sql)
+    sql = SQL_NEGATIVE_RE.sub(r"\1?", sql)
+    sql = SQL_PARAM_RUN_RE.sub("?+", sql)
+    sql = SQL_VALUE_LIST_RE.sub(r"\1 (?+)", sql)
+    return " ".join(sql.split())
+
+def params_shape(params):
+    """只记录参数类型, 如 [1, 'a', 'b', 'c'] -> "int,str*3" """
+    if params is None: return ""
+    if isinstance(params, dict):
+        return ",".join(f"{k}:{type(v).__name__}" for k, v in params.items())
+    runs = []
+    for p in params:
+        name = type(p).__name__
+        if runs and runs[-1][0] == name: runs[-1][1] += 1
+        else: runs.append([name, 1])
+    return ",".join(name if n == 1 else f"{name}*{n}" for name, n in runs)
+
+def explain_tables(plan):
+    """EXPLAIN FORMAT=JSON 中每张表的访问方式 (access_type=ALL 即全表扫描)"""
+    tables = []
+    def walk(node):
+        if isinstance(node, dict):
+            table = node.get("table")
+            if isinstance(table, dict) and "table_name" in table:
+                tables.append({"table": table["table_name"], "access_type": table.get("access_type"),
+                               "key": table.get("key"), "rows_examined_per_scan": table.get("rows_examined_per_scan")})
+            for value in node.values(): walk(value)
+        elif isinstance(node, list):
+            for value in node: walk(value)
+    walk(plan)
+    return tables
+
+class SlowQueryLog:
+    """
+    按 SQL 指纹汇总超过阈值的查询 (次数/累计/最大耗时/参数类型);
+    每个指纹首次出现时由后台线程抓取 EXPLAIN FORMAT=JSON,
+    rows examined 取自 performance_schema 按 digest 的汇总 (平均每次)
+    """
+
+    def __init__(self, max_fingerprints=SLOW_QUERY_MAX_FINGERPRINTS):
+        self.max_fingerprints = max_fingerprints
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query")
+
+    def record(self, sql, params, elapsed):
+        fingerprint = sql_fingerprint(sql)
+        key = hashlib.md5(fingerprint.encode()).hexdigest()[:12]
+        ms = round(elapsed * 1000, 1)
+        shape = params_shape(params)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            first = entry is None
+            if first:
+                if len(self._entries) >= self.max_fingerprints:
+                    self.dropped += 1
+                    logger.warning("slow query %.1fms fp=%s params=[%s] (not tracked, table full)", ms, key, shape)
+                    return
+                entry = self._entries[key] = {
+                    "id": key, "fingerprint": fingerprint, "params_shape": shape,
+                    "count": 0, "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0, "first_seen": now, "last_seen": now,
+                    "rows_examined_avg": None, "rows_checked_at": 0.0, "digest": None,
+                    "explain": None, "explain_error": None,
+                }
+            entry["count"] += 1
+            entry["total_ms"] = round(entry["total_ms"] + ms, 1)
+            entry["max_ms"] = max(entry["max_ms"], ms)
+            entry["last_ms"] = ms; entry["last_seen"] = now; entry["params_shape"] = shape
+            inspect_now = first or now - entry["rows_checked_at"] > SLOW_QUERY_ROWS_REFRESH
+            if inspect_now: entry["rows_checked_at"] = now
+            rows_examined = entry["rows_examined_avg"]
+        if inspect_now:
+            # 查询计划和 rows examined 在后台补全后再写日志, 不占用当前请求
+            self._executor.submit(self._inspect, key, sql, params, ms, shape, first)
+        else:
+            self._log(entry, ms, shape, rows_examined)
+
+    def _log(self, entry, ms, shape, rows_examined):
+        logger.warning("slow query %.1fms fp=%s params=[%s] rows_examined=%s %s",
+                       ms, entry["id"], shape, rows_examined, entry["fingerprint"][:300])
+
+    def _inspect(self, key, sql, params, ms, shape, explain):
+        entry = self._entries.get(key)
+        if entry is None: return  # 期间被 clear()
+        try:
+            conn = db_pool.acquire()
+        except Exception:
+            logger.exception("slow query inspection: no connection")
+            self._log(entry, ms, shape, entry["rows_examined_avg"]); return
+        # 直接使用底层游标, 检查语句本身不再进入慢查询统计
+        cursor = conn._raw.cursor()
+        try:
+            if explain and EXPLAINABLE_RE.match(sql):
+                try:
+                    cursor.execute("EXPLAIN FORMAT=JSON " + sql, params)
+                    plan = json.loads(cursor.fetchone()[0])
+                    with self._lock:
+                        entry["explain"] = plan
+                except Exception as e:
+                    entry["explain_error"] = str(e)[:200]
+                else:
+                    # STATEMENT_DIGEST() 需要 MySQL 8.0.22+, MariaDB / 旧版本只缺少 rows examined
+                    try:
+                        statement = cursor.statement[len("EXPLAIN FORMAT=JSON "):]
+                        cursor.execute("SELECT STATEMENT_DIGEST(%s)", (statement,))
+                        entry["digest"] = cursor.fetchone()[0]
+                    except Exception:
+                        pass
+            if entry["digest"]:
+                try:
+                    cursor.execute("""SELECT SUM_ROWS_EXAMINED / COUNT_STAR FROM performance_schema.events_statements_summary_by_digest
+                                      WHERE DIGEST = %s AND SCHEMA_NAME = DATABASE()""", (entry["digest"],))
+                    row = cursor.fetchone()
+                    if row and row[0] is not None:
+                        entry["rows_examined_avg"] = round(float(row[0]), 1)
+                except Exception:
+                    pass  # 没有 performance_schema 权限时只缺少 rows examined
+        finally:
+            cursor.close(); conn.close()
+        self._log(entry, ms, shape, entry["rows_examined_avg"])
+
+    def top(self, sort="total_ms", limit=20, explain=False):
+        with self._lock:
+            entries = sorted(self._entries.values(), key=lambda e: e.get(sort) or 0, reverse=True)[:limit]
+            out = []
+            for e in entries:
+                item = {k: v for k, v in e.items() if k not in ("explain", "rows_checked_at")}
+                item["avg_ms"] = round(e["total_ms"] / e["count"], 1)
+                item["tables"] = explain_tables(e["explain"]) if e["explain"] else None
+                item["full_scan"] = any(t["access_type"] == "ALL" for t in item["tables"] or ())
+                if explain: item["explain"] = e["explain"]
+                out.append(item)
+            return {"threshold_ms": SLOW_QUERY_MS, "tracked": len(self._entries), "dropped": self.dropped, "data": out}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear(); self.dropped = 0
+
+slow_query_log = SlowQueryLog()
+
+# ============================================================
+# Database Connection Pool
+# ============================================================
+
+DB_CONFIG = {
+    "host": os.getenv("VSM_DB_HOST", "localhost"),
+    "user": os.getenv("VSM_DB_USER", "root"),
+    "database": os.getenv("VSM_DB_NAME", "goveggie_v4"),
+    "charset": "utf8mb4",
+}
+if os.getenv("VSM_DB_PASSWORD"):
+    DB_CONFIG["password"] = os.getenv("VSM_DB_PASSWORD")
+DB_POOL_SIZE = int(os.getenv("VSM_DB_POOL_SIZE", "10"))          # 最大连接数
+DB_POOL_TIMEOUT = float(os.getenv("VSM_DB_POOL_TIMEOUT", "5"))   # 借连接最长等待(秒)
+DB_POOL_RECYCLE = int(os.getenv("VSM_DB_POOL_RECYCLE", "1800"))  # 连接最长寿命(秒)
+DB_POOL_PING_IDLE = 30  # 闲置超过该秒数, 借出前先 ping 检查
+
+class PooledConnection:
+    """从连接池借出的连接, close() 时归还而不是断开"""
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self.created_at = time.time()
+        self.last_used = self.created_at
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def cursor(self, *args, **kwargs):
+        cursor = self._raw.cursor(*args, **kwargs)
+        stats = current_request_stats.get()
+        if stats is None and SLOW_QUERY_MS <= 0: return cursor
+        return TimedCursor(cursor, stats)
+
+    def close(self):
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            pool.release(self)
+
+class DBPool:
+    """有上限的 MySQL 连接池: 超时等待、失效检测/回收、使用统计"""
+
+    def __init__(self, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, recycle=DB_POOL_RECYCLE):
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self._cond = threading.Condition()
+        self._idle = []
+        self._opened = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.acquires = 0
+        self.timeouts = 0
+        self.discarded = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _connect(self):
+        return mysql.connector.connect(**DB_CONFIG)
+
+    def _discard(self, raw):
+        self.discarded += 1
+        try: raw.close()
+        except Exception: pass
+
+    def acquire(self):
+        start = time.time()
+        deadline = start + self.timeout
+        with self._cond:
+            self.waiting += 1
+            try:
+                while not self._idle and self._opened >= self.size:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise HTTPException(status_code=503, detail="Database busy, please retry")
+                    self._cond.wait(remaining)
+                if self._idle:
+                    conn = self._idle.pop()
+                else:
+                    conn = None
+                    self._opened += 1
+                self.in_use += 1
+            finally:
+                self.waiting -= 1
+            waited = time.time() - start
+            self.acquires += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+        try:
+            if conn is not None:
+                now = time.time()
+                if now - conn.created_at > self.recycle:
+                    self._discard(conn._raw); conn = None
+                elif now - conn.last_used > DB_POOL_PING_IDLE:
+                    try: conn._raw.ping(reconnect=False)
+                    except Exception:
+                        self._discard(conn._raw); conn = None
+            if conn is None:
+                conn = PooledConnection(self, self._connect())
+            conn._pool = self
+            return conn
+        except Exception:
+            with self._cond:
+                self._opened -= 1; self.in_use -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn):
+        raw = conn._raw
+        healthy = True
+        try:
+            # 结束未提交的事务, 避免下一个借用者读到旧快照
+            raw.rollback()
+        except Exception:
+            healthy = False
+        with self._cond:
+            self.in_use -= 1
+            if healthy and time.time() - conn.created_at <= self.recycle:
+                conn.last_used = time.time()
+                self._idle.append(conn)
+            else:
+                self._opened -= 1
+                self._discard(raw)
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self.size,
+                "opened": self._opened,
+                "in_use": self.in_use,
+                "idle": len(self._idle),
+                "waiting": self.waiting,
+                "acquires": self.acquires,
+                "timeouts": self.timeouts,
+                "discarded": self.discarded,
+                "wait_avg_ms": round(self.wait_total / self.acquires * 1000, 3) if self.acquires else 0.0,
+                "wait_max_ms": round(self.wait_max * 1000, 3),
+            }
+
+db_pool = DBPool()
+
 def get_db():
-    return mysql.connector.connect(
-        host="localhost",
-        user="root",
-        database="goveggie_v4",
-        charset="utf8mb4",
-    )
+    with request_timer("connect"):
+        return db_pool.acquire()
+
+@contextmanager
+def db_cursor(dictionary=True):
+    """with db_cursor() as (db, cursor): ... 自动关闭游标并归还连接"""
+    db = get_db(); cursor = db.cursor(dictionary=dictionary)
+    try: yield db, cursor
+    finally: cursor.close(); db.close()
+
+# ============================================================
+# Async Database Access (热点接口使用)
+# ============================================================
+
+# 1: 使用 aiomysql 原生异步连接池 (需 pip install aiomysql); 0: 在线程池中使用上面的同步连接池
+DB_ASYNC = os.getenv("VSM_DB_ASYNC", "0") == "1"
+aio_pool = None
+aiomysql = None
+
+def drive_steps(steps, run, first):
+    """依次执行 steps 产生的查询并把结果送回, 返回 steps 的返回值 (run 为同步执行函数)"""
+    query = first
+    try:
+        while True: query = steps.send(run(*query))
+    except StopIteration as stop:
+        return stop.value
+
+class ThreadedSession:
+    """同步连接上的 async 接口, 每条 SQL 交给线程池执行; run() 把一组查询合并为一次线程池调用"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def _run(self, sql, params, fetch, decode=False):
+        cursor = self.conn.cursor(dictionary=True, buffered=True)
+        try:
+            cursor.execute(sql, params)
+            if fetch is None: return cursor.rowcount
+            rows = cursor.fetchall() if fetch == "all" else [r for r in [cursor.fetchone()] if r]
+            if decode: decode_rows(cursor, rows)
+            return rows if fetch == "all" else (rows[0] if rows else None)
+        finally: cursor.close()
+
+    async def execute(self, sql, params=()):
+        return await run_in_threadpool(self._run, sql, params, None)
+
+    async def fetchall(self, sql, params=(), decode=False):
+        """decode=True: 按列类型解析 JSON 字段 / DECIMAL (见 RowDecoder)"""
+        return await run_in_threadpool(self._run, sql, params, "all", decode)
+
+    async def fetchone(self, sql, params=(), decode=False):
+        return await run_in_threadpool(self._run, sql, params, "one", decode)
+
+    async def commit(self):
+        await run_in_threadpool(self.conn.commit)
+
+    async def run(self, steps):
+        """执行查询步骤 (见 run_db); 不需要查询时不进线程池"""
+        try: first = steps.send(None)
+        except StopIteration as stop: return stop.value
+        return await run_in_threadpool(drive_steps, steps, self._run, first)
+
+class AioSession:
+    """aiomysql 连接, 接口与 ThreadedSession 一致"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def _run(self, sql, params, fetch, decode=False):
+        async with self.conn.cursor(aiomysql.DictCursor) as cursor:
+            start = time.perf_counter()
+            with request_timer("db", queries=1):
+                await cursor.execute(sql, tuple(params))
+                if fetch is None: rows = None
+                else: rows = list(await cursor.fetchall()) if fetch == "all" else [r for r in [await cursor.fetchone()] if r]
+            elapsed = time.perf_counter() - start
+            if elapsed >= SLOW_QUERY_SECONDS: slow_query_log.record(sql, tuple(params), elapsed)
+            if fetch is None: return cursor.rowcount
+            if decode: decode_rows(cursor, rows)
+            return rows if fetch == "all" else (rows[0] if rows else None)
+
+    async def execute(self, sql, params=()):
+        return await self._run(sql, params, None)
+
+    async def fetchall(self, sql, params=(), decode=False):
+        return await self._run(sql, params, "all", decode)
+
+    async def fetchone(self, sql, params=(), decode=False):
+        return await self._run(sql, params, "one", decode)
+
+    async def commit(self):
+        await self.conn.commit()
+
+    async def run(self, steps):
+        result = None
+        try:
+            while True: result = await self._run(*steps.send(result))
+        except StopIteration as stop:
+            return stop.value
+
+async def run_db(steps):
+    """
+    steps: 生成器, yield (sql, params, fetch, decode) 取得查询结果 (fetch 为 "all" / "one" / None), return 最终结果
+    同一连接上依次执行, 不需要查询时不借连接;
+    线程池模式下借连接、全部查询、归还连接合并为一次线程池调用 (逐条 await 每条都要进出一次线程池)
+    """
+    try: first = steps.send(None)
+    except StopIteration as stop: return stop.value
+    if aio_pool is not None:
+        async with async_db() as db:
+            return await db.run(_resume(first, steps))
+
+    def run():
+        conn = get_db()
+        try: return drive_steps(steps, ThreadedSession(conn)._run, first)
+        finally: conn.close()
+    return await run_in_threadpool(run)
+
+def _resume(first, steps):
+    """已经取出第一条查询的 steps 重新包装成完整的生成器"""
+    result = yield first
+    while True:
+        try: query = steps.send(result)
+        except StopIteration as stop: return stop.value
+        result = yield query
+
+@asynccontextmanager
+async def async_db():
+    """async with async_db() as db: rows = await db.fetchall(sql, params)"""
+    if aio_pool is not None:
+        try:
+            with request_timer("connect"):
+                conn = await asyncio.wait_for(aio_pool.acquire(), DB_POOL_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Database busy, please retry")
+        try: yield AioSession(conn)
+        finally:
+            try: await conn.rollback()
+            finally: aio_pool.release(conn)
+    else:
+        conn = await run_in_threadpool(get_db)
+        try: yield ThreadedSession(conn)
+        finally: await run_in_threadpool(conn.close)
+
+async def ensure_fresh_async(cache):
+    """内存索引需要同步时才进线程池, 平时不占用线程"""
+    if cache.needs_sync():
+        await run_in_threadpool(cache.ensure_fresh)
+
+@app.on_event("startup")
+async def start_async_db_pool():
+    global aio_pool, aiomysql
+    if not DB_ASYNC: return
+    import aiomysql as _aiomysql
+    aiomysql = _aiomysql
+    aio_pool = await aiomysql.create_pool(
+        host=DB_CONFIG["host"], user=DB_CONFIG["user"], password=DB_CONFIG.get("password", ""),
+        db=DB_CONFIG["database"], charset=DB_CONFIG["charset"],
+        minsize=1, maxsize=DB_POOL_SIZE, pool_recycle=DB_POOL_RECYCLE, autocommit=False)
+
+@app.on_event("shutdown")
+async def close_async_db_pool():
+    if aio_pool is not None:
+        aio_pool.close()
+        await aio_pool.wait_closed()
 
 def parse_json_field(val):
     if val is None: return None
@@ -93,15 +795,1274 @@ def parse_json_field(val):
         except: return val
     return val
 
+JSON_FIELDS = ('phones', 'time_slots', 'rest_days', 'diet_tags', 'food_tags', 'facility_tags', 'photos', 'business_hours', 'device_tokens', 'preferences')
+
 def row_to_dict(row):
-    from decimal import Decimal
-    json_fields = ['phones', 'time_slots', 'rest_days', 'diet_tags', 'food_tags', 'facility_tags', 'photos', 'business_hours', 'device_tokens', 'preferences']
-    for f in json_fields:
+    for f in JSON_FIELDS:
         if f in row: row[f] = parse_json_field(row[f])
     for key, value in row.items():
         if isinstance(value, Decimal): row[key] = float(value)
     return row
 
+# MySQL 协议字段类型 (mysql.connector FieldType / pymysql FIELD_TYPE 取值相同)
+FIELD_TYPE_DECIMAL = (0, 246)       # DECIMAL, NEWDECIMAL
+FIELD_TYPE_JSON = 245
+FIELD_TYPE_DATETIME = (7, 10, 12)   # TIMESTAMP, DATE, DATETIME
+
+def _to_float(value):
+    return float(value) if isinstance(value, Decimal) else value
+
+def _to_isoformat(value):
+    return value.isoformat() if isinstance(value, (datetime, date)) else value
+
+class RowDecoder:
+    """
+    按 cursor.description 一次生成每列的转换计划 (JSON 字段解析 / DECIMAL -> float),
+    再批量套用到整批结果, 效果与逐行 row_to_dict 相同但不再逐列判断类型
+    datetimes=True 时日期时间列直接转为 isoformat 字符串 (直接输出 JSON 时可省去编码器的处理)
+    """
+
+    def __init__(self, description, datetimes=False):
+        plan = []
+        for col in description or ():
+            name, type_code = col[0], col[1]
+            if name in JSON_FIELDS or type_code == FIELD_TYPE_JSON:
+                plan.append((name, parse_json_field))
+            elif type_code in FIELD_TYPE_DECIMAL:
+                plan.append((name, _to_float))
+            elif datetimes and type_code in FIELD_TYPE_DATETIME:
+                plan.append((name, _to_isoformat))
+        self.plan = plan
+
+    def decode(self, rows):
+        plan = self.plan
+        if not plan: return rows
+        with request_timer("decode"):
+            for row in rows:
+                for name, convert in plan:
+                    value = row[name]
+                    if value is not None: row[name] = convert(value)
+        return rows
+
+def decode_rows(cursor, rows, datetimes=False):
+    """rows = decode_rows(cursor, cursor.fetchall())"""
+    return RowDecoder(cursor.description, datetimes).decode(rows)
+
+# ============================================================
+# TTL Cache
+# ============================================================
+
+class TTLCache:
+    """线程安全的 TTL + LRU 缓存 (超出 maxsize 时淘汰最久未使用的; maxsize=None 不限数量, 只按 TTL 过期)"""
+
+    def __init__(self, ttl, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.time():
+                if item is not None: del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while self.maxsize is not None and len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return item[1] if item else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def purge(self):
+        """删除已过期的条目 (get 只清理被访问到的)"""
+        now = time.time()
+        with self._lock:
+            for key in [k for k, (expires_at, _) in self._data.items() if expires_at < now]:
+                del self._data[key]
+
+    def delete_where(self, predicate):
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def __len__(self):
+        return len(self._data)
+
+# ============================================================
+# Token Verification Cache
+# ============================================================
+
+TOKEN_CACHE_SIZE = int(os.getenv("VSM_TOKEN_CACHE_SIZE", "50000"))
+TOKEN_CACHE_TTL = 3600  # 最长缓存时间, 同时不超过 token 自身的 exp
+
+token_cache = TTLCache(TOKEN_CACHE_TTL, maxsize=TOKEN_CACHE_SIZE)
+# 摘要 -> True, 保留到 token 过期; 不限数量 (淘汰会让已吊销的 token 重新生效), 过期条目定期清理
+revoked_tokens = TTLCache(365 * 86400, maxsize=None)
+REVOKED_PURGE_INTERVAL = 600
+revoked_purged_at = 0.0
+token_revocation_hooks = []  # 额外的吊销检查 (如共享存储): hook(digest, payload) 返回 True 表示已吊销
+
+def token_digest(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def is_token_revoked(digest, payload):
+    if revoked_tokens.get(digest): return True
+    return any(hook(digest, payload) for hook in token_revocation_hooks)
+
+def decode_token(token):
+    """jwt.decode + LRU 缓存 (key 为 token 的 sha256); 过期或已吊销时抛出异常"""
+    digest = token_digest(token)
+    payload = token_cache.get(digest)
+    now = time.time()
+    if payload is None or payload.get('exp', now + 1) <= now:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        ttl = min(TOKEN_CACHE_TTL, payload['exp'] - now) if 'exp' in payload else TOKEN_CACHE_TTL
+        token_cache.set(digest, payload, ttl=ttl)
+    if is_token_revoked(digest, payload):
+        raise jwt.InvalidTokenError("Token revoked")
+    return dict(payload)
+
+def revoke_token(token):
+    """
+    吊销名单只在当前进程内存中: 多 worker 部署时, 其他 worker 上该 token 在过期前仍然有效,
+    重启后名单也会丢失; 需要全局生效时通过 token_revocation_hooks 接入共享存储
+    """
+    global revoked_purged_at
+    digest = token_digest(token)
+    payload = token_cache.pop(digest)
+    ttl = None
+    if payload and 'exp' in payload: ttl = max(1, payload['exp'] - time.time())
+    revoked_tokens.set(digest, True, ttl=ttl)
+    if time.time() - revoked_purged_at >= REVOKED_PURGE_INTERVAL:
+        revoked_purged_at = time.time()
+        revoked_tokens.purge()
+
+# ============================================================
+# Geo Index (附近餐厅内存空间索引)
+# ============================================================
+
+EARTH_RADIUS_M = 6371000
+GEO_INDEX_ENABLED = os.getenv("VSM_GEO_INDEX", "1") == "1"
+GEO_CELL_DEG = 0.05           # 网格边长约 5.5km
+GEO_SYNC_INTERVAL = 30        # 增量同步间隔(秒), 按 updated_at
+GEO_FULL_RELOAD_INTERVAL = 600  # 全量重建间隔(秒), 兜底处理硬删除
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1; dl = math.radians(lng2 - lng1)
+    h = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(h)))
+
+class SyncedCache:
+    """
+    从数据库同步的内存结构基类
+    子类实现 sync(full), ensure_fresh() 负责节流: 首次加载阻塞, 之后由一个线程刷新, 其他线程直接用旧数据
+    """
+    sync_interval = 30
+    full_interval = 600
+
+    def __init__(self):
+        self._sync_lock = threading.Lock()
+        self.loaded = False
+        self.watermark = None
+        self.last_sync = 0.0
+        self.last_full = 0.0
+
+    def sync(self, full=False):
+        raise NotImplementedError
+
+    def needs_sync(self):
+        return not self.loaded or time.time() - self.last_sync >= self.sync_interval
+
+    def ensure_fresh(self):
+        now = time.time()
+        if self.loaded and now - self.last_sync < self.sync_interval:
+            return
+        if not self._sync_lock.acquire(blocking=not self.loaded):
+            return
+        try:
+            if self.loaded and time.time() - self.last_sync < self.sync_interval:
+                return
+            self.sync(full=now - self.last_full >= self.full_interval)
+        finally:
+            self._sync_lock.release()
+
+class GeoIndex(SyncedCache):
+    """
+    餐厅坐标的网格索引 (lat/lng 按 GEO_CELL_DEG 分桶)
+    半径查询只扫描包围盒覆盖的格子, 代价与附近餐厅数量相关而非全表
+    """
+    sync_interval = GEO_SYNC_INTERVAL
+    full_interval = GEO_FULL_RELOAD_INTERVAL
+
+    def __init__(self, cell_deg=GEO_CELL_DEG):
+        super().__init__()
+        self.cell_deg = cell_deg
+        self._lock = threading.RLock()
+        self._cells = {}    # (cx, cy) -> {id: (lat, lng)}
+        self._points = {}   # id -> (lat, lng, cell)
+
+    def _cell(self, lat, lng):
+        return (int(math.floor(lat / self.cell_deg)), int(math.floor(lng / self.cell_deg)))
+
+    def __len__(self):
+        return len(self._points)
+
+    def upsert(self, rid, lat, lng):
+        with self._lock:
+            self.remove(rid)
+            cell = self._cell(lat, lng)
+            self._cells.setdefault(cell, {})[rid] = (lat, lng)
+            self._points[rid] = (lat, lng, cell)
+
+    def remove(self, rid):
+        with self._lock:
+            old = self._points.pop(rid, None)
+            if old:
+                bucket = self._cells.get(old[2])
+                if bucket is not None:
+                    bucket.pop(rid, None)
+                    if not bucket: del self._cells[old[2]]
+
+    def within(self, lat, lng, radius_m):
+        """返回半径内的 [(id, distance_m)], 按距离升序"""
+        dlat = radius_m / 111320.0
+        dlng = radius_m / (111320.0 * max(0.01, math.cos(math.radians(lat))))
+        cx0, cy0 = self._cell(lat - dlat, lng - dlng)
+        cx1, cy1 = self._cell(lat + dlat, lng + dlng)
+        hits = []
+        with self._lock:
+            if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self._cells):
+                buckets = list(self._cells.values())
+            else:
+                buckets = [self._cells[c] for c in
+                           ((x, y) for x in range(cx0, cx1 + 1) for y in range(cy0, cy1 + 1))
+                           if c in self._cells]
+            for bucket in buckets:
+                for rid, (plat, plng) in bucket.items():
+                    if abs(plat - lat) > dlat or abs(plng - lng) > dlng: continue
+                    d = haversine_m(lat, lng, plat, plng)
+                    if d <= radius_m: hits.append((rid, d))
+        hits.sort(key=lambda h: (h[1], h[0]))
+        return hits
+
+    def _apply(self, rows):
+        for row in rows:
+            if row['location_lat'] is None or row['location_lng'] is None:
+                self.remove(row['id']); continue
+            f_lat = float(row['location_lat']); f_lng = float(row['location_lng'])
+            if abs(f_lat) < 0.1 and abs(f_lng) < 0.1:
+                self.remove(row['id']); continue
+            self.upsert(row['id'], f_lat, f_lng)
+            if row.get('updated_at') and (self.watermark is None or row['updated_at'] > self.watermark):
+                self.watermark = row['updated_at']
+
+    def sync(self, full=False):
+        """从数据库同步: 首次/定期全量, 其余按 updated_at 增量"""
+        with db_cursor() as (db, cursor):
+            cols = "SELECT id, location_lat, location_lng, updated_at FROM restaurants"
+            if full or not self.loaded or self.watermark is None:
+                cursor.execute(cols)
+                rows = cursor.fetchall()
+                with self._lock:
+                    self._cells.clear(); self._points.clear(); self.watermark = None
+                    self._apply(rows)
+                self.last_full = time.time(); self.loaded = True
+            else:
+                cursor.execute(cols + " WHERE updated_at >= %s", (self.watermark,))
+                rows = cursor.fetchall()
+                with self._lock:
+                    self._apply(rows)
+            self.last_sync = time.time()
+
+geo_index = GeoIndex()
+
+# ============================================================
+# Catalogue Snapshot (全量餐厅快照 + 增量同步)
+# ============================================================
+
+CATALOGUE_SYNC_INTERVAL = 30
+CATALOGUE_FULL_RELOAD_INTERVAL = 600
+
+# 州属/地区按整数外键关联, state_id/area_id 由 state_area_ids_migration.sql 回填并用触发器维护
+LOCATION_JOINS = """LEFT JOIN states s ON s.id = r.state_id
+              LEFT JOIN areas a ON a.id = r.area_id"""
+
+# 与 list_restaurants 返回结构一致
+RESTAURANT_DETAIL_SQL = f"""SELECT r.*, 
+                     s.name as state_name, s.name_zh as state_name_zh, 
+                     a.area as area_name, a.area_zh as area_name_zh
+              FROM restaurants r 
+              {LOCATION_JOINS}"""
+
+def json_default(o):
+    if isinstance(o, (datetime, date)): return o.isoformat()
+    if isinstance(o, Decimal): return float(o)
+    if isinstance(o, (bytes, bytearray)): return o.decode("utf-8", "replace")
+    return str(o)
+
+try:
+    import orjson  # 可选: 大响应编码快数倍, 没有安装时使用标准库
+except ImportError:
+    orjson = None
+
+def dump_json(obj):
+    with request_timer("serialize"):
+        if orjson is not None:
+            return orjson.dumps(obj, default=json_default, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(obj, ensure_ascii=False, default=json_default, separators=(",", ":")).encode("utf-8")
+
+STREAM_CHUNK_ROWS = 200
+
+def stream_json_rows(sql, params, head, decode=None, tail=None, chunk=STREAM_CHUNK_ROWS):
+    """
+    服务端游标 (unbuffered) 分块读取, 逐块解码 (RowDecoder) 并编码输出 {head..., "data": [...], tail...}
+    内存占用只与 chunk 有关; tail(last_row, count) 返回 data 之后的字段
+    连接在生成器开始迭代时才借出、结束时归还: 响应没开始发送就断开时生成器不会执行, 不会占住连接
+    """
+    conn = get_db()
+    cursor = None
+    done = False
+    try:
+        cursor = conn.cursor(dictionary=True, buffered=False)
+        cursor.execute(sql, params)
+        decoder = RowDecoder(cursor.description)
+        prefix = dump_json(head)[:-1]
+        yield prefix + (b',"data":[' if head else b'"data":[')
+        last = None; count = 0
+        while True:
+            rows = cursor.fetchmany(chunk)
+            if not rows: break
+            decoder.decode(rows)
+            if decode: rows = [decode(r) for r in rows]
+            yield (b"," if count else b"") + b",".join(dump_json(r) for r in rows)
+            last = rows[-1]; count += len(rows)
+        done = True
+        extra = tail(last, count) if tail else None
+        yield b"]" + (b"," + dump_json(extra)[1:] if extra else b"}")
+    finally:
+        try:
+            if cursor is not None:
+                if not done: conn.consume_results()  # 客户端中途断开时丢弃未读结果
+                cursor.close()
+        except Exception:
+            logger.exception("stream cursor cleanup failed")
+        conn.close()
+
+class Catalogue(SyncedCache):
+    """
+    active 餐厅的版本化快照
+    每条记录带最后变更版本号, 删除/下架记录保留墓碑, 以便按 since 计算增量
+    版本号取毫秒时间戳(单调递增), 进程重启后旧版本号小于 base_version, 客户端会拿到全量
+    """
+    sync_interval = CATALOGUE_SYNC_INTERVAL
+    full_interval = CATALOGUE_FULL_RELOAD_INTERVAL
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.RLock()
+        self.version = 0
+        self.base_version = 0
+        self._rows = {}      # id -> row dict
+        self._changed = {}   # id -> 最后变更版本
+        self._removed = {}   # id -> 删除版本
+        self._body = None
+        self._body_gz = None
+
+    def _next_version(self):
+        self.version = max(self.version + 1, int(time.time() * 1000))
+        return self.version
+
+    def _apply(self, rows, present_ids=None):
+        """rows 为最新数据; present_ids 不为空时, 不在其中的记录视为删除"""
+        version = None
+        for row in rows:
+            rid = row['id']
+            if row.get('updated_at') and (self.watermark is None or row['updated_at'] > self.watermark):
+                self.watermark = row['updated_at']
+            if row.get('status') != 'active':
+                if rid in self._rows:
+                    version = version or self._next_version()
+                    del self._rows[rid]; self._changed.pop(rid, None); self._removed[rid] = version
+                continue
+            row = row_to_dict(row)
+            if self._rows.get(rid) == row: continue
+            version = version or self._next_version()
+            self._rows[rid] = row; self._changed[rid] = version; self._removed.pop(rid, None)
+        if present_ids is not None:
+            for rid in [rid for rid in self._rows if rid not in present_ids]:
+                version = version or self._next_version()
+                del self._rows[rid]; self._changed.pop(rid, None); self._removed[rid] = version
+        if version:
+            self._body = self._body_gz = None
+            count_cache.clear()  # 餐厅有变化, 分页总数随之失效
+        return version
+
+    def sync(self, full=False):
+        with db_cursor() as (db, cursor):
+            if full or not self.loaded or self.watermark is None:
+                cursor.execute(RESTAURANT_DETAIL_SQL + " ORDER BY r.id")
+                rows = cursor.fetchall()
+                with self._lock:
+                    self._apply(rows, present_ids={r['id'] for r in rows if r.get('status') == 'active'})
+                    if not self.loaded:
+                        self.base_version = self.version = self.version or self._next_version()
+                self.last_full = time.time(); self.loaded = True
+            else:
+                cursor.execute(RESTAURANT_DETAIL_SQL + " WHERE r.updated_at >= %s ORDER BY r.id", (self.watermark,))
+                rows = cursor.fetchall()
+                with self._lock:
+                    self._apply(rows)
+            self.last_sync = time.time()
+
+    @property
+    def etag(self):
+        return f'"cat-{self.version}"'
+
+    def snapshot(self):
+        """返回 (json bytes, gzip bytes, version), 同一版本只序列化/压缩一次"""
+        with self._lock:
+            if self._body is None:
+                data = [self._rows[rid] for rid in sorted(self._rows, reverse=True)]
+                self._body = dump_json({"version": self.version, "full": True, "total": len(data), "data": data})
+                self._body_gz = gzip.compress(self._body, compresslevel=6)
+            return self._body, self._body_gz, self.version
+
+    def delta(self, since):
+        """since 之后新增/变更/删除的记录; since 早于本进程基线时返回 None (需要全量)"""
+        with self._lock:
+            if since < self.base_version or since > self.version:
+                return None
+            changed = [self._rows[rid] for rid, v in self._changed.items() if v > since]
+            removed = [rid for rid, v in self._removed.items() if v > since]
+            return {"version": self.version, "since": since, "full": False,
+                    "changed": changed, "removed": removed}
+
+    def rows(self):
+        """(version, 当前 active 记录列表)"""
+        with self._lock:
+            return self.version, list(self._rows.values())
+
+catalogue = Catalogue()
+
+# ============================================================
+# Map Clusters (按缩放级别预先聚合, supercluster 算法的简化版)
+# ============================================================
+
+CLUSTER_MIN_ZOOM = 0
+CLUSTER_MAX_ZOOM = 16       # 超过该级别直接返回单点
+CLUSTER_RADIUS = 60         # 聚合半径 (像素, 相对 CLUSTER_EXTENT 的瓦片大小)
+CLUSTER_EXTENT = 512
+CLUSTER_POINT_FIELDS = ('name_zh', 'name_en', 'cover_photo', 'recommended', 'price_level')
+
+def mercator_x(lng):
+    return lng / 360.0 + 0.5
+
+def mercator_y(lat):
+    s = math.sin(math.radians(max(-85.0511, min(85.0511, lat))))
+    return 0.5 - 0.25 * math.log((1 + s) / (1 - s)) / math.pi
+
+def mercator_lng(x):
+    return (x - 0.5) * 360.0
+
+def mercator_lat(y):
+    return math.degrees(math.atan(math.exp(math.pi * (1 - 2 * y)))) * 2 - 90
+
+class ClusterIndex:
+    """
+    每个缩放级别一组节点 (x, y, count, key, expansion_zoom, props), 按 x 排序
+    从最大级别逐级向上, 把半径内的节点合并成加权中心点; 视口查询为一次二分 + y 过滤
+    数据来自 catalogue 快照, 版本变化时重建
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        self._levels = {}   # zoom -> (xs, nodes)
+
+    @staticmethod
+    def _cluster(nodes, zoom):
+        r = CLUSTER_RADIUS / (CLUSTER_EXTENT * 2 ** zoom)
+        grid = {}
+        for i, node in enumerate(nodes):
+            grid.setdefault((int(node[0] / r), int(node[1] / r)), []).append(i)
+        merged = [False] * len(nodes)
+        out = []
+        for i, (x, y, count, key, expansion, props) in enumerate(nodes):
+            if merged[i]: continue
+            merged[i] = True
+            cx, cy = int(x / r), int(y / r)
+            members = [i]
+            for gx in (cx - 1, cx, cx + 1):
+                for gy in (cy - 1, cy, cy + 1):
+                    for j in grid.get((gx, gy), ()):
+                        if not merged[j] and (nodes[j][0] - x) ** 2 + (nodes[j][1] - y) ** 2 <= r * r:
+                            merged[j] = True; members.append(j)
+            if len(members) == 1:
+                out.append(nodes[i]); continue
+            total = sum(nodes[j][2] for j in members)
+            wx = sum(nodes[j][0] * nodes[j][2] for j in members) / total
+            wy = sum(nodes[j][1] * nodes[j][2] for j in members) / total
+            out.append((wx, wy, total, f"c{zoom}-{len(out)}", zoom + 1, None))
+        return out
+
+    def build(self, rows):
+        nodes = []
+        for row in sorted(rows, key=lambda r: r['id']):
+            lat, lng = row.get('location_lat'), row.get('location_lng')
+            if lat is None or lng is None: continue
+            lat, lng = float(lat), float(lng)
+            if abs(lat) < 0.1 and abs(lng) < 0.1: continue
+            props = {f: row.get(f) for f in CLUSTER_POINT_FIELDS}
+            nodes.append((mercator_x(lng), mercator_y(lat), 1, row['id'], None, props))
+        levels = {}
+        for zoom in range(CLUSTER_MAX_ZOOM + 1, CLUSTER_MIN_ZOOM - 1, -1):
+            if zoom <= CLUSTER_MAX_ZOOM:
+                nodes = self._cluster(nodes, zoom)
+            ordered = sorted(nodes, key=lambda n: n[0])
+            levels[zoom] = ([n[0] for n in ordered], ordered)
+        return levels
+
+    def ensure_fresh(self):
+        catalogue.ensure_fresh()
+        if self.version == catalogue.version: return
+        with self._lock:
+            if self.version == catalogue.version: return
+            version, rows = catalogue.rows()
+            self._levels = self.build(rows)
+            self.version = version
+
+    def query(self, west, south, east, north, zoom):
+        zoom = max(CLUSTER_MIN_ZOOM, min(CLUSTER_MAX_ZOOM + 1, zoom))
+        xs, nodes = self._levels.get(zoom, ([], []))
+        x0, x1 = mercator_x(west), mercator_x(east)
+        y0, y1 = mercator_y(north), mercator_y(south)
+        out = []
+        for x, y, count, key, expansion, props in nodes[bisect.bisect_left(xs, x0):bisect.bisect_right(xs, x1)]:
+            if not (y0 <= y <= y1): continue
+            item = {"lat": round(mercator_lat(y), 6), "lng": round(mercator_lng(x), 6)}
+            if props is None:
+                item.update(type="cluster", id=key, count=count, expansion_zoom=expansion)
+            else:
+                item.update(type="point", id=key, **props)
+            out.append(item)
+        return zoom, out
+
+cluster_index = ClusterIndex()
+
+# ============================================================
+# Search Index (倒排索引: 单字 + 二元组, 兼顾中文与英文子串搜索)
+# ============================================================
+
+SEARCH_INDEX_ENABLED = os.getenv("VSM_SEARCH_INDEX", "1") == "1"
+# 字段 -> 相关度权重
+SEARCH_FIELDS = {
+    "name_zh": 10,
+    "name_en": 10,
+    "phones": 6,
+    "recommended_dishes": 4,
+    "address": 3,
+    "description": 1,
+}
+SEARCH_NAME_FIELDS = ("name_zh", "name_en")
+
+def normalize_text(val):
+    return " ".join(str(val).lower().split()) if val else ""
+
+def text_grams(text):
+    """单字 + 相邻二元组; 中文无需分词, 英文子串同样可命中"""
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    grams.discard(" ")
+    return grams
+
+def query_grams(text):
+    return {text} if len(text) == 1 else {text[i:i + 2] for i in range(len(text) - 1)} - {"  "}
+
+def phone_digits(val):
+    phones = parse_json_field(val)
+    if isinstance(phones, (list, tuple)):
+        phones = " ".join(str(p) for p in phones if p)
+    return " ".join("".join(c for c in part if c.isdigit()) for part in str(phones or "").split(" ")).strip()
+
+class SearchIndex(SyncedCache):
+    """
+    餐厅搜索引擎: 候选集来自倒排表交集, 再逐字段校验子串并按字段权重打分
+    语义与原先 LIKE '%q%' 一致, 电话按纯数字子串匹配
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.RLock()
+        self._postings = {}  # gram -> set(id)
+        self._docs = {}      # id -> {field: normalized text}
+        self.meta = {}       # id -> 建议/展示用原始字段
+        self.areas = []      # [{area, area_zh, state}]
+        self.generation = 0  # 内容变化计数, 供依赖方判断是否需要重建
+
+    def _index(self, rid, doc):
+        for grams in (text_grams(t) for t in doc.values()):
+            for g in grams:
+                self._postings.setdefault(g, set()).add(rid)
+
+    def remove(self, rid):
+        with self._lock:
+            doc = self._docs.pop(rid, None); self.meta.pop(rid, None)
+            if not doc: return
+            for g in set().union(*(text_grams(t) for t in doc.values())):
+                ids = self._postings.get(g)
+                if ids is not None:
+                    ids.discard(rid)
+                    if not ids: del self._postings[g]
+
+    def upsert(self, row):
+        rid = row['id']
+        doc = {f: normalize_text(row.get(f)) for f in SEARCH_FIELDS if f != "phones"}
+        doc["phones"] = phone_digits(row.get('phones'))
+        meta = {k: row.get(k) for k in ("name_zh", "name_en", "state", "area", "recommended_dishes", "recommended")}
+        with self._lock:
+            if self._docs.get(rid) == doc and self.meta.get(rid) == meta:
+                return False
+            self.remove(rid)
+            self._docs[rid] = doc
+            self.meta[rid] = meta
+            self._index(rid, doc)
+            return True
+
+    def _candidates(self, grams):
+        sets = [self._postings.get(g) for g in grams]
+        if not sets or any(not ids for ids in sets): return set()
+        sets.sort(key=len)
+        out = set(sets[0])
+        for ids in sets[1:]:
+            out &= ids
+            if not out: break
+        return out
+
+    def search(self, q, fields=None, limit=None):
+        """返回 [(id, score)], 按相关度降序; fields 限定匹配字段"""
+        text = normalize_text(q)
+        if not text: return []
+        fields = fields or tuple(SEARCH_FIELDS)
+        digits = "".join(c for c in text if c.isdigit())
+        use_phone = "phones" in fields and len(digits) >= 4
+        with self._lock:
+            cands = self._candidates(query_grams(text))
+            if use_phone:
+                cands |= self._candidates(query_grams(digits))
+            hits = []
+            for rid in cands:
+                doc = self._docs[rid]; score = 0
+                for f in fields:
+                    val = doc.get(f)
+                    if not val: continue
+                    needle = digits if f == "phones" else text
+                    if f == "phones" and not use_phone: continue
+                    if needle in val:
+                        w = SEARCH_FIELDS[f]
+                        score += w * 3 if val == needle else w * 2 if val.startswith(needle) else w
+                if score: hits.append((rid, score))
+        hits.sort(key=lambda h: (-h[1], -h[0]))
+        return hits[:limit] if limit else hits
+
+    def match_areas(self, q, limit):
+        text = normalize_text(q)
+        out = []
+        for a in self.areas:
+            if text in normalize_text(a['area']) or text in normalize_text(a['area_zh']):
+                out.append(a)
+                if len(out) >= limit: break
+        return out
+
+    def sync(self, full=False):
+        cols = "SELECT id, name_zh, name_en, address, recommended_dishes, description, phones, state, area, recommended, updated_at FROM restaurants"
+        with db_cursor() as (db, cursor):
+            if full or not self.loaded or self.watermark is None:
+                cursor.execute(cols)
+                rows = cursor.fetchall()
+                cursor.execute("SELECT DISTINCT area, area_zh, state FROM areas")
+                areas = cursor.fetchall()
+                with self._lock:
+                    self._postings.clear(); self._docs.clear(); self.meta.clear(); self.watermark = None
+                    self.areas = areas
+                    self._apply(rows)
+                    self.generation += 1
+                self.last_full = time.time(); self.loaded = True
+            else:
+                cursor.execute(cols + " WHERE updated_at >= %s", (self.watermark,))
+                rows = cursor.fetchall()
+                with self._lock:
+                    self._apply(rows)
+            self.last_sync = time.time()
+
+    def _apply(self, rows):
+        changed = False
+        for row in rows:
+            changed = self.upsert(row) or changed
+            if row.get('updated_at') and (self.watermark is None or row['updated_at'] > self.watermark):
+                self.watermark = row['updated_at']
+        if changed:
+            self.generation += 1
+            count_cache.clear()
+
+search_index = SearchIndex()
+
+# ============================================================
+# Suggestion Index (搜索框自动补全, 有序数组 + bisect 前缀查找)
+# ============================================================
+
+SUGGEST_REFRESH_INTERVAL = 30
+HOT_KEYWORDS = ["素食", "vegan", "火锅", "早餐", "经济饭", "咖啡", "Kuala Lumpur", "Penang"]
+SUGGEST_TYPE_ORDER = {"restaurant": 0, "area": 1, "dish": 2, "hot": 3}
+SUGGEST_HOT_WEIGHT = 1000
+
+def is_cjk(ch):
+    return "\u3400" <= ch <= "\u9fff" or "\uf900" <= ch <= "\ufaff"
+
+def suggest_keys(text):
+    """整串 + 每个英文单词起点 + 每个中文字符起点, 前缀查找即可覆盖词中匹配"""
+    norm = normalize_text(text)
+    if not norm: return set()
+    keys = {norm}
+    for i in range(1, len(norm)):
+        if norm[i] != " " and (norm[i - 1] == " " or is_cjk(norm[i])):
+            keys.add(norm[i:])
+    return keys
+
+def split_dishes(val):
+    return [d.strip() for d in (val or "").replace('，', ',').split(',') if d.strip()]
+
+class SuggestionIndex:
+    """
+    自动补全用的前缀结构, 由 search_index 的内存数据生成, 查询不访问 MySQL
+    权重: 地区/菜名按出现餐厅数, 推荐餐厅加权, 热门关键词固定高权重
+    """
+
+    def __init__(self):
+        # (排序后的 key, 与 key 对齐的 (type, text, extra, weight)); 重建时整体替换, 查询不会看到新旧混合
+        self._data = ([], [])
+        self.generation = -1
+        self._build_lock = threading.Lock()
+
+    def build(self):
+        with search_index._lock:
+            metas = list(search_index.meta.values())
+            areas = list(search_index.areas)
+            generation = search_index.generation
+        items = {}  # (type, text, extra) -> weight
+
+        def add(kind, text, extra, weight):
+            key = (kind, text, extra)
+            items[key] = items.get(key, 0) + weight
+
+        area_counts = {}
+        for m in metas:
+            location = f"{m['state']}, {m['area']}" if m['area'] else m['state']
+            weight = 3 if m.get('recommended') else 1
+            for name in (m['name_zh'], m['name_en']):
+                if name: add("restaurant", name, location, weight)
+            for dish in split_dishes(m['recommended_dishes'])[:3]:
+                add("dish", dish, None, 1)
+            if m['area']: area_counts[m['area']] = area_counts.get(m['area'], 0) + 1
+        for a in areas:
+            add("area", a['area'], a['state'], 1 + area_counts.get(a['area'], 0))
+        for kw in HOT_KEYWORDS:
+            add("hot", kw, None, SUGGEST_HOT_WEIGHT)
+
+        pairs = []
+        for (kind, text, extra), weight in items.items():
+            entry = (kind, text, extra, weight)
+            keys = suggest_keys(text)
+            if kind == "area":
+                zh = next((a['area_zh'] for a in areas if a['area'] == text and a['area_zh']), None)
+                if zh: keys |= suggest_keys(zh)
+            pairs.extend((k, entry) for k in keys)
+        pairs.sort(key=lambda p: p[0])
+        self._data = ([p[0] for p in pairs], [p[1] for p in pairs])
+        self.generation = generation
+
+    def refresh(self):
+        """search_index 有变化时重建; 重建期间查询继续使用旧数组"""
+        if self.generation == search_index.generation or not self._build_lock.acquire(blocking=False):
+            return
+        try: self.build()
+        finally: self._build_lock.release()
+
+    def lookup(self, q, limit):
+        prefix = normalize_text(q)
+        keys, entries = self._data
+        lo = bisect.bisect_left(keys, prefix)
+        hi = bisect.bisect_left(keys, prefix + "\U0010ffff", lo)
+        best = {}
+        for entry in entries[lo:hi]:
+            best[entry[:3]] = entry
+        ranked = sorted(best.values(), key=lambda e: (SUGGEST_TYPE_ORDER[e[0]], -e[3], e[1]))
+        suggestions = []; hot = 0
+        for kind, text, extra, _ in ranked:
+            if kind == "hot":
+                if hot >= 3: continue
+                hot += 1
+            if kind == "restaurant":
+                suggestions.append({"type": kind, "text": text, "location": extra})
+            elif kind == "area":
+                suggestions.append({"type": kind, "text": text, "state": extra})
+            else:
+                suggestions.append({"type": kind, "text": text})
+            if len(suggestions) >= limit: break
+        return suggestions
+
+suggestion_index = SuggestionIndex()
+
+def refresh_search_indexes():
+    search_index.ensure_fresh()
+    suggestion_index.refresh()
+
+def background_refresh_loop():
+    """后台线程: 定期同步搜索索引并重建自动补全, 请求线程不必访问数据库"""
+    while True:
+        try: refresh_search_indexes()
+        except Exception: logger.exception("search index refresh failed")
+        time.sleep(SUGGEST_REFRESH_INTERVAL)
+
+@app.on_event("startup")
+def start_background_refresh():
+    if SEARCH_INDEX_ENABLED:
+        threading.Thread(target=background_refresh_loop, name="search-refresh", daemon=True).start()
+
+# ============================================================
+# Opening Hours (营业时间解析 + 正在营业/时段筛选)
+# ============================================================
+
+OPENING_HOURS_ENABLED = os.getenv("VSM_OPENING_HOURS_INDEX", "1") == "1"
+OPENING_SYNC_INTERVAL = 60
+OPENING_FULL_RELOAD_INTERVAL = 600
+LOCAL_TZ = timezone(timedelta(hours=8), "Asia/Kuala_Lumpur")  # 马来西亚无夏令时, 固定 UTC+8
+DAY_MINUTES = 24 * 60
+WEEK_MINUTES = 7 * DAY_MINUTES
+
+# 周一 = 0
+ZH_WEEKDAYS = ["周一", "周二", "周三", "周四", "周五", "周六", "周日"]
+WEEKDAY_ALIASES = {name: i for i, name in enumerate(ZH_WEEKDAYS)}
+WEEKDAY_ALIASES.update({"周天": 6, "星期一": 0, "星期二": 1, "星期三": 2, "星期四": 3, "星期五": 4, "星期六": 5, "星期日": 6, "星期天": 6})
+for i, name in enumerate(["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]):
+    WEEKDAY_ALIASES.update({name: i, name + "s": i, name[:3]: i, str(i): i})
+for alias, i in [("tues", 1), ("weds", 2), ("thur", 3), ("thurs", 3)]:
+    WEEKDAY_ALIASES[alias] = i
+WEEKDAY_GROUPS = {"weekend": {5, 6}, "weekends": {5, 6}, "weekday": {0, 1, 2, 3, 4}, "weekdays": {0, 1, 2, 3, 4},
+                  "daily": set(range(7))}
+
+# 与 /api/search/filters 的时段说明一致: value -> (开始分钟, 结束分钟, time_slots 中的中文名)
+TIME_SLOTS = {
+    "morning": (6 * 60, 11 * 60, "早上"),
+    "afternoon": (11 * 60, 15 * 60, "下午"),
+    "evening": (18 * 60, 22 * 60, "晚上"),
+    "night": (22 * 60, 26 * 60, "凌晨"),
+}
+TIME_SLOT_BITS = {slot: 1 << i for i, slot in enumerate(TIME_SLOTS)}
+TIME_SLOT_ALIASES = {zh: slot for slot, (_, _, zh) in TIME_SLOTS.items()}  # App 传的是中文 (time_slot=下午)
+
+HOURS_RANGE_RE = re.compile(
+    r"(\d{1,2})(?:[.:](\d{2}))?\s*(am|pm)?\s*(?:(?:to|-|–|~)\s*)+(\d{1,2})(?:[.:](\d{2}))?\s*(am|pm)?", re.I)
+
+def _clock_minutes(hour, minute, meridiem):
+    hour = int(hour); minute = int(minute or 0)
+    if meridiem:
+        hour = hour % 12 + (12 if meridiem.lower() == "pm" else 0)
+    return hour * 60 + minute
+
+def parse_time_range(m):
+    """HOURS_RANGE_RE 匹配 -> (开始, 结束) 当天分钟数; 跨午夜时结束 > 1440"""
+    h1, m1, ap1, h2, m2, ap2 = m.groups()
+    start = _clock_minutes(h1, m1, ap1)
+    end = _clock_minutes(h2, m2, ap2)
+    if ap1 and not ap2 and end <= start and end < 12 * 60:
+        end += 12 * 60                      # "12.00pm to 10.00"
+    if not ap1 and ap2 and start + 12 * 60 < end:
+        start += 12 * 60                    # "5 to 9pm"
+    if end <= start:
+        end += DAY_MINUTES                  # 营业到凌晨
+    return start, end
+
+WEEKDAY_TOKEN_RE = re.compile(r"星期.|周.|[a-z]+|[-–~至到]")
+WEEKDAY_RANGE_WORDS = {"to", "-", "–", "~", "至", "到"}
+
+def parse_weekdays(text):
+    """英文/中文星期 -> {0..6}; 支持 weekends 以及 "Friday to Sunday"、"Mon-Fri"、"周一至周五" 这类范围 (可跨周, 如 Fri-Mon)"""
+    days = set()
+    prev = None; in_range = False
+    for word in WEEKDAY_TOKEN_RE.findall(text.lower()):
+        if word in WEEKDAY_GROUPS:
+            days |= WEEKDAY_GROUPS[word]; prev = None
+        elif word in WEEKDAY_ALIASES:
+            day = WEEKDAY_ALIASES[word]
+            if in_range and prev is not None:
+                d = prev
+                while d != day:
+                    d = (d + 1) % 7; days.add(d)
+            days.add(day); prev = day
+        in_range = word in WEEKDAY_RANGE_WORDS and prev is not None
+    return days
+
+CLOSED_RE = re.compile(r"\bclosed?\b|休息|公休|休业", re.I)
+CLOSED_CONDITION_RE = re.compile(r"\bif\b|\bunless\b|\bexcept|若|如果|即使|照常", re.I)
+CLAUSE_BREAK_RE = re.compile(HOURS_RANGE_RE.pattern + r"|[,;；，\n()（）]", re.I)
+
+def _closed_clause_days(clause):
+    """单句休息说明中的星期; 带条件、带具体时间或不含星期的返回空集"""
+    if not CLOSED_RE.search(clause) or CLOSED_CONDITION_RE.search(clause) or re.search(r"\d", clause):
+        return set()
+    return parse_weekdays(clause)
+
+def extract_closed_days(text):
+    """
+    营业时间中夹带的休息说明 -> (去掉这些说明后的文本, 休息日)
+    如 "7am to 3pm (closed on Tuesday)"、"8am-4pm (Closed Mon)"、"Sun closed"、"星期二固定休息"
+    """
+    days = set()
+
+    def take(clause):
+        found = _closed_clause_days(clause)
+        days.update(found)
+        return " " if found else clause
+
+    text = re.sub(r"[(（][^()（）]*[)）]", lambda m: take(m.group(0)), text)
+    out = []; pos = 0
+    for m in CLAUSE_BREAK_RE.finditer(text):
+        out.append(take(text[pos:m.start()])); out.append(m.group(0)); pos = m.end()
+    out.append(take(text[pos:]))
+    return "".join(out), days
+
+def parse_working_hours_text(text):
+    """
+    "Business Hour : 10.30am to 2.30pm , 5.30pm to 8.30pm ; Sunday 8.00am to 1.00pm\nRest day : Monday"
+    -> ({星期: [(开始, 结束)]}, 文本中的休息日)
+    时间前面的文字决定适用日期: 无星期的作为每天默认值, 带星期的覆盖对应日期,
+    只有农历/公共假期限定的时间忽略; 紧跟在逗号后的时间沿用前一个时间的限定;
+    时间中夹带的 "(closed on Tuesday)"、"星期二休息" 等也算休息日
+    """
+    if not text: return {}, set()
+    parts = re.split(r"rest\s*days?\s*:?", text, maxsplit=1, flags=re.I)
+    hours_text, inline_rest = extract_closed_days(parts[0])
+    rest_text = parts[1] if len(parts) > 1 else ""
+    default = []; overrides = {}
+    for segment in re.split(r"[;；]|(?<!to)\n", hours_text):
+        if re.search(r"24\s*hours?|24小时", segment, re.I):
+            default.append((0, DAY_MINUTES)); continue
+        target = None; pos = 0
+        for m in HOURS_RANGE_RE.finditer(segment):
+            qualifier = re.sub(r"(?i)open daily|\band\b", " ", segment[pos:m.start()]); pos = m.end()
+            if target is None or re.search(r"[a-zA-Z\u4e00-\u9fff]", qualifier):
+                days = parse_weekdays(qualifier)
+                if days: target = days
+                elif re.search(r"lunar|农历|初一|十五|holiday|假期", qualifier, re.I): target = "skip"
+                else: target = "default"
+            if target == "default":
+                default.append(parse_time_range(m))
+            elif target != "skip":
+                for d in target: overrides.setdefault(d, []).append(parse_time_range(m))
+    week = {d: overrides.get(d, default) for d in range(7)}
+    week = {d: r for d, r in week.items() if r}
+    rest_days = set()
+    rest_text = re.sub(r"\(.*?\)", " ", rest_text.split("Updated")[0])
+    if not re.search(r"alternate|uncertain|不定", rest_text, re.I):
+        rest_days = parse_weekdays(rest_text)
+    return week, rest_days | inline_rest
+
+def parse_business_hours(value):
+    """
+    business_hours JSON -> {星期: [(开始, 结束)]}, 无法识别时返回 None
+    支持 {"mon": ["09:00-17:00"], "tue": [["09:00", "17:00"]], "sun": "closed"}
+    以及 [{"day": "monday", "open": "09:00", "close": "17:00"}]
+    """
+    if not value: return None
+    if isinstance(value, str):
+        value = parse_json_field(value)
+    entries = []
+    if isinstance(value, dict):
+        entries = list(value.items())
+    elif isinstance(value, list):
+        entries = [(e.get("day"), e) for e in value if isinstance(e, dict)]
+    week = {}
+    for key, spec in entries:
+        day = WEEKDAY_ALIASES.get(str(key).strip().lower())
+        if day is None: continue
+        if isinstance(spec, dict) and ("open" in spec or "close" in spec):
+            spec = [[spec.get("open"), spec.get("close")]]
+        if isinstance(spec, str) or not isinstance(spec, list):
+            spec = [spec]
+        for item in spec:
+            if isinstance(item, (list, tuple)) and len(item) == 2 and all(item):
+                item = f"{item[0]}-{item[1]}"
+            if not isinstance(item, str): continue
+            m = HOURS_RANGE_RE.search(item)
+            if m: week.setdefault(day, []).append(parse_time_range(m))
+        week.setdefault(day, [])
+    return week if entries and week else None
+
+def weekly_intervals(week, rest_days=()):
+    """{星期: [(开始, 结束)]} -> 按本周分钟数 (周一 00:00 = 0) 排序合并后的 ((start, end), ...)"""
+    spans = []
+    for day, ranges in week.items():
+        if day in rest_days: continue
+        for start, end in ranges:
+            start += day * DAY_MINUTES; end += day * DAY_MINUTES
+            if end > WEEK_MINUTES:          # 周日营业到周一凌晨
+                spans.append((start, WEEK_MINUTES)); spans.append((0, end - WEEK_MINUTES))
+            else:
+                spans.append((start, end))
+    spans.sort()
+    merged = []
+    for start, end in spans:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return tuple(merged)
+
+def restaurant_intervals(row):
+    """business_hours 优先, 其次 working_hours_text; rest_days (周X) 中的日期不营业"""
+    week = parse_business_hours(row.get('business_hours'))
+    text_week, text_rest = parse_working_hours_text(row.get('working_hours_text'))
+    if week is None: week = text_week
+    rest = set()
+    for name in parse_json_field(row.get('rest_days')) or []:
+        if isinstance(name, str) and name in WEEKDAY_ALIASES: rest.add(WEEKDAY_ALIASES[name])
+    if not rest: rest = text_rest
+    return weekly_intervals(week, rest)
+
+def slot_mask(intervals, time_slots=None):
+    """营业区间与各时段 (任一天) 有重叠则置位; 没有营业时间时按 time_slots 字段"""
+    mask = 0
+    if intervals:
+        for slot, (lo, hi, _) in TIME_SLOTS.items():
+            windows = [(d * DAY_MINUTES + lo, d * DAY_MINUTES + hi) for d in range(7)]
+            windows += [(a - WEEK_MINUTES, b - WEEK_MINUTES) for a, b in windows if b > WEEK_MINUTES]
+            if any(s < b and a < e for s, e in intervals for a, b in windows):
+                mask |= TIME_SLOT_BITS[slot]
+        return mask
+    names = parse_json_field(time_slots) or []
+    if isinstance(names, list):
+        for slot, (_, _, zh) in TIME_SLOTS.items():
+            if zh in names or slot in names: mask |= TIME_SLOT_BITS[slot]
+    return mask
+
+def week_minute(now=None):
+    now = now or datetime.now(LOCAL_TZ)
+    return now.weekday() * DAY_MINUTES + now.hour * 60 + now.minute
+
+class OpeningHoursIndex(SyncedCache):
+    """
+    每家餐厅的每周营业区间 (分钟, 吉隆坡时间) + 时段位掩码
+    所有区间端点排序后把一周切成若干段, 同一段内营业集合不变, 按段缓存 -> 正在营业查询为一次二分
+    """
+    sync_interval = OPENING_SYNC_INTERVAL
+    full_interval = OPENING_FULL_RELOAD_INTERVAL
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.RLock()
+        self._intervals = {}    # id -> ((start, end), ...)
+        self._starts = {}       # id -> (start, ...) 供二分
+        self._slots = {}        # id -> 时段位掩码
+        self._boundaries = []
+        self._open_cache = {}   # 段号 -> frozenset(id)
+
+    def __len__(self):
+        return len(self._slots)
+
+    def upsert(self, rid, intervals, mask):
+        with self._lock:
+            if self._intervals.get(rid) == intervals and self._slots.get(rid) == mask:
+                return False
+            if intervals:
+                self._intervals[rid] = intervals
+                self._starts[rid] = tuple(s for s, _ in intervals)
+            else:
+                self._intervals.pop(rid, None); self._starts.pop(rid, None)
+            self._slots[rid] = mask
+            return True
+
+    def remove(self, rid):
+        with self._lock:
+            self._intervals.pop(rid, None); self._starts.pop(rid, None)
+            return self._slots.pop(rid, None) is not None
+
+    def _reindex(self):
+        points = set()
+        for spans in self._intervals.values():
+            for s, e in spans: points.add(s); points.add(e)
+        self._boundaries = sorted(points)
+        self._open_cache = {}
+
+    def is_open(self, rid, minute):
+        starts = self._starts.get(rid)
+        if not starts: return False
+        i = bisect.bisect_right(starts, minute) - 1
+        return i >= 0 and minute < self._intervals[rid][i][1]
+
+    def open_at(self, minute):
+        """minute: 本周分钟数; 没有可解析营业时间的餐厅不计入"""
+        with self._lock:
+            seg = bisect.bisect_right(self._boundaries, minute)
+            ids = self._open_cache.get(seg)
+            if ids is None:
+                ids = frozenset(rid for rid in self._intervals if self.is_open(rid, minute))
+                self._open_cache[seg] = ids
+            return ids
+
+    def open_now(self):
+        return self.open_at(week_minute())
+
+    def in_slot(self, slot):
+        bit = TIME_SLOT_BITS[slot]
+        with self._lock:
+            return [rid for rid, mask in self._slots.items() if mask & bit]
+
+    def _apply(self, rows):
+        changed = False
+        for row in rows:
+            if row.get('updated_at') and (self.watermark is None or row['updated_at'] > self.watermark):
+                self.watermark = row['updated_at']
+            if row.get('status') != 'active':
+                changed = self.remove(row['id']) or changed; continue
+            intervals = restaurant_intervals(row)
+            changed = self.upsert(row['id'], intervals, slot_mask(intervals, row.get('time_slots'))) or changed
+        return changed
+
+    def sync(self, full=False):
+        """从数据库同步: 首次/定期全量, 其余按 updated_at 增量"""
+        with db_cursor() as (db, cursor):
+            cols = "SELECT id, status, working_hours_text, business_hours, rest_days, time_slots, updated_at FROM restaurants"
+            if full or not self.loaded or self.watermark is None:
+                cursor.execute(cols)
+                rows = cursor.fetchall()
+                with self._lock:
+                    self._intervals.clear(); self._starts.clear(); self._slots.clear(); self.watermark = None
+                    self._apply(rows); self._reindex()
+                self.last_full = time.time(); self.loaded = True
+            else:
+                cursor.execute(cols + " WHERE updated_at >= %s", (self.watermark,))
+                rows = cursor.fetchall()
+                with self._lock:
+                    if self._apply(rows): self._reindex()
+            self.last_sync = time.time()
+
+opening_hours = OpeningHoursIndex()
+
+# ============================================================
+# Response Cache (公共 GET 接口响应缓存)
+# ============================================================
+
+# 缓存的 states/areas/tags/notices 只通过 Adminer 直接修改 (main.py 没有对应的写接口), 修改后最多
+# RESPONSE_CACHE_TTL 秒 (notices 60 秒) 才对外生效, 除非调用 POST /api/admin/cache/invalidate;
+# 进程内后端时该调用只清除处理它的那个 worker, 其他 worker 仍等到 TTL 过期, 需要立即生效时配置 Redis
+RESPONSE_CACHE_TTL = int(os.getenv("VSM_RESPONSE_CACHE_TTL", "300"))
+RESPONSE_CACHE_REDIS_URL = os.getenv("VSM_CACHE_REDIS_URL")  # 设置后多个 worker 共享缓存
+
+class LocalCacheBackend:
+    """进程内后端: TTL + LRU"""
+
+    def __init__(self, maxsize=512):
+        self._cache = TTLCache(RESPONSE_CACHE_TTL, maxsize=maxsize)
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value, ttl):
+        self._cache.set(key, value, ttl)
+
+    def invalidate(self, namespace=None):
+        if namespace is None: self._cache.clear()
+        else: self._cache.delete_where(lambda k: k.startswith(namespace + ":"))
+
+class RedisCacheBackend:
+    """共享后端 (需要 redis 包): 值为 etag + 换行 + JSON body"""
+
+    PREFIX = "vsm:rc:"
+
+    def __init__(self, url):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self._redis.get(self.PREFIX + key)
+        if raw is None: return None
+        etag, _, body = raw.partition(b"\n")
+        return body, etag.decode()
+
+    def set(self, key, value, ttl):
+        body, etag = value
+        self._redis.set(self.PREFIX + key, etag.encode() + b"\n" + body, ex=ttl)
+
+    def invalidate(self, namespace=None):
+        pattern = self.PREFIX + (f"{namespace}:*" if namespace else "*")
+        keys = list(self._redis.scan_iter(match=pattern, count=500))
+        if keys: self._redis.delete(*keys)
+
+def make_response_cache_backend():
+    if RESPONSE_CACHE_REDIS_URL:
+        try: return RedisCacheBackend(RESPONSE_CACHE_REDIS_URL)
+        except Exception: logger.exception("redis cache unavailable, using in-process cache")
+    return LocalCacheBackend()
+
+response_cache = make_response_cache_backend()
+
+def invalidate_response_cache(*namespaces):
+    """数据修改后调用; 不传参数时清空全部 (进程内后端只影响当前 worker)"""
+    for ns in namespaces or (None,):
+        try: response_cache.invalidate(ns)
+        except Exception: logger.exception("response cache invalidation failed")
+
+def etag_matches(if_none_match, etag):
+    return bool(if_none_match) and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")])
+
+def cached_response(namespace, ttl=RESPONSE_CACHE_TTL):
+    """
+    GET 接口响应缓存装饰器: 按 namespace + 查询参数缓存序列化后的 JSON
+    附带 ETag / Cache-Control, If-None-Match 命中时返回 304
+    """
+    def decorator(func):
+        sig = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, _request: Request, **kwargs):
+            key = f"{namespace}:" + json.dumps(kwargs, sort_keys=True, default=str)
+            entry = None
+            try: entry = response_cache.get(key)
+            except Exception: logger.exception("response cache read failed")
+            if entry is None:
+                body = dump_json(func(*args, **kwargs))
+                entry = (body, '"' + hashlib.md5(body).hexdigest() + '"')
+                try: response_cache.set(key, entry, ttl)
+                except Exception: logger.exception("response cache write failed")
+            body, etag = entry
+            headers = {"ETag": etag, "Cache-Control": f"public, max-age={ttl}"}
+            if etag_matches(_request.headers.get("if-none-match"), etag):
+                return Response(status_code=304, headers=headers)
+            return Response(content=body, media_type="application/json", headers=headers)
+
+        wrapper.__signature__ = sig.replace(parameters=list(sig.parameters.values()) + [
+            inspect.Parameter("_request", inspect.Parameter.KEYWORD_ONLY, annotation=Request)])
+        return wrapper
+    return decorator
+
 # ============================================================
 # Auth Endpoints
 # ============================================================
@@ -157,25 +2118,41 @@ def bind_phone(req: BindPhoneRequest, user: dict = Depends(verify_token)):
         if cursor.fetchone():
             raise HTTPException(status_code=409, detail="Phone already linked")
         cursor.execute("UPDATE users SET phone=%s WHERE id=%s", (req.phone, user['uid']))
-        db.commit(); return {"ok": True}
+        db.commit(); profile_cache.pop(user['uid'])
+        return {"ok": True}
     finally: cursor.close(); db.close()
 
+PROFILE_CACHE_TTL = 60
+profile_cache = TTLCache(PROFILE_CACHE_TTL, maxsize=20000)  # uid -> /api/auth/me 结果
+
 @app.get("/api/auth/me")
-def get_me(user: dict = Depends(verify_token)):
-    db = get_db(); cursor = db.cursor(dictionary=True)
-    try:
-        cursor.execute("SELECT id, phone, email, name, avatar_url, role, preferences, created_at FROM users WHERE id=%s", (user['uid'],))
-        u = cursor.fetchone()
+async def get_me(user: dict = Depends(verify_token)):
+    profile = profile_cache.get(user['uid'])
+    if profile is None:
+        async with async_db() as db:
+            u = await db.fetchone("SELECT id, phone, email, name, avatar_url, role, preferences, created_at FROM users WHERE id=%s", (user['uid'],))
         if not u: raise HTTPException(status_code=404, detail="User not found")
-        return row_to_dict(u)
-    finally: cursor.close(); db.close()
+        profile = row_to_dict(u)
+        profile_cache.set(user['uid'], profile)
+    return profile
+
+@app.post("/api/auth/logout")
+def logout(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security), user: dict = Depends(verify_token)):
+    """吊销当前 token (仅处理本请求的 worker 进程, 见 revoke_token)"""
+    revoke_token(credentials.credentials)
+    return {"ok": True}
 
 # ============================================================
 # Restaurants Endpoints
 # ============================================================
 
+# 分页总数缓存: 按规范化后的筛选参数为 key (不含展开的 id 列表), 无限滚动翻页时不重复 COUNT;
+# catalogue / 搜索索引同步到餐厅变化时整体清空
+COUNT_CACHE_TTL = 30
+count_cache = TTLCache(COUNT_CACHE_TTL, maxsize=2048)
+
 @app.get("/api/restaurants", dependencies=[Depends(verify_token_or_key)])
-def list_restaurants(
+async def list_restaurants(
     # 基础筛选
     state_id: Optional[int] = None,
     area: Optional[str] = None,
@@ -203,7 +2180,12 @@ def list_restaurants(
     
     # 分页
     page: int = 1,
-    limit: int = 50
+    limit: int = 50,
+    include_total: bool = Query(True, description="false 时不计算 total (无限滚动第2页起可省去 COUNT)"),
+    after_id: Optional[int] = Query(None, description="游标分页: 上一页 next_cursor.after_id"),
+    after_distance: Optional[float] = Query(None, description="游标分页(sort_by=distance): 上一页 next_cursor.after_distance"),
+    stream: bool = Query(False, description="true 时边读边输出 JSON (limit 较大时内存占用不随行数增长)"),
+    user: Optional[dict] = Depends(get_optional_user)
 ):
     """
     增强版餐厅搜索 API
@@ -216,37 +2198,47 @@ def list_restaurants(
     - price_level: 价格等级(1-3)
     - price_min/price_max: 价格范围
     - recommended: 是否推荐餐厅
-    - time_slot: 营业时段(morning/afternoon/evening)
+    - time_slot: 营业时段(morning/afternoon/evening/night, 或 早上/下午/晚上/凌晨)
     - is_open_now: 是否正在营业
     
     排序 (Q1版本无rating/saves):
     - distance: 距离最近(需lat/lng)
     - newest: 最新加入
     - recommended: 推荐优先
+
+    分页: page/limit, 或按 next_cursor 传 after_id(/after_distance) 做游标分页 (默认排序与距离排序)
+    stream=true: 服务端游标分块读取并流式输出, 响应结构相同
+    带登录 token 时每行的 is_favorite 取自内存收藏集合, 不必再请求 /api/favorites
     """
-    db = get_db(); cursor = db.cursor(dictionary=True)
     where = ["1=1"]; params = []
     joins = []
 
-    # 1. 州属筛选 (通过 state_id 查找 state 名称)
+    # 1. 州属筛选 (state_id 已回填, 直接按整数索引过滤)
     if state_id:
-        cursor.execute("SELECT name FROM states WHERE id = %s", (state_id,))
-        state_row = cursor.fetchone()
-        if state_row:
-            where.append("r.state = %s")
-            params.append(state_row['name'])
-    
+        where.append("r.state_id = %s")
+        params.append(state_id)
+
     # 2. 地区筛选 (直接匹配 area 名称)
     if area:
         where.append("r.area = %s")
         params.append(area)
-    
+
     # 3. 增强搜索 (多字段模糊搜索)
-    if search:
+    relevance_ids = None
+    if search and SEARCH_INDEX_ENABLED:
+        # 倒排索引: 命中 id 按相关度排序
+        await ensure_fresh_async(search_index)
+        hits = search_index.search(search)
+        if hits:
+            relevance_ids = ",".join(str(int(rid)) for rid, _ in hits)
+            where.append(f"r.id IN ({relevance_ids})")
+        else:
+            where.append("1=0")
+    elif search:
         q = f"%{search}%"
         # 支持中英文名称、地址、推荐菜、描述、电话
         search_conditions = [
-            "r.name_zh LIKE %s", 
+            "r.name_zh LIKE %s",
             "r.name_en LIKE %s",
             "r.address LIKE %s",
             "r.recommended_dishes LIKE %s",
@@ -255,7 +2247,7 @@ def list_restaurants(
         ]
         where.append(f"({' OR '.join(search_conditions)})")
         params.extend([q, q, q, q, q, search])  # phones 用原始搜索词
-    
+
     # 4. 价格筛选
     if price_level is not None:
         where.append("r.price_level = %s")
@@ -266,51 +2258,79 @@ def list_restaurants(
     if price_max is not None:
         where.append("r.price_level <= %s")
         params.append(price_max)
-    
+
     # 5. 推荐餐厅筛选
     if recommended is not None:
         if recommended:
             where.append("r.recommended = 1")
         else:
             where.append("(r.recommended = 0 OR r.recommended IS NULL)")
-    
-    # 6. 营业时段筛选 (time_slots JSON)
-    if time_slot:
-        valid_slots = ['morning', 'afternoon', 'evening', 'night']
-        if time_slot in valid_slots:
+
+    # 6. 营业时段筛选 (营业区间与时段重叠, 无营业时间时按 time_slots)
+    time_slot = TIME_SLOT_ALIASES.get(time_slot, time_slot)
+    if time_slot in TIME_SLOTS:
+        if OPENING_HOURS_ENABLED:
+            await ensure_fresh_async(opening_hours)
+            slot_ids = opening_hours.in_slot(time_slot)
+            where.append(f"r.id IN ({','.join(str(int(rid)) for rid in slot_ids)})" if slot_ids else "1=0")
+        else:
             where.append("JSON_CONTAINS(r.time_slots, %s)")
-            params.append(json.dumps(time_slot))
-    
-    # 8. 正在营业筛选
+            params.append(json.dumps(TIME_SLOTS[time_slot][2], ensure_ascii=False))
+
+    # 8. 正在营业筛选 (吉隆坡时间)
     if is_open_now:
-        # 获取当前时间
-        now = datetime.now()
-        current_time = now.strftime("%H:%M")
-        current_day = now.strftime("%A")  # Monday, Tuesday...
-        # 简化版：检查 rest_days 不包含今天
-        where.append("(r.rest_days IS NULL OR r.rest_days NOT LIKE %s)")
-        params.append(f"%{current_day}%")
-    
+        if OPENING_HOURS_ENABLED:
+            await ensure_fresh_async(opening_hours)
+            open_ids = opening_hours.open_now()
+            where.append(f"r.id IN ({','.join(str(int(rid)) for rid in sorted(open_ids))})" if open_ids else "1=0")
+        else:
+            # 回退: 只排除今天休息的餐厅 (rest_days 为 ["周四", ...])
+            where.append("(r.rest_days IS NULL OR NOT JSON_CONTAINS(r.rest_days, %s))")
+            params.append(json.dumps(ZH_WEEKDAYS[datetime.now(LOCAL_TZ).weekday()], ensure_ascii=False))
+
     # 9. 距离筛选和排序
     dist_select = ""
     dist_where = ""
+    dist_expr = None
+    dist_map = None  # 使用内存索引时: id -> 距离(米)
+    nearby = None
     order_by = "r.id DESC"  # 默认排序
-    
+
     if lat is not None and lng is not None:
         try:
             f_lat = float(lat); f_lng = float(lng)
-            if abs(f_lat) > 0.1:
-                # 计算距离
-                dist_select = f", (6371000 * acos(least(1.0, cos(radians({f_lat})) * cos(radians(r.location_lat)) * cos(radians(r.location_lng) - radians({f_lng})) + sin(radians({f_lat})) * sin(radians(r.location_lat))))) AS distance_m"
+            use_index = abs(f_lat) > 0.1 and GEO_INDEX_ENABLED
+            if use_index:
+                try: await ensure_fresh_async(geo_index)
+                except Exception: use_index = geo_index.loaded  # 同步失败时沿用旧索引, 无索引则回退 SQL
+            if use_index:
+                # 内存网格索引: 先取半径内候选 id, 再交给 SQL 做其余筛选
+                nearby = geo_index.within(f_lat, f_lng, radius)
+                dist_map = dict(nearby)
+                if nearby:
+                    id_list = ",".join(str(int(rid)) for rid, _ in nearby)
+                    where.append(f"r.id IN ({id_list})")
+                    if sort_by == "distance":
+                        order_by = f"FIELD(r.id, {id_list})"
+                else:
+                    where.append("1=0")
+            elif abs(f_lat) > 0.1:
+                # 计算距离: 先用包围盒 (走 idx_location_lat_lng, 见 geo_bbox_migration.sql) 筛出候选, 只对候选计算球面距离
+                dlat = radius / 111320.0
+                dlng = radius / (111320.0 * max(0.01, math.cos(math.radians(f_lat))))
+                dist_expr = f"ST_Distance_Sphere(POINT(r.location_lng, r.location_lat), POINT({f_lng}, {f_lat}))"
+                dist_select = f", {dist_expr} AS distance_m"
                 # 限制半径
-                dist_where = f" AND (6371000 * acos(least(1.0, cos(radians({f_lat})) * cos(radians(r.location_lat)) * cos(radians(r.location_lng) - radians({f_lng})) + sin(radians({f_lat})) * sin(radians(r.location_lat))))) <= {radius}"
-                
+                dist_where = (f" AND r.location_lat BETWEEN {f_lat - dlat} AND {f_lat + dlat}"
+                              f" AND r.location_lng BETWEEN {f_lng - dlng} AND {f_lng + dlng}"
+                              f" AND {dist_expr} <= {radius}")
+
                 # 根据 sort_by 参数决定排序
                 if sort_by == "distance":
-                    order_by = "distance_m ASC"
+                    order_by = "distance_m ASC, r.id ASC"
         except:
             pass
-    
+
     # 排序处理 (Q1版本: 无rating/saves排序)
     if sort_by == "newest":
         order_by = "r.created_at DESC"
@@ -319,66 +2339,162 @@ def list_restaurants(
     elif sort_by == "distance" and not (lat and lng):
         # 如果没有提供坐标，忽略距离排序
         order_by = "r.id DESC"
-    
+    if relevance_ids and not sort_by:
+        order_by = f"FIELD(r.id, {relevance_ids})"  # 未指定排序时按相关度
+
     where_str = " AND ".join(where)
     offset = (page - 1) * limit
-    
+
+    # 游标分页: 条件只加在数据查询上, 不影响 total
+    by_distance = sort_by == "distance" and (dist_map is not None or dist_expr is not None)
+    keyset = ""; keyset_params = []
+    if after_id is not None:
+        offset = 0
+        if by_distance:
+            if after_distance is None:
+                raise HTTPException(status_code=400, detail="after_distance is required when sort_by=distance")
+            if dist_map is not None:
+                rest = [str(int(rid)) for rid, d in nearby if (d, rid) > (after_distance, after_id)]
+                keyset = f" AND r.id IN ({','.join(rest)})" if rest else " AND 1=0"
+            else:
+                keyset = f" AND ({dist_expr} > %s OR ({dist_expr} = %s AND r.id > %s))"
+                keyset_params = [after_distance, after_distance, after_id]
+        elif order_by == "r.id DESC":
+            keyset = " AND r.id < %s"; keyset_params = [after_id]
+        else:
+            raise HTTPException(status_code=400, detail="after_id only supports default or distance sort")
+
     # 构建最终 SQL (WHERE 条件参数 + 分页参数)
-    sql_params = params.copy()
-    sql = f"""SELECT r.*, 
-                     s.name as state_name, s.name_zh as state_name_zh, 
+    sql_params = params + keyset_params
+    sql = f"""SELECT r.*,
+                     s.name as state_name, s.name_zh as state_name_zh,
                      a.area as area_name, a.area_zh as area_name_zh
                      {dist_select}
-              FROM restaurants r 
-              LEFT JOIN states s ON CAST(s.name AS CHAR CHARACTER SET utf8mb4) = CAST(r.state AS CHAR CHARACTER SET utf8mb4)
-              LEFT JOIN areas a ON CAST(a.area AS CHAR CHARACTER SET utf8mb4) = CAST(r.area AS CHAR CHARACTER SET utf8mb4)
-              WHERE {where_str} {dist_where}
+              FROM restaurants r
+              {LOCATION_JOINS}
+              WHERE {where_str} {dist_where}{keyset}
               ORDER BY {order_by}
               LIMIT %s OFFSET %s"""
     sql_params.extend([limit, offset])
-    
-    # 执行查询
-    cursor.execute(sql, sql_params)
-    rows = [row_to_dict(r) for r in cursor.fetchall()]
-    
-    # 获取总数 (使用原始 params，不包含分页参数)
-    count_sql = f"SELECT COUNT(*) as total FROM restaurants r WHERE {where_str}"
-    cursor.execute(count_sql, params)
-    total = cursor.fetchone()['total']
-    
-    cursor.close(); db.close()
-    
+
+    # 总数只取决于筛选条件; 正在营业的集合随时间变化, 按分钟区分
+    count_key = ("restaurants", state_id, area, normalize_text(search) if SEARCH_INDEX_ENABLED else search,
+                 price_level, price_min, price_max, recommended, time_slot if time_slot in TIME_SLOTS else None,
+                 week_minute() if is_open_now else None, lat, lng, radius if lat is not None and lng is not None else None)
+
+    def decode_row(row):
+        if dist_map is not None:
+            row['distance_m'] = dist_map.get(row['id'])
+        row['is_favorite'] = row['id'] in favorite_ids
+        return row
+
+    def make_next_cursor(last_row, count):
+        if last_row is None or count != limit or not (by_distance or order_by == "r.id DESC"):
+            return None
+        next_cursor = {"after_id": last_row['id']}
+        if by_distance: next_cursor["after_distance"] = last_row.get('distance_m')
+        return next_cursor
+
+    filters_applied = {
+        "state_id": state_id,
+        "area": area,
+        "search": search,
+        "price_level": price_level,
+        "price_range": {"min": price_min, "max": price_max} if (price_min or price_max) else None,
+        "recommended": recommended,
+        "time_slot": time_slot,
+        "is_open_now": is_open_now,
+        "sort_by": sort_by,
+        "location": {"lat": lat, "lng": lng, "radius": radius} if lat and lng else None
+    }
+
+    def queries():
+        favorites = (yield from favorite_sets.steps(user['uid'])) if user else frozenset()
+        rows = None if stream else (yield (sql, sql_params, "all", True))
+
+        # 获取总数 (使用原始 params，不包含分页参数); 相同筛选条件短时间内复用
+        total = None
+        if include_total:
+            total = count_cache.get(count_key)
+            if total is None:
+                count_sql = f"SELECT COUNT(*) as total FROM restaurants r WHERE {where_str} {dist_where}"
+                total = (yield (count_sql, params, "one", False))['total']
+                count_cache.set(count_key, total)
+        return favorites, rows, total
+
+    # 执行查询 (线程池模式下全部查询只进出一次线程池)
+    favorite_ids, rows, total = await run_db(queries())
+    if not stream: rows = [decode_row(r) for r in rows]
+
+    head = {"total": total, "page": page, "limit": limit, "filters_applied": filters_applied}
+    if stream:
+        # 流式输出走同步连接池的服务端游标, 在线程池中逐块迭代 (连接由生成器自己借出)
+        return StreamingResponse(
+            stream_json_rows(sql, sql_params, head, decode_row,
+                             lambda last, count: {"next_cursor": make_next_cursor(last, count)}),
+            media_type="application/json")
+
     return {
-        "total": total,
-        "page": page,
-        "limit": limit,
-        "filters_applied": {
-            "state_id": state_id,
-            "area": area,
-            "search": search,
-            "price_level": price_level,
-            "price_range": {"min": price_min, "max": price_max} if (price_min or price_max) else None,
-            "recommended": recommended,
-            "time_slot": time_slot,
-            "is_open_now": is_open_now,
-            "sort_by": sort_by,
-            "location": {"lat": lat, "lng": lng, "radius": radius} if lat and lng else None
-        },
+        **head,
+        "next_cursor": make_next_cursor(rows[-1] if rows else None, len(rows)),
         "data": rows
     }
 
+@app.get("/api/restaurants/clusters", dependencies=[Depends(verify_token_or_key)])
+async def restaurant_clusters(
+    bbox: str = Query(..., description="视口: west,south,east,north (经纬度)"),
+    zoom: int = Query(..., ge=0, le=22, description="地图缩放级别")
+):
+    """
+    地图标记: 视口内的聚合点 (count/expansion_zoom) 或单个餐厅
+    zoom 超过 CLUSTER_MAX_ZOOM 时全部为单点
+    """
+    try:
+        west, south, east, north = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be west,south,east,north")
+    if cluster_index.version != catalogue.version or catalogue.needs_sync():
+        await run_in_threadpool(cluster_index.ensure_fresh)
+    level, items = cluster_index.query(west, south, east, north, zoom)
+    return {"zoom": level, "version": cluster_index.version, "total": len(items), "data": items}
+
+@app.get("/api/restaurants/catalogue", dependencies=[Depends(verify_token_or_key)])
+def restaurant_catalogue(
+    since: Optional[int] = Query(None, description="上次拿到的 version, 只返回之后的变更"),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+    accept_encoding: Optional[str] = Header(None, alias="Accept-Encoding"),
+):
+    """
+    全量餐厅快照 (替代 /api/restaurants?status=active&limit=2000)
+
+    - 无变化时返回 304 (If-None-Match)
+    - since=<version>: 只返回 changed/removed; 版本过旧则返回全量 (full=true)
+    """
+    catalogue.ensure_fresh()
+    etag = catalogue.etag
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    if since is not None:
+        diff = catalogue.delta(since)
+        if diff is not None:
+            return Response(content=dump_json(diff), media_type="application/json", headers=headers)
+    body, body_gz, _ = catalogue.snapshot()
+    if accept_encoding and "gzip" in accept_encoding.lower():
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=body_gz, media_type="application/json", headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 @app.get("/api/restaurants/{restaurant_id}")
-def get_restaurant(restaurant_id: int):
-    db = get_db(); cursor = db.cursor(dictionary=True)
-    cursor.execute("""SELECT r.*, s.name as state_name, s.name_zh as state_name_zh, 
-                        a.area as area_name, a.area_zh as area_name_zh 
-                      FROM restaurants r 
-                      LEFT JOIN states s ON CAST(s.name AS CHAR CHARACTER SET utf8mb4) = CAST(r.state AS CHAR CHARACTER SET utf8mb4)
-                      LEFT JOIN areas a ON CAST(a.area AS CHAR CHARACTER SET utf8mb4) = CAST(r.area AS CHAR CHARACTER SET utf8mb4)
-                      WHERE r.id = %s""", (restaurant_id,))
-    row = cursor.fetchone(); cursor.close(); db.close()
+async def get_restaurant(restaurant_id: int, user: Optional[dict] = Depends(get_optional_user)):
+    def queries():
+        row = yield (RESTAURANT_DETAIL_SQL + " WHERE r.id = %s", (restaurant_id,), "one", True)
+        if row: row['is_favorite'] = bool(user) and restaurant_id in (yield from favorite_sets.steps(user['uid']))
+        return row
+
+    row = await run_db(queries())
     if not row: raise HTTPException(status_code=404, detail="Not found")
-    return row_to_dict(row)
+    return row
 
 
 @app.get("/api/search/suggestions")
@@ -390,6 +2506,12 @@ def search_suggestions(
     搜索建议 API - 返回餐厅名称、地区、推荐菜等建议
     用于搜索框自动补全
     """
+    if SEARCH_INDEX_ENABLED:
+        if not search_index.loaded:
+            refresh_search_indexes()  # 冷启动时同步加载一次
+        elif suggestion_index.generation < 0:
+            suggestion_index.refresh()
+        return {"query": q, "suggestions": suggestion_index.lookup(q, limit)}
     db = get_db(); cursor = db.cursor(dictionary=True)
     suggestions = []
     
@@ -456,8 +2578,7 @@ def search_suggestions(
                             })
         
         # 4. 热门搜索关键词 (基于搜索历史或预设)
-        hot_keywords = ["素食", "vegan", "火锅", "早餐", "经济饭", "咖啡", "Kuala Lumpur", "Penang"]
-        matching_hot = [k for k in hot_keywords if q.lower() in k.lower()]
+        matching_hot = [k for k in HOT_KEYWORDS if q.lower() in k.lower()]
         for kw in matching_hot[:3]:
             if len(suggestions) < limit:
                 suggestions.append({
@@ -475,89 +2596,263 @@ def search_suggestions(
 
 
 @app.get("/api/search/filters")
+@cached_response("search_filters")
 def get_search_filters():
     """
     获取所有可用的搜索筛选选项
     用于前端筛选器展示
     """
-    db = get_db(); cursor = db.cursor(dictionary=True)
+    # 价格等级 (Q1版本: 1-3级)
+    price_levels = [
+        {"value": 1, "label": "$", "label_en": "Budget", "label_zh": "经济"},
+        {"value": 2, "label": "$$", "label_en": "Moderate", "label_zh": "中等"},
+        {"value": 3, "label": "$$$", "label_en": "Expensive", "label_zh": "较贵"}
+    ]
     
-    try:
-        # 价格等级 (Q1版本: 1-3级)
-        price_levels = [
-            {"value": 1, "label": "$", "label_en": "Budget", "label_zh": "经济"},
-            {"value": 2, "label": "$$", "label_en": "Moderate", "label_zh": "中等"},
-            {"value": 3, "label": "$$$", "label_en": "Expensive", "label_zh": "较贵"}
-        ]
-        
-        # 营业时段
-        time_slots = [
-            {"value": "morning", "label": "早餐", "label_en": "Morning", "hours": "6:00 - 11:00"},
-            {"value": "afternoon", "label": "午餐", "label_en": "Afternoon", "hours": "11:00 - 15:00"},
-            {"value": "evening", "label": "晚餐", "label_en": "Evening", "hours": "18:00 - 22:00"},
-            {"value": "night", "label": "宵夜", "label_en": "Night", "hours": "22:00 - 2:00"}
-        ]
-        
-        # 排序选项 (Q1版本: 无rating/saves，favorites表为空)
-        sort_options = [
-            {"value": "recommended", "label": "推荐优先", "label_en": "Recommended"},
-            {"value": "distance", "label": "距离最近", "label_en": "Nearest"},
-            {"value": "newest", "label": "最新加入", "label_en": "Newest"}
-        ]
-        
-        # 特色筛选
-        features = [
-            {"value": "recommended", "label": "推荐餐厅", "label_en": "Recommended"},
-            {"value": "is_open_now", "label": "正在营业", "label_en": "Open Now"}
-        ]
-        
-        return {
-            "price_levels": price_levels,
-            "time_slots": time_slots,
-            "sort_options": sort_options,
-            "features": features
-        }
-    finally:
-        cursor.close(); db.close()
+    # 营业时段
+    time_slots = [
+        {"value": "morning", "label": "早餐", "label_en": "Morning", "hours": "6:00 - 11:00"},
+        {"value": "afternoon", "label": "午餐", "label_en": "Afternoon", "hours": "11:00 - 15:00"},
+        {"value": "evening", "label": "晚餐", "label_en": "Evening", "hours": "18:00 - 22:00"},
+        {"value": "night", "label": "宵夜", "label_en": "Night", "hours": "22:00 - 2:00"}
+    ]
+    
+    # 排序选项 (Q1版本: 无rating/saves，favorites表为空)
+    sort_options = [
+        {"value": "recommended", "label": "推荐优先", "label_en": "Recommended"},
+        {"value": "distance", "label": "距离最近", "label_en": "Nearest"},
+        {"value": "newest", "label": "最新加入", "label_en": "Newest"}
+    ]
+    
+    # 特色筛选
+    features = [
+        {"value": "recommended", "label": "推荐餐厅", "label_en": "Recommended"},
+        {"value": "is_open_now", "label": "正在营业", "label_en": "Open Now"}
+    ]
+    
+    return {
+        "price_levels": price_levels,
+        "time_slots": time_slots,
+        "sort_options": sort_options,
+        "features": features
+    }
 
 # ============================================================
 # Favorites Endpoints
 # ============================================================
 
+FAVORITE_SET_TTL = 60  # 进程内缓存秒数, 多 worker 时其他进程的最大延迟
+
+class FavoriteSets:
+    """
+    每个用户收藏的餐厅 ID 集合 (frozenset): 首次使用时一条查询载入, 本进程的写入直接更新缓存;
+    列表/详情据此标注 is_favorite, 不再额外查询
+    """
+
+    def __init__(self):
+        self._cache = TTLCache(FAVORITE_SET_TTL, maxsize=100000)
+        self._lock = threading.Lock()
+        self.generation = 0  # 每次写入 +1; 载入期间有写入时不缓存载入结果, 避免写入被旧快照覆盖
+
+    def steps(self, uid):
+        """查询步骤 (见 run_db), 缓存命中时不查询"""
+        ids = self._cache.get(uid)
+        if ids is None:
+            generation = self.generation
+            rows = yield ("SELECT restaurant_id FROM favorites WHERE user_id = %s", (uid,), "all", False)
+            ids = frozenset(r['restaurant_id'] for r in rows)
+            self.remember(uid, ids, generation)
+        return ids
+
+    def remember(self, uid, ids, generation):
+        with self._lock:
+            if generation == self.generation: self._cache.set(uid, frozenset(ids))
+
+    def _update(self, uid, change):
+        with self._lock:
+            self.generation += 1
+            ids = self._cache.get(uid)
+            if ids is not None: self._cache.set(uid, change(ids))
+
+    def add(self, uid, restaurant_id):
+        self._update(uid, lambda ids: ids | {restaurant_id})
+
+    def discard(self, uid, restaurant_id):
+        self._update(uid, lambda ids: ids - {restaurant_id})
+
+favorite_sets = FavoriteSets()
+
+# 幂等写入, 依赖 favorites 的唯一键 uk_user_rest (user_id, restaurant_id); 餐厅不存在时不插入
+ADD_FAVORITE_SQL = """INSERT IGNORE INTO favorites (user_id, restaurant_id)
+                      SELECT %s, id FROM restaurants WHERE id = %s"""
+REMOVE_FAVORITE_SQL = "DELETE FROM favorites WHERE user_id = %s AND restaurant_id = %s"
+
 @app.get("/api/favorites")
-def list_favorites(user: dict = Depends(get_current_user)):
-    db = get_db(); cursor = db.cursor(dictionary=True)
-    try:
-        cursor.execute("""
+async def list_favorites(user: dict = Depends(get_current_user)):
+    generation = favorite_sets.generation
+    async with async_db() as db:
+        rows = await db.fetchall("""
             SELECT f.restaurant_id, r.name, r.cover_photo, r.lat, r.lng
             FROM favorites f
             JOIN restaurants r ON f.restaurant_id = r.id
             WHERE f.user_id = %s
         """, (user['uid'],))
-        rows = cursor.fetchall()
-        return {"data": rows}
-    finally: cursor.close(); db.close()
+    favorite_sets.remember(user['uid'], (r['restaurant_id'] for r in rows), generation)
+    return {"data": rows}
+
+@app.put("/api/favorites/{restaurant_id}")
+async def add_favorite(restaurant_id: int, user: dict = Depends(get_current_user)):
+    """幂等收藏: 重复请求返回 status=unchanged"""
+    async with async_db() as db:
+        added = await db.execute(ADD_FAVORITE_SQL, (user['uid'], restaurant_id))
+        await db.commit()
+        if not added and not await db.fetchone("SELECT id FROM restaurants WHERE id = %s", (restaurant_id,)):
+            raise HTTPException(status_code=404, detail="Restaurant not found")
+    favorite_sets.add(user['uid'], restaurant_id)
+    return {"ok": True, "status": "added" if added else "unchanged", "is_favorite": True}
+
+@app.delete("/api/favorites/{restaurant_id}")
+async def remove_favorite(restaurant_id: int, user: dict = Depends(get_current_user)):
+    """幂等取消收藏"""
+    async with async_db() as db:
+        removed = await db.execute(REMOVE_FAVORITE_SQL, (user['uid'], restaurant_id))
+        await db.commit()
+    favorite_sets.discard(user['uid'], restaurant_id)
+    return {"ok": True, "status": "removed" if removed else "unchanged", "is_favorite": False}
 
 @app.post("/api/favorites/{restaurant_id}")
 def toggle_favorite(restaurant_id: int, user: dict = Depends(get_current_user)):
+    """
+    旧版客户端的切换接口: 先 DELETE, 没有删除行再 INSERT IGNORE;
+    重复点击并发到达时不会因唯一键冲突报错 (新客户端请用 PUT/DELETE)
+    """
     db = get_db(); cursor = db.cursor(dictionary=True)
     try:
-        cursor.execute("SELECT id FROM favorites WHERE user_id = %s AND restaurant_id = %s", (user['uid'], restaurant_id))
-        row = cursor.fetchone()
-        if row: 
-            cursor.execute("DELETE FROM favorites WHERE id = %s", (row['id'],))
+        cursor.execute(REMOVE_FAVORITE_SQL, (user['uid'], restaurant_id))
+        if cursor.rowcount:
             status = "removed"
-        else: 
-            cursor.execute("INSERT INTO favorites (user_id, restaurant_id) VALUES (%s, %s)", (user['uid'], restaurant_id))
+        else:
+            cursor.execute(ADD_FAVORITE_SQL, (user['uid'], restaurant_id))
+            if not cursor.rowcount:
+                cursor.execute("SELECT id FROM restaurants WHERE id = %s", (restaurant_id,))
+                if not cursor.fetchone(): raise HTTPException(status_code=404, detail="Restaurant not found")
             status = "added"
         db.commit()
-        return {"ok": True, "status": status}
     finally: cursor.close(); db.close()
+    if status == "added": favorite_sets.add(user['uid'], restaurant_id)
+    else: favorite_sets.discard(user['uid'], restaurant_id)
+    return {"ok": True, "status": status}
 
 # ============================================================
 # Notifications Endpoints
 # ============================================================
 
+NOTIFICATION_COUNTER_TTL = 10   # 进程内缓存秒数, 多 worker 时的最大延迟
+UNREAD_POLL_STEP = 1            # 长轮询检查间隔(秒)
+UNREAD_MAX_WAIT = 60
+NOTIFICATION_RECONCILE_INTERVAL = int(os.getenv("VSM_NOTIFICATION_RECONCILE_INTERVAL", "600"))  # 按明细核对计数表间隔(秒), 0 关闭
+
+class NotificationCounters:
+    """
+    每个用户的未读数/总数: user_notification_counters 表维护 (notification_counters_migration.sql),
+    写入通知/标记已读时同一事务内更新, 进程内 TTL 缓存写穿, 轮询只读缓存或主键查询;
+    应用之外的写入 (Adminer、外键级联删除) 由后台定期 reconcile() 按明细修正
+    """
+
+    def __init__(self):
+        self._cache = TTLCache(NOTIFICATION_COUNTER_TTL, maxsize=100000)
+
+    async def load(self, db, uid):
+        """从计数表读取 (unread, total); 没有记录时按明细统计一次并写入 (db 为 async_db 会话)"""
+        sql = "SELECT unread_count, total_count FROM user_notification_counters WHERE user_id = %s"
+        row = await db.fetchone(sql, (uid,))
+        if row is None:
+            await db.execute("""
+                INSERT IGNORE INTO user_notification_counters (user_id, unread_count, total_count)
+                SELECT %s, COALESCE(SUM(is_read = 0), 0), COUNT(*) FROM user_notifications WHERE user_id = %s
+            """, (uid, uid))
+            row = await db.fetchone(sql, (uid,))
+        return (int(row['unread_count']), int(row['total_count']))
+
+    async def get(self, uid, db=None):
+        value = self._cache.get(uid)
+        if value is None:
+            if db is None:
+                async with async_db() as session:
+                    value = await self.load(session, uid); await session.commit()
+            else:
+                value = await self.load(db, uid)
+            self._cache.set(uid, value)
+        return value
+
+    def remember(self, uid, value):
+        self._cache.set(uid, value)
+
+    def forget(self, uids):
+        for uid in uids: self._cache.pop(uid)
+
+    def forget_range(self, lo, hi):
+        self._cache.delete_where(lambda uid: lo <= uid < hi)
+
+    async def mark_read(self, db, uid, count=1):
+        await db.execute("""
+            UPDATE user_notification_counters SET unread_count = GREATEST(unread_count - %s, 0)
+            WHERE user_id = %s
+        """, (count, uid))
+        return await self.load(db, uid)
+
+    async def mark_all_read(self, db, uid):
+        await db.execute("UPDATE user_notification_counters SET unread_count = 0 WHERE user_id = %s", (uid,))
+        return await self.load(db, uid)
+
+    def reconcile(self):
+        """
+        一致性快照中按明细重新统计, 把与计数表的差值加回计数表 (期间应用的写入不受影响);
+        多个 worker 用 GET_LOCK 保证同一时间只有一个在核对, 返回修正的用户数, 未取得锁时返回 None
+        """
+        fixes = []
+        with db_cursor(dictionary=False) as (db, cursor):
+            cursor.execute("SELECT GET_LOCK('vsm_notification_reconcile', 0)")
+            if not cursor.fetchone()[0]: return None
+            try:
+                if db.in_transaction: db.rollback()
+                db.start_transaction(consistent_snapshot=True)
+                cursor.execute("SELECT user_id, SUM(is_read = 0), COUNT(*) FROM user_notifications GROUP BY user_id")
+                actual = {uid: (int(unread), int(total)) for uid, unread, total in cursor.fetchall()}
+                cursor.execute("SELECT user_id, unread_count, total_count FROM user_notification_counters")
+                stored = {uid: (int(unread), int(total)) for uid, unread, total in cursor.fetchall()}
+                for uid in actual.keys() | stored.keys():
+                    (unread, total), (stored_unread, stored_total) = actual.get(uid, (0, 0)), stored.get(uid, (0, 0))
+                    if (unread, total) != (stored_unread, stored_total):
+                        fixes.append((uid, unread - stored_unread, total - stored_total))
+                if fixes:
+                    cursor.executemany("""
+                        INSERT INTO user_notification_counters (user_id, unread_count, total_count) VALUES (%s, %s, %s)
+                        ON DUPLICATE KEY UPDATE unread_count = unread_count + VALUES(unread_count),
+                                                total_count = total_count + VALUES(total_count)
+                    """, fixes)
+                db.commit()
+            finally:
+                cursor.execute("DO RELEASE_LOCK('vsm_notification_reconcile')")
+        if fixes:
+            self.forget([uid for uid, _, _ in fixes])
+            logger.warning("notification counters drift corrected for %d users", len(fixes))
+        return len(fixes)
+
+notification_counters = NotificationCounters()
+
+def notification_reconcile_loop():
+    """后台线程: 定期按明细核对通知计数表"""
+    while True:
+        time.sleep(NOTIFICATION_RECONCILE_INTERVAL)
+        try: notification_counters.reconcile()
+        except Exception: logger.exception("notification counter reconcile failed")
+
+@app.on_event("startup")
+def start_notification_reconcile():
+    if NOTIFICATION_RECONCILE_INTERVAL > 0:
+        threading.Thread(target=notification_reconcile_loop, name="notification-reconcile", daemon=True).start()
+
 class RegisterDeviceRequest(BaseModel):
     device_token: str
     device_type: str  # ios, android, huawei
@@ -592,100 +2887,286 @@ def register_device(req: RegisterDeviceRequest, user: dict = Depends(verify_toke
 
 
 @app.get("/api/notifications")
-def list_notifications(
+async def list_notifications(
     user: dict = Depends(get_current_user),
     page: int = 1, 
     limit: int = 20,
     unread_only: bool = False
 ):
     """获取用户通知列表"""
-    db = get_db(); cursor = db.cursor(dictionary=True)
-    try:
-        where = ["user_id = %s"]; params = [user['uid']]
-        if unread_only:
-            where.append("is_read = 0")
-        
-        where_str = " AND ".join(where)
-        offset = (page - 1) * limit
-        
-        cursor.execute(f"""
+    where = ["user_id = %s"]; params = [user['uid']]
+    if unread_only:
+        where.append("is_read = 0")
+    
+    where_str = " AND ".join(where)
+    offset = (page - 1) * limit
+    
+    async with async_db() as db:
+        rows = await db.fetchall(f"""
             SELECT * FROM user_notifications 
             WHERE {where_str}
             ORDER BY created_at DESC
             LIMIT %s OFFSET %s
         """, params + [limit, offset])
-        rows = cursor.fetchall()
-        
-        # 解析JSON数据
-        for row in rows:
-            row['data'] = parse_json_field(row['data'])
-        
-        # 获取未读数量
-        cursor.execute("""
-            SELECT COUNT(*) as unread_count 
-            FROM user_notifications 
-            WHERE user_id = %s AND is_read = 0
-        """, (user['uid'],))
-        unread_count = cursor.fetchone()['unread_count']
-        
-        # 获取总数
-        cursor.execute(f"SELECT COUNT(*) as total FROM user_notifications WHERE {where_str}", params)
-        total = cursor.fetchone()['total']
         
-        return {
-            "total": total,
-            "unread_count": unread_count,
-            "page": page,
-            "limit": limit,
-            "data": rows
-        }
-    finally: cursor.close(); db.close()
+        # 未读数量 / 总数 (计数表, 不再 COUNT 明细)
+        unread_count, total_all = await notification_counters.get(user['uid'], db)
+        await db.commit()  # 首次访问时可能初始化了计数行
+    
+    # 解析JSON数据
+    for row in rows:
+        row['data'] = parse_json_field(row['data'])
+        row.pop('broadcast_key', None)
+    total = unread_count if unread_only else total_all
+    
+    return {
+        "total": total,
+        "unread_count": unread_count,
+        "page": page,
+        "limit": limit,
+        "data": rows
+    }
 
 
 @app.get("/api/notifications/unread-count")
-def get_unread_count(user: dict = Depends(get_current_user)):
-    """获取用户未读通知数量"""
-    db = get_db(); cursor = db.cursor(dictionary=True)
-    try:
-        cursor.execute("""
-            SELECT COUNT(*) as count 
-            FROM user_notifications 
-            WHERE user_id = %s AND is_read = 0
-        """, (user['uid'],))
-        count = cursor.fetchone()['count']
-        return {"unread_count": count}
-    finally: cursor.close(); db.close()
+async def get_unread_count(
+    user: dict = Depends(get_current_user),
+    wait: int = Query(0, ge=0, le=UNREAD_MAX_WAIT, description="长轮询: If-None-Match 未变化时最多等待秒数"),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match")
+):
+    """
+    获取用户未读通知数量
+    带 If-None-Match 时未变化返回 304; 同时传 wait 则等到变化或超时
+    """
+    uid = user['uid']
+    unread, _ = await notification_counters.get(uid)
+    etag = f'"unread-{unread}"'
+    if wait and etag_matches(if_none_match, etag):
+        deadline = time.time() + wait
+        while time.time() < deadline:
+            await asyncio.sleep(UNREAD_POLL_STEP)
+            unread, _ = await notification_counters.get(uid)
+            if f'"unread-{unread}"' != etag: break
+        etag = f'"unread-{unread}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse({"unread_count": unread}, headers=headers)
 
 
 @app.post("/api/notifications/{notification_id}/read")
-def mark_notification_read(notification_id: int, user: dict = Depends(get_current_user)):
+async def mark_notification_read(notification_id: int, user: dict = Depends(get_current_user)):
     """标记通知为已读"""
-    db = get_db(); cursor = db.cursor()
-    try:
-        cursor.execute("""
+    async with async_db() as db:
+        changed = await db.execute("""
             UPDATE user_notifications 
             SET is_read = 1, read_at = NOW()
-            WHERE id = %s AND user_id = %s
+            WHERE id = %s AND user_id = %s AND is_read = 0
         """, (notification_id, user['uid']))
-        db.commit()
-        return {"ok": True, "message": "Marked as read"}
-    finally: cursor.close(); db.close()
+        counts = await notification_counters.mark_read(db, user['uid'], changed) if changed else None
+        await db.commit()
+    if counts: notification_counters.remember(user['uid'], counts)
+    return {"ok": True, "message": "Marked as read"}
 
 
 @app.post("/api/notifications/read-all")
-def mark_all_notifications_read(user: dict = Depends(get_current_user)):
+async def mark_all_notifications_read(user: dict = Depends(get_current_user)):
     """标记所有通知为已读"""
-    db = get_db(); cursor = db.cursor()
-    try:
-        cursor.execute("""
+    async with async_db() as db:
+        await db.execute("""
             UPDATE user_notifications 
             SET is_read = 1, read_at = NOW()
             WHERE user_id = %s AND is_read = 0
         """, (user['uid'],))
+        counts = await notification_counters.mark_all_read(db, user['uid'])
+        await db.commit()
+    notification_counters.remember(user['uid'], counts)
+    return {"ok": True, "message": "All notifications marked as read"}
+
+
+# ============================================================
+# Dashboard Stats (后台统计: 触发器维护的汇总表 + 定期核对)
+# ============================================================
+
+STATS_SYNC_INTERVAL = int(os.getenv("VSM_STATS_SYNC_INTERVAL", "10"))            # 读取汇总表间隔(秒), 即统计最大延迟
+STATS_RECONCILE_INTERVAL = int(os.getenv("VSM_STATS_RECONCILE_INTERVAL", "600"))  # 按明细核对汇总表间隔(秒)
+STATS_COUNTRY = "MY"  # 全局排除新加坡数据
+ER_NO_SUCH_TABLE = 1146
+ER_BAD_FIELD_ERROR = 1054  # 汇总表是旧版本结构 (缺少 category 列)
+PUBLIC_STATS_TOP_STATES = 8
+
+RESTAURANT_STAT_DIMS = "status, country, state_id, state, vegetarian_type, verification_status, category"
+RESTAURANT_STAT_SOURCE_SQL = """
+    SELECT COALESCE(status, ''), COALESCE(country, ''), COALESCE(state_id, 0), COALESCE(state, ''),
+           COALESCE(vegetarian_type, ''), COALESCE(verification_status, ''), COALESCE(category, ''), COUNT(*)
+    FROM restaurants GROUP BY 1, 2, 3, 4, 5, 6, 7"""
+STAT_COUNTER_SOURCE_SQL = """
+    SELECT 'users', COUNT(*) FROM users
+    UNION ALL SELECT 'reports_pending', COUNT(*) FROM reports WHERE status = 'pending'
+    UNION ALL SELECT 'feedback', COUNT(*) FROM feedback"""
+ACTIVITY_STATUS_TEXT = {'pending': '待审核', 'active': '已上线', 'hidden': '已隐藏', 'rejected': '已拒绝'}
+
+class DashboardStats(SyncedCache):
+    """
+    后台首页统计快照, 请求直接返回内存中的结果:
+    - 每 sync_interval 秒读取汇总表 (admin_stats_migration.sql, 触发器维护) 并汇总
+    - 每 full_interval 秒在一致性快照中按明细重新统计, 与汇总表的差值原子地加回 (期间触发器的写入不受影响)
+    - 汇总表不存在时退回按明细统计, 同样按 sync_interval 节流
+    snapshot 供 /api/admin/stats (仅马来西亚), public_snapshot 保持 /api/stats 原有的结构 (全部国家)
+    """
+    sync_interval = STATS_SYNC_INTERVAL
+    full_interval = STATS_RECONCILE_INTERVAL
+
+    def __init__(self):
+        super().__init__()
+        self.snapshot = None
+        self.public_snapshot = None
+        self.recent_activity = []
+        self.state_names = {}
+        self.reconciled_at = None
+        self.counters_available = True
+
+    def sync(self, full=False):
+        with db_cursor(dictionary=False) as (db, cursor):
+            if full or not self.counters_available:
+                cube, counters = self.reconcile(db, cursor)
+            else:
+                try:
+                    cube, counters = self.read_counters(cursor)
+                except mysql.connector.Error as e:
+                    if e.errno not in (ER_NO_SUCH_TABLE, ER_BAD_FIELD_ERROR): raise
+                    cube, counters = self.reconcile(db, cursor)
+            if full or not self.state_names:
+                cursor.execute("SELECT id, name, name_zh FROM states")
+                self.state_names = {sid: (name, name_zh) for sid, name, name_zh in cursor.fetchall()}
+            self.recent_activity = self.load_recent_activity(cursor)
+        now = time.time()
+        self.snapshot = self.build(cube, counters, now)
+        self.public_snapshot = self.build_public(cube, counters)
+        self.loaded = True
+        self.last_sync = now
+        if full: self.last_full = now
+
+    def read_counters(self, cursor):
+        cursor.execute(f"SELECT {RESTAURANT_STAT_DIMS}, cnt FROM restaurant_stat_counts")
+        cube = {tuple(r[:7]): int(r[7]) for r in cursor.fetchall()}
+        cursor.execute("SELECT name, cnt FROM stat_counters")
+        return cube, {name: int(cnt) for name, cnt in cursor.fetchall()}
+
+    def reconcile(self, db, cursor):
+        """
+        一致性快照中对比明细与汇总表, 把差值加到汇总表 (外键级联删除、批量导入不会触发触发器); 返回明细统计
+        多个 worker 用 GET_LOCK 保证同一时间只有一个在修正, 未取得锁的只读取明细统计
+        """
+        cursor.execute("SELECT GET_LOCK('vsm_stats_reconcile', 0)")
+        try:
+            return self._reconcile(db, cursor, fix=bool(cursor.fetchone()[0]))
+        finally:
+            cursor.execute("DO RELEASE_LOCK('vsm_stats_reconcile')")
+
+    def _reconcile(self, db, cursor, fix):
+        if db.in_transaction: db.rollback()
+        db.start_transaction(consistent_snapshot=True)
+        cursor.execute(RESTAURANT_STAT_SOURCE_SQL)
+        cube = {tuple(r[:7]): int(r[7]) for r in cursor.fetchall()}
+        cursor.execute(STAT_COUNTER_SOURCE_SQL)
+        counters = {name: int(cnt) for name, cnt in cursor.fetchall()}
+        try:
+            stored_cube, stored_counters = self.read_counters(cursor)
+        except mysql.connector.Error as e:
+            if e.errno not in (ER_NO_SUCH_TABLE, ER_BAD_FIELD_ERROR): raise
+            db.rollback()
+            if self.counters_available: logger.warning("admin_stats_migration.sql not applied, dashboard stats use full counts")
+            self.counters_available = False
+            return cube, counters
+        self.counters_available = True
+        if not fix:
+            db.rollback(); return cube, counters
+        cube_fixes = [key + (n - stored_cube.get(key, 0),) for key, n in cube.items() if n != stored_cube.get(key, 0)]
+        cube_fixes += [key + (-n,) for key, n in stored_cube.items() if key not in cube and n]
+        counter_fixes = [(name, n - stored_counters.get(name, 0)) for name, n in counters.items()
+                         if n != stored_counters.get(name, 0)]
+        if cube_fixes:
+            cursor.executemany(f"""
+                INSERT INTO restaurant_stat_counts ({RESTAURANT_STAT_DIMS}, cnt) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE cnt = cnt + VALUES(cnt)
+            """, cube_fixes)
+        if counter_fixes:
+            cursor.executemany("""
+                INSERT INTO stat_counters (name, cnt) VALUES (%s, %s)
+                ON DUPLICATE KEY UPDATE cnt = cnt + VALUES(cnt)
+            """, counter_fixes)
         db.commit()
-        return {"ok": True, "message": "All notifications marked as read"}
-    finally: cursor.close(); db.close()
+        if cube_fixes or counter_fixes:
+            logger.warning("dashboard stats drift corrected: %d restaurant buckets, %d counters",
+                           len(cube_fixes), len(counter_fixes))
+        self.reconciled_at = time.time()
+        return cube, counters
+
+    def build(self, cube, counters, now):
+        by_status, by_state, by_type, by_verification = Counter(), Counter(), Counter(), Counter()
+        for (status, country, state_id, state, veg_type, verification, _), n in cube.items():
+            if country != STATS_COUNTRY or n <= 0: continue
+            by_status[status] += n
+            by_verification[verification] += n
+            if status == 'active':
+                # 与 COALESCE(s.name_zh, r.state, '未知') 一致: 没有关联州属的按餐厅自身的 state 名称归类
+                by_state[self.state_names.get(state_id, (None, None))[1] or state or '未知'] += n
+                by_type[veg_type or '未分类'] += n
+        return {
+            "total_restaurants": by_status['active'],
+            "pending_count": by_status['pending'],
+            "hidden_count": by_status['hidden'],
+            "total_users": counters.get('users', 0),
+            "pending_reports": counters.get('reports_pending', 0),
+            "by_state": [{"name": name, "cnt": n} for name, n in by_state.most_common(20)],
+            "by_category": [{"category": veg_type, "cnt": n} for veg_type, n in by_type.most_common()],
+            "by_verification": [{"verification_status": v or None, "cnt": n} for v, n in by_verification.items()],
+            "as_of": datetime.fromtimestamp(now, LOCAL_TZ).isoformat(),
+            "reconciled_at": datetime.fromtimestamp(self.reconciled_at, LOCAL_TZ).isoformat() if self.reconciled_at else None,
+        }
 
+    def build_public(self, cube, counters):
+        """/api/stats 原有结构: 不区分国家, by_state 为关联州属的英文名前 8 个"""
+        by_status, by_state, by_type, by_category = Counter(), Counter(), Counter(), Counter()
+        for (status, _, state_id, _, veg_type, _, category), n in cube.items():
+            if n <= 0: continue
+            by_status[status] += n
+            if status == 'active':
+                if state_id in self.state_names: by_state[state_id] += n
+                by_type[veg_type] += n
+                by_category[category] += n
+        return {
+            "total_restaurants": by_status['active'],
+            "pending_count": by_status['pending'],
+            "hidden_count": by_status['hidden'],
+            "total_users": counters.get('users', 0),
+            "pending_reports": counters.get('reports_pending', 0),
+            "total_feedback": counters.get('feedback', 0),
+            "by_state": [{"name": self.state_names[sid][0], "cnt": n}
+                         for sid, n in by_state.most_common(PUBLIC_STATS_TOP_STATES)],
+            "by_veg_type": [{"vegetarian_type": v or None, "cnt": n} for v, n in by_type.most_common()],
+            "by_category": [{"category": c or None, "cnt": n} for c, n in by_category.most_common()],
+        }
+
+    def load_recent_activity(self, cursor):
+        """最近的餐厅与报错各 5 条, 按时间合并取前 10"""
+        cursor.execute("SELECT id, name, status, created_at FROM restaurants ORDER BY created_at DESC LIMIT 5")
+        activities = [{
+            "type": "restaurant", "title": f"{'新餐厅申请' if status == 'pending' else '餐厅更新'}: {name}",
+            "status": status, "status_text": ACTIVITY_STATUS_TEXT.get(status, status), "time": str(created_at), "id": rid,
+        } for rid, name, status, created_at in cursor.fetchall()]
+        cursor.execute("""
+            SELECT r.id, r.issue_type, r.created_at, rest.name
+            FROM reports r LEFT JOIN restaurants rest ON r.restaurant_id = rest.id
+            ORDER BY r.created_at DESC LIMIT 5
+        """)
+        activities += [{"type": "report", "title": f"用户报错: {name or '未知'} - {issue_type}", "time": str(created_at), "id": rid}
+                       for rid, issue_type, created_at, name in cursor.fetchall()]
+        activities.sort(key=lambda a: a['time'], reverse=True)
+        return activities[:10]
+
+dashboard_stats = DashboardStats()
 
 # ============================================================
 # Admin Endpoints
@@ -697,6 +3178,7 @@ def admin_list_restaurants(
     verification: Optional[str] = None,
     search: Optional[str] = None,
     page: int = 1, limit: int = 50,
+    include_total: bool = True,
     user: dict = Depends(require_admin)
 ):
     db = get_db(); cursor = db.cursor(dictionary=True)
@@ -712,77 +3194,221 @@ def admin_list_restaurants(
         where_str = " AND ".join(where)
         offset = (page - 1) * limit
 
-        cursor.execute(f"SELECT COUNT(*) as total FROM restaurants r WHERE {where_str}", params)
-        total = cursor.fetchone()['total']
+        total = None
+        if include_total:
+            count_key = ("admin_restaurants", status, verification, search)
+            total = count_cache.get(count_key)
+            if total is None:
+                cursor.execute(f"SELECT COUNT(*) as total FROM restaurants r WHERE {where_str}", params)
+                total = cursor.fetchone()['total']
+                count_cache.set(count_key, total)
 
         cursor.execute(f"""
             SELECT r.*, s.name as state_name, s.name_zh as state_name_zh, a.area as area_name
             FROM restaurants r
-            LEFT JOIN states s ON CAST(s.name AS CHAR CHARACTER SET utf8mb4)
-                                 = CAST(r.state AS CHAR CHARACTER SET utf8mb4)
-            LEFT JOIN areas a ON CAST(a.area AS CHAR CHARACTER SET utf8mb4)
-                                = CAST(r.area AS CHAR CHARACTER SET utf8mb4)
+            {LOCATION_JOINS}
             WHERE {where_str}
             ORDER BY r.created_at DESC
             LIMIT %s OFFSET %s
         """, params + [limit, offset])
-        rows = [row_to_dict(r) for r in cursor.fetchall()]
+        rows = decode_rows(cursor, cursor.fetchall())
 
         return {"total": total, "page": page, "limit": limit, "data": rows}
     finally: cursor.close(); db.close()
 
+class InvalidateCacheRequest(BaseModel):
+    namespaces: Optional[List[str]] = None  # states, areas, tags, search_filters, notices; 为空则全部
+
+@app.post("/api/admin/cache/invalidate")
+def admin_invalidate_cache(req: InvalidateCacheRequest, user: dict = Depends(require_admin)):
+    """
+    通过 Adminer 等直接修改数据后, 手动清除接口缓存;
+    scope=process 时只清除了处理本请求的 worker, 其余 worker 在 TTL 内仍返回旧数据
+    """
+    invalidate_response_cache(*(req.namespaces or []))
+    scope = "process" if isinstance(response_cache, LocalCacheBackend) else "shared"
+    return {"ok": True, "namespaces": req.namespaces or "all", "scope": scope, "ttl": RESPONSE_CACHE_TTL}
+
+@app.get("/api/admin/db-pool")
+def admin_db_pool(user: dict = Depends(require_admin)):
+    """数据库连接池状态 (使用中/等待/等待耗时)"""
+    stats = db_pool.stats()
+    if aio_pool is not None:
+        stats["async_pool"] = {"size": aio_pool.size, "free": aio_pool.freesize, "maxsize": aio_pool.maxsize}
+    return stats
+
+@app.get("/api/admin/slow-queries")
+def admin_slow_queries(
+    sort: str = Query("total_ms", description="排序: total_ms, max_ms, count, last_seen"),
+    limit: int = Query(20, ge=1, le=SLOW_QUERY_MAX_FINGERPRINTS),
+    explain: bool = Query(False, description="true 时附带完整 EXPLAIN FORMAT=JSON"),
+    user: dict = Depends(require_admin)
+):
+    """慢查询指纹排行 (默认按累计耗时)"""
+    if sort not in ("total_ms", "max_ms", "count", "last_seen"):
+        raise HTTPException(status_code=400, detail="Invalid sort")
+    return slow_query_log.top(sort, limit, explain)
+
+@app.delete("/api/admin/slow-queries")
+def admin_clear_slow_queries(user: dict = Depends(require_admin)):
+    """优化 SQL / 加索引后清空统计, 重新观察"""
+    slow_query_log.clear()
+    return {"ok": True}
+
 @app.get("/api/admin/stats")
-def admin_stats(user: dict = Depends(require_admin)):
-    db = get_db(); cursor = db.cursor(dictionary=True)
-    # 全局排除新加坡数据
-    SG_EXCLUDE = "country = 'MY'"
-    try:
-        stats = {}
-        cursor.execute(f"SELECT COUNT(*) as cnt FROM restaurants WHERE status = 'active' AND {SG_EXCLUDE}")
-        stats['total_restaurants'] = cursor.fetchone()['cnt']
-        cursor.execute(f"SELECT COUNT(*) as cnt FROM restaurants WHERE status = 'pending' AND {SG_EXCLUDE}")
-        stats['pending_count'] = cursor.fetchone()['cnt']
-        cursor.execute(f"SELECT COUNT(*) as cnt FROM restaurants WHERE status = 'hidden' AND {SG_EXCLUDE}")
-        stats['hidden_count'] = cursor.fetchone()['cnt']
-        cursor.execute("SELECT COUNT(*) as cnt FROM users")
-        stats['total_users'] = cursor.fetchone()['cnt']
-        cursor.execute("SELECT COUNT(*) as cnt FROM reports WHERE status = 'pending'")
-        stats['pending_reports'] = cursor.fetchone()['cnt']
-
-        # 各州分布（排除新加坡，按数量降序，只取前20）
-        cursor.execute(f"""
-            SELECT COALESCE(s.name_zh, r.state, '未知') as name, COUNT(*) as cnt
-            FROM restaurants r
-            LEFT JOIN states s ON CAST(s.name AS CHAR CHARACTER SET utf8mb4)
-                                 = CAST(r.state AS CHAR CHARACTER SET utf8mb4)
-            WHERE r.status = 'active' AND {SG_EXCLUDE}
-            GROUP BY COALESCE(s.name_zh, r.state)
-            ORDER BY cnt DESC
-            LIMIT 20
-        """)
-        stats['by_state'] = cursor.fetchall()
+async def admin_stats(user: dict = Depends(require_admin)):
+    """内存快照, 最多延迟 VSM_STATS_SYNC_INTERVAL 秒 (见 as_of)"""
+    await ensure_fresh_async(dashboard_stats)
+    return dashboard_stats.snapshot
 
-        # 类别分布（排除新加坡）
-        cursor.execute(f"""
-            SELECT COALESCE(vegetarian_type, '未分类') as category, COUNT(*) as cnt
-            FROM restaurants
-            WHERE status = 'active' AND {SG_EXCLUDE}
-            GROUP BY vegetarian_type
-            ORDER BY cnt DESC
-        """)
-        stats['by_category'] = cursor.fetchall()
+@app.get("/api/admin/recent-activity")
+async def admin_recent_activity(user: dict = Depends(require_admin)):
+    await ensure_fresh_async(dashboard_stats)
+    return dashboard_stats.recent_activity
 
-        cursor.execute(f"""
-            SELECT verification_status, COUNT(*) as cnt
-            FROM restaurants
-            WHERE {SG_EXCLUDE}
-            GROUP BY verification_status
-        """)
-        stats['by_verification'] = cursor.fetchall()
+@app.post("/api/admin/stats/reconcile")
+def admin_reconcile_stats(user: dict = Depends(require_admin)):
+    """批量导入或级联删除后立即按明细核对, 不等下一次定期核对"""
+    with dashboard_stats._sync_lock:
+        dashboard_stats.sync(full=True)
+    return dashboard_stats.snapshot
 
-        return stats
-    finally: cursor.close(); db.close()
 
+# ============================================================
+# Notification Broadcast (后台批量推送)
+# ============================================================
+
+BROADCAST_BATCH_SIZE = int(os.getenv("VSM_BROADCAST_BATCH_SIZE", "5000"))
+BROADCAST_KEEP_JOBS = 100    # 任务列表返回的条数
+BROADCAST_CLAIM_TIMEOUT = 3600  # 新餐厅通知的占位记录 / 任务进度超过该秒数没有更新, 视为任务已中断
+NOTIFICATION_TYPES = ['new_restaurant', 'announcement', 'promotion', 'update']
+
+BROADCAST_JOB_SAVE_SQL = """
+    INSERT INTO notification_broadcast_jobs (id, title, status, total, sent, skipped, error)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE status = VALUES(status), sent = VALUES(sent), skipped = VALUES(skipped),
+        error = VALUES(error), updated_at = NOW(),
+        finished_at = IF(VALUES(status) IN ('done', 'failed'), NOW(), NULL)
+"""
+BROADCAST_JOB_SELECT_SQL = """
+    SELECT id AS job_id, title, status, total, sent, skipped, error, created_at, finished_at,
+           status IN ('queued', 'running') AND updated_at < NOW() - INTERVAL %s SECOND AS stale
+    FROM notification_broadcast_jobs
+"""
+
+class BroadcastJob:
+    """
+    一次广播任务; 进度写入 notification_broadcast_jobs 表 (notification_broadcast_migration.sql),
+    任意 worker 都能通过 /api/admin/notifications/jobs/{job_id} 查询
+    """
+
+    def __init__(self, title, total):
+        self.id = uuid.uuid4().hex[:12]
+        self.title = title
+        self.status = "queued"
+        self.total = total
+        self.sent = 0
+        self.skipped = 0  # 重试时已送达而跳过的用户
+        self.error = None
+
+    def save(self, db, cursor):
+        cursor.execute(BROADCAST_JOB_SAVE_SQL, (self.id, self.title, self.status, self.total,
+                                                self.sent, self.skipped, self.error))
+        db.commit()
+
+def broadcast_job_dict(row):
+    """任务表的一行 -> 接口返回; 执行任务的进程退出后进度不再更新, 显示为 interrupted"""
+    if row.pop('stale'): row['status'] = "interrupted"
+    row['progress'] = round((row['sent'] + row['skipped']) / row['total'], 4) if row['total'] else 1.0
+    return row
+
+broadcast_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="broadcast")
+
+BROADCAST_INSERT_SQL = """
+    INSERT IGNORE INTO user_notifications (user_id, type, title, content, data, broadcast_key)
+    VALUES (%s, %s, %s, %s, %s, %s)
+"""
+BROADCAST_COUNTER_SQL = """
+    INSERT INTO user_notification_counters (user_id, unread_count, total_count)
+    VALUES (%s, 1, 1)
+    ON DUPLICATE KEY UPDATE unread_count = unread_count + 1, total_count = total_count + 1
+"""
+
+def undelivered(cursor, user_ids, dedupe_key):
+    """去掉已经收到过这次广播 (相同 broadcast_key) 的用户"""
+    if not dedupe_key or not user_ids: return user_ids
+    placeholders = ",".join(["%s"] * len(user_ids))
+    cursor.execute(f"SELECT user_id FROM user_notifications WHERE broadcast_key = %s AND user_id IN ({placeholders})",
+                   [dedupe_key] + list(user_ids))
+    done = {row[0] for row in cursor.fetchall()}
+    return [uid for uid in user_ids if uid not in done]
+
+def deliver_batch(db, cursor, user_ids, notification_type, title, content, data_json, dedupe_key):
+    """写入一批通知并更新计数, 同一事务提交; 返回实际写入的用户数"""
+    todo = undelivered(cursor, user_ids, dedupe_key)
+    if todo:
+        cursor.executemany(BROADCAST_INSERT_SQL,
+                           [(uid, notification_type, title, content, data_json, dedupe_key) for uid in todo])
+        cursor.executemany(BROADCAST_COUNTER_SQL, [(uid,) for uid in todo])
+    db.commit()
+    return len(todo)
+
+def run_broadcast(job, notification_type, title, content, data_json, user_ids=None, dedupe_key=None,
+                  on_done=None, on_failed=None):
+    """
+    分批写入 user_notifications, 每批单独提交, 不长时间占用事务
+    - 全体用户: 按 id 区间分批
+    - 指定用户: 按列表分批
+    dedupe_key 相同的通知每个用户只写一次, 失败后重试会跳过已送达的用户; 失败时调用 on_failed 释放占位
+    """
+    try:
+        with db_cursor(dictionary=False) as (db, cursor):
+            job.status = "running"; job.save(db, cursor)
+            if user_ids:
+                for i in range(0, len(user_ids), BROADCAST_BATCH_SIZE):
+                    chunk = user_ids[i:i + BROADCAST_BATCH_SIZE]
+                    delivered = deliver_batch(db, cursor, chunk, notification_type, title, content, data_json, dedupe_key)
+                    notification_counters.forget(chunk)
+                    job.sent += delivered; job.skipped += len(chunk) - delivered
+                    job.save(db, cursor)
+            else:
+                cursor.execute("SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), -1) FROM users WHERE is_active = 1")
+                lo, hi = cursor.fetchone()
+                for start in range(lo, hi + 1, BROADCAST_BATCH_SIZE):
+                    cursor.execute("SELECT id FROM users WHERE is_active = 1 AND id >= %s AND id < %s",
+                                   (start, start + BROADCAST_BATCH_SIZE))
+                    chunk = [row[0] for row in cursor.fetchall()]
+                    delivered = deliver_batch(db, cursor, chunk, notification_type, title, content, data_json, dedupe_key)
+                    notification_counters.forget_range(start, start + BROADCAST_BATCH_SIZE)
+                    job.sent += delivered; job.skipped += len(chunk) - delivered
+                    job.save(db, cursor)
+            if on_done: on_done(db, cursor)
+        job.status = "done"
+    except Exception as e:
+        logger.exception("broadcast %s failed", job.id)
+        job.status = "failed"; job.error = str(e)
+        if on_failed:
+            try:
+                with db_cursor(dictionary=False) as (db, cursor): on_failed(db, cursor)
+            except Exception: logger.exception("broadcast %s cleanup failed", job.id)
+    try:
+        with db_cursor(dictionary=False) as (db, cursor): job.save(db, cursor)
+    except Exception: logger.exception("broadcast %s status update failed", job.id)
+
+def submit_broadcast(title, total, **kwargs):
+    job = BroadcastJob(title, total)
+    with db_cursor(dictionary=False) as (db, cursor):
+        try: job.save(db, cursor)
+        except Exception:
+            if kwargs.get("on_failed"): kwargs["on_failed"](db, cursor)  # 释放占位, 以便重试
+            raise
+    broadcast_executor.submit(run_broadcast, job, title=title, **kwargs)
+    return job
+
+def count_active_users(cursor):
+    cursor.execute("SELECT COUNT(*) AS cnt FROM users WHERE is_active = 1")
+    row = cursor.fetchone()
+    return row['cnt'] if isinstance(row, dict) else row[0]
 
 class SendNotificationRequest(BaseModel):
     user_ids: Optional[List[int]] = None  # 为空则发送给所有用户
@@ -793,42 +3419,27 @@ class SendNotificationRequest(BaseModel):
 
 @app.post("/api/admin/notifications/send")
 def admin_send_notification(req: SendNotificationRequest, user: dict = Depends(require_admin)):
-    """管理员发送通知给指定用户或所有用户"""
-    db = get_db(); cursor = db.cursor()
-    try:
-        notification_type = req.type if req.type in ['new_restaurant', 'announcement', 'promotion', 'update'] else 'announcement'
-        
-        if req.user_ids:
-            # 发送给指定用户
-            for uid in req.user_ids:
-                cursor.execute("""
-                    INSERT INTO user_notifications (user_id, type, title, content, data)
-                    VALUES (%s, %s, %s, %s, %s)
-                """, (uid, notification_type, req.title, req.content, json.dumps(req.data) if req.data else None))
-            target_count = len(req.user_ids)
-        else:
-            # 发送给所有用户
-            cursor.execute("SELECT id FROM users WHERE is_active = 1")
-            all_users = cursor.fetchall()
-            for u in all_users:
-                cursor.execute("""
-                    INSERT INTO user_notifications (user_id, type, title, content, data)
-                    VALUES (%s, %s, %s, %s, %s)
-                """, (u['id'], notification_type, req.title, req.content, json.dumps(req.data) if req.data else None))
-            target_count = len(all_users)
-        
-        db.commit()
-        return {
-            "ok": True, 
-            "message": f"Notification sent to {target_count} users",
-            "target_count": target_count
-        }
-    finally: cursor.close(); db.close()
+    """管理员发送通知给指定用户或所有用户 (后台任务, 立即返回 job_id)"""
+    notification_type = req.type if req.type in NOTIFICATION_TYPES else 'announcement'
+    if req.user_ids:
+        target_count = len(req.user_ids)
+    else:
+        with db_cursor(dictionary=False) as (db, cursor):
+            target_count = count_active_users(cursor)
+    job = submit_broadcast(
+        req.title, target_count, notification_type=notification_type, content=req.content,
+        data_json=json.dumps(req.data) if req.data else None, user_ids=req.user_ids)
+    return {
+        "ok": True, 
+        "message": f"Notification queued for {target_count} users",
+        "target_count": target_count,
+        "job_id": job.id
+    }
 
 
 @app.post("/api/admin/notifications/new-restaurant/{restaurant_id}")
 def admin_notify_new_restaurant(restaurant_id: int, user: dict = Depends(require_admin)):
-    """通知所有用户有新餐厅上线"""
+    """通知所有用户有新餐厅上线 (后台任务, 立即返回 job_id)"""
     db = get_db(); cursor = db.cursor(dictionary=True)
     try:
         # 获取餐厅信息
@@ -840,44 +3451,90 @@ def admin_notify_new_restaurant(restaurant_id: int, user: dict = Depends(require
         restaurant_name = restaurant['name_zh'] or restaurant['name_en'] or 'New Restaurant'
         location = f"{restaurant['area']}, {restaurant['state']}" if restaurant['area'] else restaurant['state']
         
-        # 检查是否已发送过通知
-        cursor.execute("SELECT id FROM new_restaurant_notifications WHERE restaurant_id = %s", (restaurant_id,))
-        if cursor.fetchone():
-            return {"ok": False, "message": "Notification already sent for this restaurant"}
-        
-        # 记录已发送
+        # 占位记录 (唯一键防止重复发送), 任务完成后标记 notification_sent=1, 失败时删除以便重试;
+        # 进程中途退出留下的占位超过 BROADCAST_CLAIM_TIMEOUT 后可以重新占用
         cursor.execute("""
-            INSERT INTO new_restaurant_notifications (restaurant_id, notification_sent, sent_at)
-            VALUES (%s, 1, NOW())
+            INSERT IGNORE INTO new_restaurant_notifications (restaurant_id, notification_sent)
+            VALUES (%s, 0)
         """, (restaurant_id,))
-        
-        # 发送给所有用户
-        title = f"🎉 新餐厅上线: {restaurant_name}"
-        content = f"{location} 新增一家素食餐厅，快来看看！"
-        data = {"restaurant_id": restaurant_id, "type": "new_restaurant"}
-        
-        cursor.execute("SELECT id FROM users WHERE is_active = 1")
-        all_users = cursor.fetchall()
-        for u in all_users:
+        if cursor.rowcount == 0:
             cursor.execute("""
-                INSERT INTO user_notifications (user_id, type, title, content, data)
-                VALUES (%s, 'new_restaurant', %s, %s, %s)
-            """, (u['id'], title, content, json.dumps(data)))
-        
+                UPDATE new_restaurant_notifications SET created_at = NOW()
+                WHERE restaurant_id = %s AND notification_sent = 0 AND created_at < NOW() - INTERVAL %s SECOND
+            """, (restaurant_id, BROADCAST_CLAIM_TIMEOUT))
+        if cursor.rowcount == 0:
+            cursor.execute("SELECT notification_sent FROM new_restaurant_notifications WHERE restaurant_id = %s", (restaurant_id,))
+            claim = cursor.fetchone()
+            if claim and not claim['notification_sent']:
+                return {"ok": False, "message": "Notification for this restaurant is already in progress"}
+            return {"ok": False, "message": "Notification already sent for this restaurant"}
         db.commit()
-        return {
-            "ok": True, 
-            "message": f"New restaurant notification sent to {len(all_users)} users",
-            "restaurant_name": restaurant_name
-        }
+        target_count = count_active_users(cursor)
     finally: cursor.close(); db.close()
 
+    def mark_sent(db, cursor):
+        cursor.execute("""
+            UPDATE new_restaurant_notifications SET notification_sent = 1, sent_at = NOW()
+            WHERE restaurant_id = %s
+        """, (restaurant_id,))
+        db.commit()
+
+    def release_claim(db, cursor):
+        cursor.execute("""
+            DELETE FROM new_restaurant_notifications WHERE restaurant_id = %s AND notification_sent = 0
+        """, (restaurant_id,))
+        db.commit()
+
+    # 发送给所有用户
+    title = f"🎉 新餐厅上线: {restaurant_name}"
+    content = f"{location} 新增一家素食餐厅，快来看看！"
+    data = {"restaurant_id": restaurant_id, "type": "new_restaurant"}
+    job = submit_broadcast(
+        title, target_count, notification_type='new_restaurant', content=content,
+        data_json=json.dumps(data), dedupe_key=f"new_restaurant:{restaurant_id}",
+        on_done=mark_sent, on_failed=release_claim)
+    return {
+        "ok": True, 
+        "message": f"New restaurant notification queued for {target_count} users",
+        "restaurant_name": restaurant_name,
+        "job_id": job.id
+    }
+
+
+@app.post("/api/admin/notifications/reconcile")
+def admin_reconcile_notification_counters(user: dict = Depends(require_admin)):
+    """立即按明细核对通知计数 (例如通过 Adminer 增删通知之后)"""
+    fixed = notification_counters.reconcile()
+    if fixed is None:
+        return {"ok": False, "message": "Reconcile already running"}
+    return {"ok": True, "fixed_users": fixed}
+
+
+@app.get("/api/admin/notifications/jobs")
+def admin_list_broadcast_jobs(user: dict = Depends(require_admin)):
+    """最近的广播任务"""
+    with db_cursor() as (db, cursor):
+        cursor.execute(BROADCAST_JOB_SELECT_SQL + " ORDER BY created_at DESC LIMIT %s",
+                       (BROADCAST_CLAIM_TIMEOUT, BROADCAST_KEEP_JOBS))
+        return {"data": [broadcast_job_dict(row) for row in cursor.fetchall()]}
+
+
+@app.get("/api/admin/notifications/jobs/{job_id}")
+def admin_get_broadcast_job(job_id: str, user: dict = Depends(require_admin)):
+    """广播任务进度"""
+    with db_cursor() as (db, cursor):
+        cursor.execute(BROADCAST_JOB_SELECT_SQL + " WHERE id = %s", (BROADCAST_CLAIM_TIMEOUT, job_id))
+        row = cursor.fetchone()
+    if not row: raise HTTPException(status_code=404, detail="Job not found")
+    return broadcast_job_dict(row)
+
 
 # ============================================================
 # Helper Endpoints
 # ============================================================
 
 @app.get("/api/notices")
+@cached_response("notices", ttl=60)
 def list_notices(
     type: Optional[str] = None,  # banner, popup
     limit: int = 5
@@ -910,7 +3567,15 @@ def list_notices(
     finally: cursor.close(); db.close()
 
 
+@app.get("/api/stats")
+async def get_stats():
+    """公开的首页统计 (不需要登录), 由后台统计的内存快照生成, 最多延迟 VSM_STATS_SYNC_INTERVAL 秒"""
+    await ensure_fresh_async(dashboard_stats)
+    return dashboard_stats.public_snapshot
+
+
 @app.get("/api/states")
+@cached_response("states")
 def list_states():
     db = get_db(); cursor = db.cursor(dictionary=True)
     try:
@@ -931,6 +3596,7 @@ def list_states():
     finally: cursor.close(); db.close()
 
 @app.get("/api/states/{state_id}/areas")
+@cached_response("areas")
 def list_areas(state_id: int):
     db = get_db(); cursor = db.cursor(dictionary=True)
     try:
@@ -943,49 +3609,441 @@ def list_areas(state_id: int):
     finally: cursor.close(); db.close()
 
 @app.get("/api/tags")
+@cached_response("tags")
 def list_tags(type: Optional[str] = None):
     db = get_db(); cursor = db.cursor(dictionary=True)
     try:
-        where = "WHERE is_active = 1"
-        if type: where += f" AND type = '{type}'"
-        cursor.execute(f"SELECT * FROM tags {where} ORDER BY type, sort_order, name_en")
+        where = "WHERE is_active = 1"; params = []
+        if type: where += " AND type = %s"; params.append(type)
+        cursor.execute(f"SELECT * FROM tags {where} ORDER BY type, sort_order, name_en", params)
         return cursor.fetchall()
     finally: cursor.close(); db.close()
 
+# ============================================================
+# Photo Cache (旧站图片代理: 共享 HTTP 连接池 + 同一图片并发只回源一次 + 磁盘 LRU)
+# ============================================================
+
+PHOTO_UPSTREAM = os.getenv("VSM_PHOTO_UPSTREAM", "http://goveggiemalaysia.com/foodlogDB_cms/images/vendorPic")
+# 回源下载的图片单独存放并参与 LRU 淘汰; PHOTO_DIR 中已有的原图只读, 不建索引也不会被删除
+PHOTO_CACHE_DIR = os.getenv("VSM_PHOTO_CACHE_DIR", os.path.join(os.path.dirname(__file__), "photo_cache"))
+PHOTO_CACHE_MAX_BYTES = int(os.getenv("VSM_PHOTO_CACHE_MAX_MB", "2048")) * 1024 * 1024
+PHOTO_FETCH_TIMEOUT = 10
+PHOTO_MISS_TTL = 300        # 上游 404 记住的秒数, 避免反复回源
+PHOTO_MAX_AGE = 7 * 86400
+
+class PhotoCache:
+    """
+    磁盘缓存文件的内存索引: 路径 -> (大小, mtime), 按访问顺序 LRU
+    总大小超过 max_bytes 时淘汰最久未访问的文件; 实际删除由调用方在线程池中进行
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._index = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.inflight = {}      # 路径 -> asyncio.Future, 并发请求共用一次回源
+        self.misses = TTLCache(PHOTO_MISS_TTL, maxsize=10000)
+
+    def __len__(self):
+        return len(self._index)
+
+    def scan(self):
+        """启动时扫描磁盘建立索引 (按 atime 排序, 近似原有访问顺序), 返回需淘汰的文件"""
+        entries = []
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                if name.startswith("."): continue  # 写入中的临时文件
+                path = os.path.join(dirpath, name)
+                try: st = os.stat(path)
+                except OSError: continue
+                entries.append((st.st_atime, path, st.st_size, st.st_mtime))
+        entries.sort()
+        with self._lock:
+            self._index.clear(); self.total_bytes = 0
+            for _, path, size, mtime in entries:
+                self._index[path] = (size, mtime); self.total_bytes += size
+        return self._evict()
+
+    def get(self, path):
+        with self._lock:
+            entry = self._index.get(path)
+            if entry is not None: self._index.move_to_end(path)
+            return entry
+
+    def add(self, path, size, mtime):
+        with self._lock:
+            old = self._index.pop(path, None)
+            if old: self.total_bytes -= old[0]
+            self._index[path] = (size, mtime); self.total_bytes += size
+        return self._evict()
+
+    def _evict(self):
+        victims = []
+        with self._lock:
+            while self.total_bytes > self.max_bytes and len(self._index) > 1:
+                path, (size, _) = self._index.popitem(last=False)
+                self.total_bytes -= size; victims.append(path)
+        return victims
+
+photo_cache = PhotoCache(PHOTO_CACHE_DIR, PHOTO_CACHE_MAX_BYTES)
+photo_client = None
+
+def get_photo_client():
+    """进程内共享的 httpx.AsyncClient (keep-alive 连接池)"""
+    global photo_client
+    if photo_client is None:
+        import httpx
+        photo_client = httpx.AsyncClient(
+            timeout=PHOTO_FETCH_TIMEOUT, follow_redirects=True,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10))
+    return photo_client
+
+def stat_file(path):
+    if not os.path.isfile(path): return None
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime)
+
+def write_file_atomic(path, content):
+    """先写临时文件再 rename, 并发读取不会读到半个文件; 返回 (大小, mtime)"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+    with open(tmp, "wb") as f: f.write(content)
+    os.replace(tmp, path)
+    return stat_file(path)
+
+def remove_files(paths):
+    for path in paths:
+        try: os.remove(path)
+        except OSError: pass
+
+def read_file_range(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start); return f.read(length)
+
+async def single_flight(cache, path, produce):
+    """同一路径同时只执行一次 produce(), 其他请求等待同一个结果; 失败时结果为 None"""
+    pending = cache.inflight.get(path)
+    if pending is not None:
+        return await asyncio.shield(pending)
+    pending = asyncio.get_running_loop().create_future()
+    cache.inflight[path] = pending
+    result = None
+    try:
+        result = await produce()
+    except Exception:
+        logger.warning("cache fill failed: %s", path, exc_info=True)
+    finally:
+        cache.inflight.pop(path, None)
+        pending.set_result(result)
+    return result
+
+async def fetch_photo(path, remote_url):
+    """返回 (大小, mtime); 本地没有时回源, 同一路径的并发请求等待同一次回源"""
+    entry = photo_cache.get(path)
+    if entry: return entry
+
+    async def produce():
+        entry = await run_in_threadpool(stat_file, path)  # 其他 worker 已写入的文件
+        if entry is None and not photo_cache.misses.get(remote_url):
+            resp = await get_photo_client().get(remote_url)
+            if resp.status_code == 200 and resp.content:
+                entry = await run_in_threadpool(write_file_atomic, path, resp.content)
+            elif resp.status_code == 404:
+                photo_cache.misses.set(remote_url, True)
+        if entry:
+            victims = photo_cache.add(path, *entry)
+            if victims: await run_in_threadpool(remove_files, victims)
+        return entry
+
+    return await single_flight(photo_cache, path, produce)
+
+def parse_byte_range(header, size):
+    """单个区间 bytes=a-b / a- / -n -> (start, end) 含 end; 不支持或越界时返回 None"""
+    unit, _, spec = (header or "").partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec: return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first); end = min(int(last), size - 1) if last else size - 1
+        else:
+            start = max(0, size - int(last)); end = size - 1
+    except ValueError:
+        return None
+    return (start, end) if 0 <= start <= end < size else None
+
+async def serve_cached_file(path, entry, request, media_type, extra_headers=None):
+    """带 ETag / Last-Modified / Range 的文件响应"""
+    size, mtime = entry
+    etag = f'"{int(mtime):x}-{size:x}"'
+    last_modified = formatdate(mtime, usegmt=True)
+    headers = {"ETag": etag, "Last-Modified": last_modified, "Accept-Ranges": "bytes",
+               "Cache-Control": f"public, max-age={PHOTO_MAX_AGE}", **(extra_headers or {})}
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    if not if_none_match and if_modified_since:
+        try:
+            if int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp():
+                return Response(status_code=304, headers=headers)
+        except (TypeError, ValueError):
+            pass
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range in (etag, last_modified)):
+        byte_range = parse_byte_range(range_header, size)
+        if byte_range is None:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        start, end = byte_range
+        body = await run_in_threadpool(read_file_range, path, start, end - start + 1)
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        return Response(content=body, status_code=206, media_type=media_type, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+@app.on_event("startup")
+async def load_photo_cache_index():
+    victims = await run_in_threadpool(photo_cache.scan)
+    if victims: await run_in_threadpool(remove_files, victims)
+
+@app.on_event("shutdown")
+async def close_photo_client():
+    if photo_client is not None:
+        await photo_client.aclose()
+
 @app.get("/api/photos/{legacy_pid}/{filename}")
-async def get_photo(legacy_pid: int, filename: str):
-    import httpx
+async def get_photo(legacy_pid: int, filename: str, request: Request,
+                    w: Optional[int] = Query(None, ge=1, description="目标宽度, 取不小于它的预设宽度"),
+                    size: Optional[str] = Query(None, description="thumb | card | full")):
+    if filename != os.path.basename(filename) or filename.startswith("."):
+        raise HTTPException(status_code=404, detail="Not found")
+    # 先找本地原图, 没有时从旧站回源到 PHOTO_CACHE_DIR
     file_path = os.path.join(PHOTO_DIR, str(legacy_pid), filename)
-    if os.path.isfile(file_path):
-        return FileResponse(file_path, media_type="image/jpeg")
-    remote_url = f"http://goveggiemalaysia.com/foodlogDB_cms/images/vendorPic/{filename}"
-    try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            resp = await client.get(remote_url)
-            if resp.status_code == 200:
-                os.makedirs(os.path.join(PHOTO_DIR, str(legacy_pid)), exist_ok=True)
-                with open(file_path, 'wb') as f: f.write(resp.content)
-                return Response(content=resp.content, media_type="image/jpeg")
-    except: pass
-    return {"error": "Not found"}, 404
+    entry = await run_in_threadpool(stat_file, file_path)
+    if not entry:
+        file_path = os.path.join(PHOTO_CACHE_DIR, str(legacy_pid), filename)
+        entry = await fetch_photo(file_path, f"{PHOTO_UPSTREAM}/{filename}")
+    if not entry: raise HTTPException(status_code=404, detail="Not found")
+    return await serve_image(file_path, entry, f"photos/{legacy_pid}", request, w, size)
+
+# ============================================================
+# Image Variants (缩略图 / 指定宽度, 按需生成并缓存在磁盘)
+# ============================================================
+
+try:
+    from PIL import Image, ImageOps  # 可选: 没有安装 Pillow 时直接返回原图
+except ImportError:
+    Image = ImageOps = None
+
+VARIANT_DIR = os.getenv("VSM_VARIANT_DIR", os.path.join(os.path.dirname(__file__), "variants"))
+VARIANT_CACHE_MAX_BYTES = int(os.getenv("VSM_VARIANT_CACHE_MAX_MB", "1024")) * 1024 * 1024
+VARIANT_SIZES = {"thumb": 200, "card": 600, "full": 1600}
+VARIANT_WIDTHS = sorted(set(VARIANT_SIZES.values()) | {400, 800, 1200})  # ?w= 取整到这些宽度, 限制变体数量
+VARIANT_PREGENERATE = ("thumb", "card")  # 上传时预先生成
+VARIANT_QUALITY = 80
+
+variant_cache = PhotoCache(VARIANT_DIR, VARIANT_CACHE_MAX_BYTES)
+variant_executor = ThreadPoolExecutor(max_workers=int(os.getenv("VSM_IMAGE_WORKERS", "2")), thread_name_prefix="image")
+
+def variant_width(size=None, w=None):
+    """size / w -> 目标宽度; 不需要缩放 (或没有 Pillow) 时返回 None"""
+    if Image is None: return None
+    if size:
+        if size not in VARIANT_SIZES:
+            raise HTTPException(status_code=400, detail=f"size must be one of {', '.join(VARIANT_SIZES)}")
+        return VARIANT_SIZES[size]
+    if w:
+        return next((width for width in VARIANT_WIDTHS if width >= w), VARIANT_WIDTHS[-1])
+    return None
+
+def variant_path(key, filename, width, fmt):
+    return os.path.join(VARIANT_DIR, key, f"{os.path.splitext(filename)[0]}.{width}.{fmt.lower()}")
+
+def render_variant(src, dest, width, fmt):
+    """按宽度等比缩小 (不放大) 并转码, 返回 (大小, mtime); 在 variant_executor 中执行"""
+    with Image.open(src) as im:
+        im = ImageOps.exif_transpose(im)
+        if im.width > width:
+            im.thumbnail((width, width * 20), Image.LANCZOS)
+        if fmt == "JPEG" and im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = os.path.join(os.path.dirname(dest), f".{os.path.basename(dest)}.{uuid.uuid4().hex}.tmp")
+        options = {"quality": VARIANT_QUALITY}
+        if fmt == "JPEG": options.update(optimize=True, progressive=True)
+        if fmt == "WEBP": options["method"] = 4
+        im.save(tmp, fmt, **options)
+    os.replace(tmp, dest)
+    return stat_file(dest)
+
+def store_variant(src, dest, width, fmt):
+    entry = render_variant(src, dest, width, fmt)
+    remove_files(variant_cache.add(dest, *entry))
+    return entry
+
+def pregenerate_variants(src, key, filename):
+    """上传后在后台生成常用尺寸的 WebP 变体"""
+    for size in VARIANT_PREGENERATE:
+        try: store_variant(src, variant_path(key, filename, VARIANT_SIZES[size], "WEBP"), VARIANT_SIZES[size], "WEBP")
+        except Exception: logger.warning("variant pregeneration failed: %s", src, exc_info=True)
+
+async def get_variant(src, src_entry, key, width, fmt):
+    """返回 (路径, (大小, mtime)); 原图比变体新时重新生成"""
+    dest = variant_path(key, os.path.basename(src), width, fmt)
+    entry = variant_cache.get(dest)
+    if entry and entry[1] >= src_entry[1]: return dest, entry
+
+    async def produce():
+        current = await run_in_threadpool(stat_file, dest)
+        if current and current[1] >= src_entry[1]:
+            victims = variant_cache.add(dest, *current)
+            if victims: await run_in_threadpool(remove_files, victims)
+            return current
+        return await asyncio.wrap_future(variant_executor.submit(store_variant, src, dest, width, fmt))
+
+    entry = await single_flight(variant_cache, dest, produce)
+    return (dest, entry) if entry else None
+
+async def serve_image(path, entry, key, request, w=None, size=None):
+    """原图或缩放后的变体; 客户端接受 WebP 时返回 WebP"""
+    media_type = mimetypes.guess_type(path)[0] or "image/jpeg"
+    width = variant_width(size, w)
+    if width is None:
+        return await serve_cached_file(path, entry, request, media_type)
+    fmt = "WEBP" if "image/webp" in request.headers.get("accept", "") else "JPEG"
+    variant = await get_variant(path, entry, key, width, fmt)
+    if variant is None:  # 不是可解码的图片, 退回原图
+        return await serve_cached_file(path, entry, request, media_type, {"Vary": "Accept"})
+    return await serve_cached_file(variant[0], variant[1], request, f"image/{fmt.lower()}", {"Vary": "Accept"})
+
+@app.on_event("startup")
+async def load_variant_cache_index():
+    if Image is None:
+        logger.warning("Pillow is not installed: image variants (?w= / ?size=) are disabled, originals are served")
+    victims = await run_in_threadpool(variant_cache.scan)
+    if victims: await run_in_threadpool(remove_files, victims)
 
 # ============================================================
 # Upload Endpoints
 # ============================================================
 
+@app.get("/uploads/{filename}")
+async def get_upload(filename: str, request: Request,
+                     w: Optional[int] = Query(None, ge=1, description="目标宽度, 取不小于它的预设宽度"),
+                     size: Optional[str] = Query(None, description="thumb | card | full")):
+    """上传的图片; 支持 ?w= / ?size= 缩放 (先于下面的 StaticFiles 挂载匹配)"""
+    if filename != os.path.basename(filename) or filename.startswith("."):
+        raise HTTPException(status_code=404, detail="Not found")
+    file_path = os.path.join(UPLOAD_DIR, filename)
+    entry = await run_in_threadpool(stat_file, file_path)
+    if not entry: raise HTTPException(status_code=404, detail="Not found")
+    return await serve_image(file_path, entry, "uploads", request, w, size)
+
 app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 
+UPLOAD_MAX_BYTES = int(os.getenv("VSM_UPLOAD_MAX_MB", "10")) * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 256 * 1024
+UPLOAD_FORM_OVERHEAD = 64 * 1024  # multipart 边界/字段的余量
+
+def sniff_image_type(head):
+    """按文件头判断图片类型, 返回扩展名; 不是支持的图片返回 None"""
+    if head.startswith(b"\xff\xd8\xff"): return ".jpg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"): return ".png"
+    if head[:6] in (b"GIF87a", b"GIF89a"): return ".gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP": return ".webp"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"heic", b"heix", b"mif1", b"msf1"): return ".heic"
+    return None
+
+def write_upload_chunk(f, digest, chunk):
+    f.write(chunk); digest.update(chunk)
+
+def finish_upload(tmp, filepath):
+    """内容相同的文件已存在时丢弃临时文件 (去重), 返回是否新文件"""
+    if os.path.exists(filepath):
+        os.remove(tmp); return False
+    os.replace(tmp, filepath); return True
+
+class UploadSizeLimit:
+    """
+    /api/upload 请求体的字节上限: Content-Length 超限的在读取请求体之前直接拒绝,
+    没有 Content-Length 的分块上传在接收时累计字节数, 超限即中止 (Starlette 解析表单时最多缓存到上限)
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != "/api/upload":
+            return await self.app(scope, receive, send)
+        limit = UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > limit:
+            return await JSONResponse({"detail": "File too large"}, status_code=413)(scope, receive, send)
+        received = 0; too_large = False; started = False
+
+        # 超限后对内层应用表现为客户端断开 (表单解析中止), 内层的错误响应丢弃, 改为返回 413
+        async def limited_receive():
+            nonlocal received, too_large
+            if too_large: return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    too_large = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            if too_large and not started: return
+            started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not too_large: raise
+        if too_large and not started:
+            await JSONResponse({"detail": "File too large"}, status_code=413)(scope, receive, send)
+
+app.add_middleware(UploadSizeLimit)
+
 @app.post("/api/upload")
 async def upload_photo(file: UploadFile = File(...), user: dict = Depends(verify_token)):
-    import uuid as _uuid
-    ext = os.path.splitext(file.filename or "photo.jpg")[1] or ".jpg"
-    filename = f"{_uuid.uuid4().hex}{ext}"
+    """
+    请求体大小由 UploadSizeLimit 在接收时限制; 这里把 Starlette 已缓存的文件分块复制到临时文件
+    (线程池写入), 同时计算 sha256; 文件名取内容哈希, 相同图片只保存一份
+    """
+    head = await file.read(UPLOAD_CHUNK_SIZE)
+    ext = sniff_image_type(head)
+    if ext is None:
+        raise HTTPException(status_code=415, detail="Only JPEG, PNG, GIF, WebP or HEIC images are allowed")
+    tmp = os.path.join(UPLOAD_DIR, f".upload-{uuid.uuid4().hex}.tmp")
+    digest = hashlib.sha256()
+    size = 0
+    f = await run_in_threadpool(open, tmp, "wb")
+    try:
+        chunk = head
+        while chunk:
+            size += len(chunk)
+            if size > UPLOAD_MAX_BYTES:
+                raise HTTPException(status_code=413, detail="File too large")
+            await run_in_threadpool(write_upload_chunk, f, digest, chunk)
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+    except BaseException:
+        await run_in_threadpool(f.close)
+        await run_in_threadpool(remove_files, [tmp])
+        raise
+    await run_in_threadpool(f.close)
+
+    filename = f"{digest.hexdigest()[:32]}{ext}"
     filepath = os.path.join(UPLOAD_DIR, filename)
-    content = await file.read()
-    with open(filepath, "wb") as f:
-        f.write(content)
+    created = await run_in_threadpool(finish_upload, tmp, filepath)
+    if created and Image is not None:
+        variant_executor.submit(pregenerate_variants, filepath, "uploads", filename)
     url = f"/uploads/{filename}"
-    return {"ok": True, "url": url, "filename": filename}
+    return {"ok": True, "url": url, "filename": filename, "size": size, "deduplicated": not created}
 
 if __name__ == "__main__":
     import uvicorn
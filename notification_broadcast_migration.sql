@@ -0,0 +1,52 @@
+-- ============================================
+-- VSM Backend Migration: 广播通知去重
+-- Date: 2026-10-18
+-- 目的: 广播任务失败后可以重试, 已送达的用户不会再收到一次
+--       user_notifications.broadcast_key 标识一次广播 (如 new_restaurant:123), (user_id, broadcast_key) 唯一;
+--       普通通知 broadcast_key 为 NULL, 不受唯一键限制
+--       notification_broadcast_jobs 记录广播任务进度, 多 worker 部署时任意 worker 都能查询
+-- 需在部署新版 main.py 之前执行; 可重复执行
+-- ============================================
+
+-- 1. 广播标识列
+SET @exist := (SELECT COUNT(*) FROM information_schema.columns
+  WHERE table_name = 'user_notifications' AND column_name = 'broadcast_key' AND table_schema = DATABASE());
+SET @sql := IF(@exist = 0, 'ALTER TABLE user_notifications ADD COLUMN broadcast_key VARCHAR(64) NULL AFTER data', 'SELECT "Column already exists"');
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- 2. 回填: 已发送的新餐厅通知, 每个 (用户, 餐厅) 只标记最早的一条 (重复的旧记录保持 NULL)
+UPDATE user_notifications n
+JOIN (
+  SELECT MIN(id) AS id FROM user_notifications
+  WHERE type = 'new_restaurant' AND JSON_EXTRACT(data, '$.restaurant_id') IS NOT NULL
+  GROUP BY user_id, JSON_UNQUOTE(JSON_EXTRACT(data, '$.restaurant_id'))
+) first ON first.id = n.id
+SET n.broadcast_key = CONCAT('new_restaurant:', JSON_UNQUOTE(JSON_EXTRACT(n.data, '$.restaurant_id')))
+WHERE n.broadcast_key IS NULL;
+
+-- 3. 唯一键
+SET @exist := (SELECT COUNT(*) FROM information_schema.statistics
+  WHERE table_name = 'user_notifications' AND index_name = 'uniq_user_broadcast' AND table_schema = DATABASE());
+SET @sql := IF(@exist = 0, 'ALTER TABLE user_notifications ADD UNIQUE INDEX uniq_user_broadcast (user_id, broadcast_key)', 'SELECT "Index already exists"');
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- 4. 广播任务进度
+CREATE TABLE IF NOT EXISTS notification_broadcast_jobs (
+  id CHAR(12) PRIMARY KEY,
+  title VARCHAR(255) NOT NULL,
+  status VARCHAR(20) NOT NULL DEFAULT 'queued',   -- queued, running, done, failed
+  total INT NOT NULL DEFAULT 0,
+  sent INT NOT NULL DEFAULT 0,
+  skipped INT NOT NULL DEFAULT 0,
+  error TEXT NULL,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,  -- 每批写入后更新, 长时间未更新说明任务已中断
+  finished_at TIMESTAMP NULL,
+  INDEX idx_created (created_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+SELECT 'Migration completed successfully!' as status;
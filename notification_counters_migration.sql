@@ -0,0 +1,35 @@
+-- ============================================
+-- VSM Backend Migration: 用户通知计数表
+-- Date: 2026-10-18
+-- 目的: /api/notifications/unread-count 与 /api/notifications 不再对 user_notifications 做 COUNT(*)
+--       main.py 在插入通知、标记已读时同一事务内维护该表
+--       并每 10 分钟按明细核对一次 (VSM_NOTIFICATION_RECONCILE_INTERVAL), 修正应用之外的增删
+-- 需在部署新版 main.py 之前执行; 可重复执行 (回填会按明细重新计算)
+-- ============================================
+
+-- 1. 计数表
+CREATE TABLE IF NOT EXISTS user_notification_counters (
+  user_id INT PRIMARY KEY,
+  unread_count INT NOT NULL DEFAULT 0,
+  total_count INT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- 2. 回填
+INSERT INTO user_notification_counters (user_id, unread_count, total_count)
+SELECT user_id, SUM(is_read = 0), COUNT(*)
+FROM user_notifications
+GROUP BY user_id
+ON DUPLICATE KEY UPDATE
+  unread_count = VALUES(unread_count),
+  total_count = VALUES(total_count);
+
+-- 3. 按用户查未读列表时使用的复合索引
+SET @exist := (SELECT COUNT(*) FROM information_schema.statistics
+  WHERE table_name = 'user_notifications' AND index_name = 'idx_user_read_created' AND table_schema = DATABASE());
+SET @sql := IF(@exist = 0, 'ALTER TABLE user_notifications ADD INDEX idx_user_read_created (user_id, is_read, created_at)', 'SELECT "Index already exists"');
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+SELECT 'Migration completed successfully!' as status;
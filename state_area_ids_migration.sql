@@ -0,0 +1,104 @@
+-- ============================================
+-- VSM Backend Migration: restaurants.state_id / area_id
+-- Date: 2026-10-18
+-- 目的: 用整数外键关联 states/areas, 取代
+--       CAST(s.name AS CHAR CHARACTER SET utf8mb4) = CAST(r.state ...) 这类无法走索引的连接
+-- 需在部署新版 main.py 之前执行 (main.py 已改为 s.id = r.state_id / a.id = r.area_id)
+-- 可重复执行
+-- ============================================
+
+-- 1. 确保 restaurants 有 state_id / area_id 字段
+SET @exist := (SELECT COUNT(*) FROM information_schema.columns
+  WHERE table_name = 'restaurants' AND column_name = 'state_id' AND table_schema = DATABASE());
+SET @sql := IF(@exist = 0, 'ALTER TABLE restaurants ADD COLUMN state_id INT NULL', 'SELECT "Column already exists"');
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+SET @exist := (SELECT COUNT(*) FROM information_schema.columns
+  WHERE table_name = 'restaurants' AND column_name = 'area_id' AND table_schema = DATABASE());
+SET @sql := IF(@exist = 0, 'ALTER TABLE restaurants ADD COLUMN area_id INT NULL', 'SELECT "Column already exists"');
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- 2. 索引
+SET @exist := (SELECT COUNT(*) FROM information_schema.statistics
+  WHERE table_name = 'restaurants' AND column_name = 'state_id' AND table_schema = DATABASE());
+SET @sql := IF(@exist = 0, 'ALTER TABLE restaurants ADD INDEX idx_state_id (state_id)', 'SELECT "Index already exists"');
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+SET @exist := (SELECT COUNT(*) FROM information_schema.statistics
+  WHERE table_name = 'restaurants' AND column_name = 'area_id' AND table_schema = DATABASE());
+SET @sql := IF(@exist = 0, 'ALTER TABLE restaurants ADD INDEX idx_area_id (area_id)', 'SELECT "Index already exists"');
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- 3. 回填 (一次性, 这里用 CAST 比较名称没有问题)
+-- 回填期间不更新 updated_at, 避免所有记录都被内存索引当作变更
+UPDATE restaurants r
+JOIN states s ON CAST(s.name AS CHAR CHARACTER SET utf8mb4) = CAST(r.state AS CHAR CHARACTER SET utf8mb4)
+SET r.state_id = s.id, r.updated_at = r.updated_at
+WHERE r.state_id IS NULL OR r.state_id <> s.id;
+
+-- 地区名可能在不同州重复, 同时匹配州名
+UPDATE restaurants r
+JOIN areas a ON CAST(a.area AS CHAR CHARACTER SET utf8mb4) = CAST(r.area AS CHAR CHARACTER SET utf8mb4)
+            AND CAST(a.state AS CHAR CHARACTER SET utf8mb4) = CAST(r.state AS CHAR CHARACTER SET utf8mb4)
+SET r.area_id = a.id, r.updated_at = r.updated_at
+WHERE r.area_id IS NULL OR r.area_id <> a.id;
+
+-- 州内找不到的地区, 退回只按地区名匹配
+UPDATE restaurants r
+JOIN areas a ON CAST(a.area AS CHAR CHARACTER SET utf8mb4) = CAST(r.area AS CHAR CHARACTER SET utf8mb4)
+SET r.area_id = a.id, r.updated_at = r.updated_at
+WHERE r.area_id IS NULL;
+
+-- 4. 触发器: 通过 Adminer/后台修改 state/area 名称时同步 ID
+DROP TRIGGER IF EXISTS trg_restaurants_location_ins;
+DROP TRIGGER IF EXISTS trg_restaurants_location_upd;
+
+DELIMITER //
+CREATE TRIGGER trg_restaurants_location_ins BEFORE INSERT ON restaurants
+FOR EACH ROW
+BEGIN
+  IF NEW.state IS NOT NULL THEN
+    SET NEW.state_id = (SELECT id FROM states
+      WHERE CAST(name AS CHAR CHARACTER SET utf8mb4) = CAST(NEW.state AS CHAR CHARACTER SET utf8mb4) LIMIT 1);
+  END IF;
+  IF NEW.area IS NOT NULL THEN
+    SET NEW.area_id = COALESCE(
+      (SELECT id FROM areas
+        WHERE CAST(area AS CHAR CHARACTER SET utf8mb4) = CAST(NEW.area AS CHAR CHARACTER SET utf8mb4)
+          AND CAST(state AS CHAR CHARACTER SET utf8mb4) = CAST(NEW.state AS CHAR CHARACTER SET utf8mb4) LIMIT 1),
+      (SELECT id FROM areas
+        WHERE CAST(area AS CHAR CHARACTER SET utf8mb4) = CAST(NEW.area AS CHAR CHARACTER SET utf8mb4) LIMIT 1));
+  END IF;
+END//
+
+CREATE TRIGGER trg_restaurants_location_upd BEFORE UPDATE ON restaurants
+FOR EACH ROW
+BEGIN
+  IF NOT (NEW.state <=> OLD.state) THEN
+    SET NEW.state_id = (SELECT id FROM states
+      WHERE CAST(name AS CHAR CHARACTER SET utf8mb4) = CAST(NEW.state AS CHAR CHARACTER SET utf8mb4) LIMIT 1);
+  END IF;
+  IF NOT (NEW.area <=> OLD.area) OR NOT (NEW.state <=> OLD.state) THEN
+    SET NEW.area_id = COALESCE(
+      (SELECT id FROM areas
+        WHERE CAST(area AS CHAR CHARACTER SET utf8mb4) = CAST(NEW.area AS CHAR CHARACTER SET utf8mb4)
+          AND CAST(state AS CHAR CHARACTER SET utf8mb4) = CAST(NEW.state AS CHAR CHARACTER SET utf8mb4) LIMIT 1),
+      (SELECT id FROM areas
+        WHERE CAST(area AS CHAR CHARACTER SET utf8mb4) = CAST(NEW.area AS CHAR CHARACTER SET utf8mb4) LIMIT 1));
+  END IF;
+END//
+DELIMITER ;
+
+-- 5. 检查: 仍未匹配上的记录
+SELECT COUNT(*) AS missing_state_id FROM restaurants WHERE state IS NOT NULL AND state_id IS NULL;
+SELECT COUNT(*) AS missing_area_id FROM restaurants WHERE area IS NOT NULL AND area_id IS NULL;
+
+SELECT 'Migration completed successfully!' as status;
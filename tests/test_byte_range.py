@@ -0,0 +1,28 @@
+"""Range 请求头解析 (照片/上传文件)"""
+
+import pytest
+
+from main import parse_byte_range
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),          # 后缀长度超过文件大小时取整个文件
+    ("bytes=990-2000", (990, 999)),     # end 越界截断
+    ("BYTES = 0-0", (0, 0)),
+])
+def test_valid_ranges(header, expected):
+    assert parse_byte_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", [
+    None, "", "items=0-1", "bytes=0-1,5-6", "bytes=1000-", "bytes=5-1", "bytes=a-b", "bytes=-",
+])
+def test_unsupported_or_unsatisfiable(header):
+    assert parse_byte_range(header, 1000) is None
+
+
+def test_empty_file():
+    assert parse_byte_range("bytes=0-", 0) is None
@@ -0,0 +1,48 @@
+"""地图聚合 (ClusterIndex) 的建树与视口查询, 不需要数据库"""
+
+from main import CLUSTER_MAX_ZOOM, ClusterIndex
+
+KL = (3.1390, 101.6869)
+PENANG = (5.4141, 100.3288)
+
+
+def row(rid, lat, lng, **extra):
+    return {"id": rid, "location_lat": lat, "location_lng": lng, "name_en": f"R{rid}", **extra}
+
+
+def build(rows):
+    index = ClusterIndex()
+    index._levels = index.build(rows)
+    return index
+
+
+def test_nearby_points_merge_at_low_zoom_and_split_when_zoomed_in():
+    rows = [row(1, *KL), row(2, KL[0] + 0.001, KL[1] + 0.001), row(3, *PENANG)]
+    index = build(rows)
+    _, items = index.query(99, 1, 105, 7, 6)
+    clusters = [i for i in items if i["type"] == "cluster"]
+    points = [i for i in items if i["type"] == "point"]
+    assert len(clusters) == 1 and clusters[0]["count"] == 2
+    assert [p["id"] for p in points] == [3]
+    assert clusters[0]["expansion_zoom"] > 6
+
+    zoom, items = index.query(101, 3, 102, 4, CLUSTER_MAX_ZOOM + 5)
+    assert zoom == CLUSTER_MAX_ZOOM + 1
+    assert sorted(i["id"] for i in items) == [1, 2]
+    assert all(i["type"] == "point" and i["name_en"] for i in items)
+
+
+def test_counts_are_preserved_at_every_zoom():
+    rows = [row(i, KL[0] + i * 0.01, KL[1] + i * 0.01) for i in range(50)]
+    index = build(rows)
+    for zoom in range(0, CLUSTER_MAX_ZOOM + 2):
+        _, items = index.query(-180, -85, 180, 85, zoom)
+        assert sum(i.get("count", 1) for i in items) == 50
+
+
+def test_viewport_filters_points_and_missing_coordinates_are_skipped():
+    index = build([row(1, *KL), row(2, *PENANG), row(3, None, None), row(4, 0, 0)])
+    _, items = index.query(101, 2.5, 102.5, 3.5, CLUSTER_MAX_ZOOM + 1)
+    assert [i["id"] for i in items] == [1]
+    _, items = index.query(-180, -85, 180, 85, CLUSTER_MAX_ZOOM + 1)
+    assert sorted(i["id"] for i in items) == [1, 2]
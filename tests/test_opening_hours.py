@@ -0,0 +1,104 @@
+"""营业时间文本解析 (不需要数据库)"""
+
+from main import (DAY_MINUTES, TIME_SLOT_BITS, WEEK_MINUTES, OpeningHoursIndex, parse_business_hours,
+                  parse_weekdays, parse_working_hours_text, restaurant_intervals, slot_mask, weekly_intervals)
+
+WEEKDAYS = {0, 1, 2, 3, 4}
+
+
+def test_weekday_ranges():
+    assert parse_weekdays("Mon-Fri") == WEEKDAYS
+    assert parse_weekdays("Monday to Friday") == WEEKDAYS
+    assert parse_weekdays("周一至周五") == WEEKDAYS
+    assert parse_weekdays("星期二到星期四") == {1, 2, 3}
+    assert parse_weekdays("Tue – Thu") == {1, 2, 3}
+
+
+def test_weekday_range_wraps_around_week():
+    assert parse_weekdays("Fri-Mon") == {4, 5, 6, 0}
+
+
+def test_weekday_lists_are_not_ranges():
+    assert parse_weekdays("Monday, Wednesday") == {0, 2}
+    assert parse_weekdays("周一、周三") == {0, 2}
+    assert parse_weekdays("weekends") == {5, 6}
+
+
+def test_ranged_days_apply_hours():
+    week, rest = parse_working_hours_text("Mon-Fri 8am to 5pm")
+    assert week == {d: [(8 * 60, 17 * 60)] for d in WEEKDAYS}
+    week, rest = parse_working_hours_text("周一至周五 6:45am-2pm")
+    assert week == {d: [(6 * 60 + 45, 14 * 60)] for d in WEEKDAYS}
+
+
+def test_default_hours_with_day_override_and_rest_day():
+    week, rest = parse_working_hours_text(
+        "Business Hour : 10.30am to 2.30pm , 5.30pm to 8.30pm ; Sunday 8.00am to 1.00pm\nRest day : Monday")
+    assert week[2] == [(10 * 60 + 30, 14 * 60 + 30), (17 * 60 + 30, 20 * 60 + 30)]
+    assert week[6] == [(8 * 60, 13 * 60)]
+    assert rest == {0}
+
+
+def test_hours_past_midnight():
+    week, _ = parse_working_hours_text("6pm to 2am")
+    assert week[0] == [(18 * 60, 26 * 60)]
+
+
+def test_alternate_rest_days_are_ignored():
+    _, rest = parse_working_hours_text("9am to 5pm\nRest day : alternate Monday")
+    assert rest == set()
+
+
+def test_inline_closed_qualifiers_are_rest_days():
+    week, rest = parse_working_hours_text("Open daily 7am to 3pm (closed on Tuesday)")
+    assert week[1] == [(7 * 60, 15 * 60)] and rest == {1}
+    assert parse_working_hours_text("8am-4pm (Closed Mon)")[1] == {0}
+    assert parse_working_hours_text("7am-2pm (Closed Mon, Tue)")[1] == {0, 1}
+    assert parse_working_hours_text("Mon-Sat 9am-5pm, Sun closed")[1] == {6}
+    assert parse_working_hours_text("8.00am to 12.00pm ; 休息星期一 ；初一十五有Laksa")[1] == {0}
+    assert parse_working_hours_text("7am-3pm，每逢星期一&星期二休息")[1] == {0, 1}
+    # 休息说明中的星期不影响前后时间的适用日期
+    week, rest = parse_working_hours_text("9am-5pm (closed Mon), Sat 9am-1pm")
+    assert rest == {0} and week[0] == [(9 * 60, 17 * 60)] and week[5] == [(9 * 60, 13 * 60)]
+
+
+def test_conditional_or_dateless_closures_are_not_rest_days():
+    assert parse_working_hours_text("8.30am to 8.00pm\nOpen daily (Close during CNY)")[1] == set()
+    assert parse_working_hours_text("7am-3pm 若周末有承接宴席必定休息")[1] == set()
+    assert parse_working_hours_text("9am-5pm (closed at 3pm on Sunday)")[1] == set()
+
+
+def test_business_hours_json_formats():
+    assert parse_business_hours({"mon": ["09:00-17:00"], "tue": [["09:00", "17:00"]], "sun": "closed"}) == {
+        0: [(540, 1020)], 1: [(540, 1020)], 6: []}
+    assert parse_business_hours('[{"day": "friday", "open": "10:00", "close": "22:00"}]') == {4: [(600, 1320)]}
+    assert parse_business_hours('{"foo": "bar"}') is None
+
+
+def test_weekly_intervals_wrap_sunday_into_monday():
+    spans = weekly_intervals({6: [(22 * 60, 26 * 60)], 0: [(60, 120)]})
+    assert spans == ((0, 120), (6 * DAY_MINUTES + 22 * 60, WEEK_MINUTES))
+
+
+def test_rest_days_remove_hours():
+    intervals = restaurant_intervals({"working_hours_text": "Daily 9am to 5pm", "rest_days": '["周一"]'})
+    assert len(intervals) == 6 and intervals[0][0] == DAY_MINUTES + 9 * 60
+
+
+def test_slot_mask():
+    lunch = weekly_intervals({d: [(11 * 60, 14 * 60)] for d in range(7)})
+    assert slot_mask(lunch) == TIME_SLOT_BITS["afternoon"]
+    late = weekly_intervals({0: [(21 * 60, 25 * 60)]})
+    assert slot_mask(late) == TIME_SLOT_BITS["evening"] | TIME_SLOT_BITS["night"]
+    assert slot_mask((), '["早上"]') == TIME_SLOT_BITS["morning"]
+
+
+def test_open_at():
+    index = OpeningHoursIndex()
+    index.upsert(1, weekly_intervals({0: [(9 * 60, 17 * 60)]}), 0)
+    index.upsert(2, weekly_intervals({6: [(22 * 60, 26 * 60)]}), 0)
+    index._reindex()
+    assert index.open_at(10 * 60) == {1}
+    assert index.open_at(30) == {2}                          # 周一 00:30, 周日营业到凌晨
+    assert index.open_at(17 * 60) == frozenset()             # 结束时刻不含
+    assert index.open_at(6 * DAY_MINUTES + 23 * 60) == {2}
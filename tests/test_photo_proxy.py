@@ -0,0 +1,156 @@
+"""旧站图片回源代理: 并发合并、LRU 淘汰、上游错误, 以及条件请求/Range 响应"""
+
+import asyncio
+import os
+
+import httpx
+import pytest
+from starlette.testclient import TestClient
+
+import main
+
+
+@pytest.fixture
+def photos(tmp_path, monkeypatch):
+    """原图目录与回源缓存目录都指向临时目录, 上游由 handler 模拟"""
+    originals, cache_dir = tmp_path / "images", tmp_path / "photo_cache"
+    originals.mkdir(); cache_dir.mkdir()
+    monkeypatch.setattr(main, "PHOTO_DIR", str(originals))
+    monkeypatch.setattr(main, "PHOTO_CACHE_DIR", str(cache_dir))
+    monkeypatch.setattr(main, "photo_cache", main.PhotoCache(str(cache_dir), 1 << 20))
+    state = {"calls": [], "handler": lambda request: httpx.Response(200, content=b"jpeg")}
+
+    async def transport(request):
+        state["calls"].append(str(request.url))
+        result = state["handler"](request)
+        return await result if asyncio.iscoroutine(result) else result
+
+    monkeypatch.setattr(main, "photo_client", httpx.AsyncClient(transport=httpx.MockTransport(transport)))
+    state.update(originals=originals, cache_dir=cache_dir)
+    return state
+
+
+def test_concurrent_fetches_share_one_upstream_call(photos):
+    async def slow(request):
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, content=b"jpeg")
+    photos["handler"] = slow
+    path = str(photos["cache_dir"] / "1" / "a.jpg")
+
+    async def run():
+        return await asyncio.gather(*(main.fetch_photo(path, "http://upstream/a.jpg") for _ in range(10)))
+
+    results = asyncio.run(run())
+    assert len(photos["calls"]) == 1
+    assert all(r == results[0] and r[0] == 4 for r in results)
+    assert not main.photo_cache.inflight
+    # 之后命中内存索引, 不再回源
+    asyncio.run(main.fetch_photo(path, "http://upstream/a.jpg"))
+    assert len(photos["calls"]) == 1
+
+
+def test_evicts_least_recently_used_at_byte_cap(photos, monkeypatch):
+    monkeypatch.setattr(main, "photo_cache", main.PhotoCache(str(photos["cache_dir"]), 10))
+    photos["handler"] = lambda request: httpx.Response(200, content=b"x" * 4)
+    paths = [str(photos["cache_dir"] / "1" / f"{name}.jpg") for name in "abc"]
+
+    async def run():
+        await main.fetch_photo(paths[0], "http://upstream/a.jpg")
+        await main.fetch_photo(paths[1], "http://upstream/b.jpg")
+        await main.fetch_photo(paths[0], "http://upstream/a.jpg")   # a 变为最近访问
+        await main.fetch_photo(paths[2], "http://upstream/c.jpg")
+
+    asyncio.run(run())
+    assert main.photo_cache.total_bytes == 8
+    assert os.path.exists(paths[0]) and os.path.exists(paths[2])
+    assert not os.path.exists(paths[1])
+    assert main.photo_cache.get(paths[1]) is None
+
+
+def test_scan_leaves_originals_alone(photos, monkeypatch):
+    original = photos["originals"] / "1" / "orig.jpg"
+    original.parent.mkdir(); original.write_bytes(b"o" * 100)
+    cached = photos["cache_dir"] / "1" / "old.jpg"
+    cached.parent.mkdir(); cached.write_bytes(b"c" * 100)
+    monkeypatch.setattr(main, "photo_cache", main.PhotoCache(main.PHOTO_CACHE_DIR, 10))
+    monkeypatch.setattr(main, "run_in_threadpool", lambda f, *a: asyncio.sleep(0, f(*a)))
+    asyncio.run(main.load_photo_cache_index())
+    assert original.exists()
+    assert main.photo_cache.get(str(original)) is None
+
+
+def test_upstream_404_is_remembered(photos):
+    photos["handler"] = lambda request: httpx.Response(404)
+    path = str(photos["cache_dir"] / "1" / "gone.jpg")
+    assert asyncio.run(main.fetch_photo(path, "http://upstream/gone.jpg")) is None
+    assert asyncio.run(main.fetch_photo(path, "http://upstream/gone.jpg")) is None
+    assert len(photos["calls"]) == 1
+    assert not os.path.exists(path)
+
+
+@pytest.mark.parametrize("handler", [
+    lambda request: httpx.Response(500),
+    lambda request: httpx.Response(200, content=b""),
+])
+def test_upstream_error_is_not_cached(photos, handler):
+    photos["handler"] = handler
+    path = str(photos["cache_dir"] / "1" / "err.jpg")
+    assert asyncio.run(main.fetch_photo(path, "http://upstream/err.jpg")) is None
+    assert asyncio.run(main.fetch_photo(path, "http://upstream/err.jpg")) is None
+    assert len(photos["calls"]) == 2    # 不是 404, 下次请求仍会重试
+    assert not os.path.exists(path) and len(main.photo_cache) == 0
+
+
+def test_upstream_timeout_returns_none(photos):
+    def timeout(request):
+        raise httpx.ReadTimeout("timed out", request=request)
+    photos["handler"] = timeout
+    path = str(photos["cache_dir"] / "1" / "slow.jpg")
+
+    async def run():
+        return await asyncio.gather(*(main.fetch_photo(path, "http://upstream/slow.jpg") for _ in range(3)))
+
+    assert asyncio.run(run()) == [None, None, None]
+    assert not main.photo_cache.inflight and not main.photo_cache.misses.get("http://upstream/slow.jpg")
+
+
+def test_endpoint_serves_original_without_upstream(photos):
+    original = photos["originals"] / "7" / "a.jpg"
+    original.parent.mkdir(); original.write_bytes(b"0123456789")
+    resp = TestClient(main.app).get("/api/photos/7/a.jpg")
+    assert resp.status_code == 200 and resp.content == b"0123456789"
+    assert photos["calls"] == [] and len(main.photo_cache) == 0
+
+
+def test_endpoint_fetches_into_cache_dir(photos):
+    resp = TestClient(main.app).get("/api/photos/7/b.jpg")
+    assert resp.status_code == 200 and resp.content == b"jpeg"
+    assert (photos["cache_dir"] / "7" / "b.jpg").exists()
+    assert not (photos["originals"] / "7").exists()
+
+
+def test_conditional_and_range_responses(photos):
+    original = photos["originals"] / "7" / "a.jpg"
+    original.parent.mkdir(); original.write_bytes(b"0123456789")
+    client = TestClient(main.app)
+    first = client.get("/api/photos/7/a.jpg")
+    etag, last_modified = first.headers["etag"], first.headers["last-modified"]
+
+    assert client.get("/api/photos/7/a.jpg", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/api/photos/7/a.jpg", headers={"If-None-Match": f'"x", {etag}'}).status_code == 304
+    assert client.get("/api/photos/7/a.jpg", headers={"If-Modified-Since": last_modified}).status_code == 304
+    assert client.get("/api/photos/7/a.jpg", headers={"If-None-Match": '"other"'}).status_code == 200
+
+    partial = client.get("/api/photos/7/a.jpg", headers={"Range": "bytes=2-5"})
+    assert partial.status_code == 206 and partial.content == b"2345"
+    assert partial.headers["content-range"] == "bytes 2-5/10"
+    suffix = client.get("/api/photos/7/a.jpg", headers={"Range": "bytes=-3"})
+    assert suffix.status_code == 206 and suffix.content == b"789"
+
+    unsatisfiable = client.get("/api/photos/7/a.jpg", headers={"Range": "bytes=10-"})
+    assert unsatisfiable.status_code == 416
+    assert unsatisfiable.headers["content-range"] == "bytes */10"
+
+    # If-Range 不匹配时忽略 Range, 返回完整文件
+    stale = client.get("/api/photos/7/a.jpg", headers={"Range": "bytes=2-5", "If-Range": '"old"'})
+    assert stale.status_code == 200 and stale.content == b"0123456789"
@@ -0,0 +1,59 @@
+"""内存搜索索引: 与 LIKE '%q%' 语义一致的子串匹配 + 按字段加权排序"""
+
+import pytest
+
+from main import SearchIndex, query_grams, text_grams
+
+
+def restaurant(rid, **fields):
+    row = {"id": rid, "name_zh": None, "name_en": None, "address": None, "recommended_dishes": None,
+           "description": None, "phones": None, "state": "Selangor", "area": None, "recommended": 0}
+    row.update(fields)
+    return row
+
+
+@pytest.fixture
+def index():
+    index = SearchIndex()
+    index.upsert(restaurant(1, name_en="Lotus Vegetarian", address="Jalan Loke Yew"))
+    index.upsert(restaurant(2, name_zh="莲花素食馆", recommended_dishes="素肉骨茶, 咖喱面"))
+    index.upsert(restaurant(3, name_en="Green Cafe", description="Try our lotus root soup",
+                            phones='["03-12345678", "012-3456789"]'))
+    return index
+
+
+def test_grams():
+    assert text_grams("ab c") == {"a", "b", "c", "ab", "b ", " c"}
+    assert query_grams("x") == {"x"}
+    assert query_grams("素食馆") == {"素食", "食馆"}
+
+
+def test_substring_match_ranked_by_field_weight(index):
+    assert [rid for rid, _ in index.search("lotus")] == [1, 3]   # 名称前缀 > 简介
+    assert [rid for rid, _ in index.search("Lotus Vegetarian")][0] == 1
+
+
+def test_chinese_substring_without_segmentation(index):
+    assert [rid for rid, _ in index.search("素食")] == [2]
+    assert [rid for rid, _ in index.search("骨茶")] == [2]
+    assert index.search("素菜") == []
+
+
+def test_phone_digits_match(index):
+    assert [rid for rid, _ in index.search("12345678")] == [3]
+    assert [rid for rid, _ in index.search("012-345")] == [3]   # 第二个号码, 按纯数字匹配
+    assert index.search("5678", fields=("name_en",)) == []
+
+
+def test_fields_limit_and_remove(index):
+    assert [rid for rid, _ in index.search("lotus", fields=("name_en",))] == [1]
+    assert len(index.search("e", limit=2)) == 2
+    index.remove(1)
+    assert [rid for rid, _ in index.search("lotus")] == [3]
+
+
+def test_upsert_replaces_old_text(index):
+    assert index.upsert(restaurant(3, name_en="Blue Cafe")) is True
+    assert index.upsert(restaurant(3, name_en="Blue Cafe")) is False
+    assert index.search("green") == []
+    assert [rid for rid, _ in index.search("blue")] == [3]
@@ -0,0 +1,50 @@
+"""sql_fingerprint: 同一语句不同参数/列表长度应得到同一指纹"""
+
+from main import sql_fingerprint as fp
+
+
+def test_literals_and_placeholders():
+    assert fp("SELECT * FROM r WHERE id = 5 AND name = 'abc'") == "SELECT * FROM r WHERE id = ? AND name = ?"
+    assert fp("SELECT * FROM r WHERE id = %s") == fp("SELECT * FROM r WHERE id = 42")
+
+
+def test_doubled_quote_is_one_literal():
+    assert fp("SELECT 1 FROM r WHERE name = 'it''s'") == "SELECT ? FROM r WHERE name = ?"
+    assert fp('SELECT 1 FROM r WHERE name = "say ""hi"""') == "SELECT ? FROM r WHERE name = ?"
+    assert fp(r"SELECT 1 FROM r WHERE name = 'it\'s'") == "SELECT ? FROM r WHERE name = ?"
+
+
+def test_negative_numbers():
+    assert fp("SELECT * FROM r WHERE a=-5") == "SELECT * FROM r WHERE a=?"
+    assert fp("SELECT * FROM r WHERE lat BETWEEN -3.5 AND -1") == "SELECT * FROM r WHERE lat BETWEEN ? AND ?"
+    assert fp("SELECT * FROM r WHERE a IN (-1, 2)") == "SELECT * FROM r WHERE a IN (?+)"
+    # 减法保留
+    assert fp("SELECT a - 5 FROM r") == "SELECT a - ? FROM r"
+
+
+def test_in_lists_collapse():
+    one = fp("SELECT * FROM r WHERE id IN (1)")
+    assert one == "SELECT * FROM r WHERE id IN (?+)"
+    assert fp("SELECT * FROM r WHERE id IN (1, 2, 3)") == one
+    assert fp("SELECT * FROM r WHERE id IN(%s,%s)") == one
+    assert fp("SELECT * FROM r WHERE id IN ( 'a' , 'b' )") == one
+
+
+def test_field_lists_collapse():
+    a = fp("SELECT * FROM r WHERE r.id IN (1,2,3) ORDER BY FIELD(r.id, 1,2,3)")
+    b = fp("SELECT * FROM r WHERE r.id IN (7,8) ORDER BY FIELD(r.id, 7,8)")
+    assert a == b == "SELECT * FROM r WHERE r.id IN (?+) ORDER BY FIELD(r.id, ?+)"
+
+
+def test_values_rows_collapse():
+    a = fp("INSERT INTO t (a, b) VALUES (%s, %s)")
+    b = fp("INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s), (%s, %s)")
+    assert a == b == "INSERT INTO t (a, b) VALUES (?+)"
+
+
+def test_single_argument_calls_kept():
+    assert fp("SELECT SLEEP(1)") == "SELECT SLEEP(?)"
+
+
+def test_comments_and_whitespace():
+    assert fp("SELECT /* hint */ *\n  FROM r -- trailing\n WHERE id = 1") == "SELECT * FROM r WHERE id = ?"
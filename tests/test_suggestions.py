@@ -0,0 +1,46 @@
+"""自动补全前缀索引 (由内存数据生成, 不需要数据库)"""
+
+import pytest
+
+from main import SuggestionIndex, search_index, suggest_keys
+
+
+def restaurant(name_en, name_zh=None, state="Selangor", area="Petaling Jaya", dishes="", recommended=False):
+    return {"name_en": name_en, "name_zh": name_zh, "state": state, "area": area,
+            "recommended_dishes": dishes, "recommended": recommended}
+
+
+@pytest.fixture
+def build(monkeypatch):
+    def build(metas, areas=()):
+        monkeypatch.setattr(search_index, "meta", {i: m for i, m in enumerate(metas, 1)})
+        monkeypatch.setattr(search_index, "areas", list(areas))
+        index = SuggestionIndex()
+        index.build()
+        return index
+    return build
+
+
+def test_prefix_lookup_ranks_by_type_then_weight(build):
+    index = build(
+        [restaurant("Lotus Garden", recommended=True), restaurant("Lotus Cafe")],
+        [{"area": "Lotus Park", "area_zh": None, "state": "Penang"}])
+    texts = [s["text"] for s in index.lookup("lotus", 10)]
+    assert texts[:2] == ["Lotus Garden", "Lotus Cafe"]
+    assert "Lotus Park" in texts
+
+
+def test_rebuild_replaces_keys_and_entries_together(build, monkeypatch):
+    index = build([restaurant("Alpha")])
+    old = index._data
+    keys, entries = old
+    assert len(keys) == len(entries) and keys == sorted(keys)
+    monkeypatch.setattr(search_index, "meta", {1: restaurant("Beta"), 2: restaurant("Gamma")})
+    index.build()
+    assert index._data is not old and old == (keys, entries)
+    assert [s["text"] for s in index.lookup("gam", 5)] == ["Gamma"]
+    assert index.lookup("alp", 5) == []
+
+
+def test_suggest_keys_cover_words():
+    assert "garden" in suggest_keys("Lotus Garden")
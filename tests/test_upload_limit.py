@@ -0,0 +1,46 @@
+"""/api/upload 请求体大小限制 (超限时不进入数据库/磁盘写入)"""
+
+import pytest
+from starlette.testclient import TestClient
+
+import main
+
+BOUNDARY = "vsm-test-boundary"
+PNG = b"\x89PNG\r\n\x1a\n"
+
+
+def multipart(data):
+    return (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.png\"\r\n"
+            f"Content-Type: image/png\r\n\r\n").encode() + data + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "UPLOAD_MAX_BYTES", 64 * 1024)
+    monkeypatch.setattr(main, "UPLOAD_DIR", str(tmp_path))
+    token = main.create_access_token({"sub": "1", "uid": 1, "role": "user"})
+    c = TestClient(main.app)  # 不进入 lifespan: 启动任务需要数据库
+    c.headers["Authorization"] = f"Bearer {token}"
+    return c
+
+
+def test_content_length_over_limit_is_rejected(client):
+    r = client.post("/api/upload", files={"file": ("a.png", PNG + b"0" * (200 * 1024), "image/png")})
+    assert r.status_code == 413
+
+
+def test_chunked_body_over_limit_is_rejected(client, tmp_path):
+    body = multipart(PNG + b"0" * (200 * 1024))
+    chunks = (body[i:i + 16384] for i in range(0, len(body), 16384))  # 无 Content-Length
+    r = client.post("/api/upload", content=chunks,
+                    headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"})
+    assert r.status_code == 413
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_chunked_body_under_limit_is_stored(client, tmp_path):
+    body = multipart(PNG + b"small")
+    r = client.post("/api/upload", content=iter([body[:10], body[10:]]),
+                    headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"})
+    assert r.status_code == 200
+    assert [p.name for p in tmp_path.iterdir()] == [r.json()["filename"]]